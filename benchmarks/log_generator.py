@@ -0,0 +1,159 @@
+import argparse
+import datetime
+import random
+import sys
+from typing import Iterator, List
+
+from src.log_parsers import MONTH_ABBREVIATIONS
+
+
+class LogGenerator:
+    """Seeded generator of CheckPoint and Huawei firewall log lines mixed with junk lines none of the parsers accepts.
+
+    Lines follow a clock advancing by up to a few seconds per line (as in real syslog files), so that the same seed
+    always produces the same lines.
+    """
+    cp_keys = ['action', 'src', 'dst', 'service', 'proto', 'rule', 'product', 'origin', 'xlatesrc', 's_port', 'i/f_dir',
+               'rule_name', 'service_id', 'layer_name', 'policy_name', 'sequencenum', 'contextnum', 'loguid']
+    cp_values = ['Accept', 'Drop', 'Reject', 'inbound', 'outbound', 'Cleanup rule', 'VPN-1 & FireWall-1', 'x=y', '']
+    hw_events = ['SEC/5/POLICYPERMIT', 'SEC/6/POLICYDENY', 'SHELL/5/CMDRECORD', 'ANTIATTACK/4/ATCKDF',
+                 'SECLOG/6/SESSION_TEARDOWN']
+    hw_params_1_keys = ['vsys', 'protocol', 'source-ip', 'source-port', 'destination-ip', 'destination-port', 'time',
+                        'user', 'source-zone', 'destination-zone', 'application-name', 'rule-name']
+    hw_params_1_values = ['public', '6', '17', 'trust', 'untrust', '"admin"', '"unknown"', 'rule 1']
+    hw_params_2_keys = ['AttackType', 'Interface', 'SrcIP', 'DstIP', 'SrcPort', 'DstPort', 'Count', 'Action']
+    hw_params_2_values = ['Syn flood', 'GE1/0/1', '80', '12', 'discard', '"TCP"']
+    junk_lines = [
+        'last message repeated {} times',
+        'kernel: [{}.000000] eth0: link up',
+        'sshd[{}]: Connection closed by authenticating user root',
+        'CRON[{}]: (root) CMD (run-parts /etc/cron.hourly)',
+        '{} bytes of binary data truncated',
+    ]
+
+    def __init__(self,
+                 seed: int = 0,
+                 junk_ratio: float = 0.05,
+                 hw_ratio: float = 0.5,
+                 start_datetime: datetime.datetime = datetime.datetime(2020, 11, 28)):
+        assert 0 <= junk_ratio <= 1, "Junk ratio has to be between zero and one."
+        assert 0 <= hw_ratio <= 1, "Huawei ratio has to be between zero and one."
+        self.rand = random.Random(seed)
+        self.junk_ratio = junk_ratio
+        self.hw_ratio = hw_ratio
+        self.clock = start_datetime
+
+    def line(self) -> str:
+        """Return next log line (with a trailing newline)."""
+        self.clock += datetime.timedelta(seconds=self.rand.randint(0, 3))
+        if self.rand.random() < self.junk_ratio:
+            return self.junk_line()
+        if self.rand.random() < self.hw_ratio:
+            return self.hw_line()
+        return self.cp_line()
+
+    def lines(self, n: int) -> List[str]:
+        return [self.line() for _ in range(n)]
+
+    def iter_lines(self, byte_size: int) -> Iterator[str]:
+        """Iterate over lines until they add up to at least the given number of bytes."""
+        size = 0
+        while size < byte_size:
+            line = self.line()
+            size += len(line.encode('utf8'))
+            yield line
+
+    def write_file(self, file_path: str, byte_size: int) -> int:
+        """Write lines adding up to at least the given number of bytes to the file, return number of lines."""
+        lines_num = 0
+        with open(file_path, mode='w', encoding='utf8', newline='') as file:
+            for line in self.iter_lines(byte_size):
+                file.write(line)
+                lines_num += 1
+        return lines_num
+
+    def date_base(self) -> str:
+        # syslog timestamp with the day of the month padded with a space (e.g. `Nov  2 01:02:03`)
+        month = MONTH_ABBREVIATIONS[self.clock.month - 1].capitalize()
+        return f'{month} {self.clock.day:>2} {self.clock:%H:%M:%S}'
+
+    def ip(self) -> str:
+        return f'10.{self.rand.randint(0, 3)}.{self.rand.randint(0, 255)}.{self.rand.randint(1, 254)}'
+
+    def cp_line(self) -> str:
+        rand = self.rand
+        params = ' '.join(f'{key}{rand.choice(["", ":"])}="{rand.choice(self.cp_values + [self.ip()])}"'
+                          for key in rand.sample(self.cp_keys, rand.randint(5, len(self.cp_keys))))
+        return f'{self.date_base()} {self.ip()} +01:00 {self.ip()} {params}\n'
+
+    def hw_line(self) -> str:
+        rand = self.rand
+        header = f'{self.date_base()} {self.ip()} {self.clock:%Y-%m-%d %H:%M:%S} FW-{rand.randint(1, 4):02d}'
+        event = f'%%01{rand.choice(self.hw_events)}({rand.choice("lsd")})[{rand.randint(0, 99)}]'
+        if rand.random() < 0.7:
+            params = ', '.join(f'{key}={rand.choice(self.hw_params_1_values + [self.ip()])}'
+                               for key in rand.sample(self.hw_params_1_keys, rand.randint(3, 8)))
+            params += '.'
+        else:
+            params = ' '.join(f'{key}:{rand.choice(self.hw_params_2_values + [self.ip()])};'
+                              for key in rand.sample(self.hw_params_2_keys, rand.randint(3, 6)))
+        return f'{header} {event}:{params}\n'
+
+    def junk_line(self) -> str:
+        return f'{self.date_base()} host {self.rand.choice(self.junk_lines).format(self.rand.randint(1, 99_999))}\n'
+
+
+def main():
+    args = get_args_parser().parse_args(sys.argv[1:])
+    generator = LogGenerator(seed=args.seed, junk_ratio=args.junk_ratio, hw_ratio=args.hw_ratio)
+    lines_num = generator.write_file(args.output, args.size)
+    print(f'Generated {lines_num:,} lines: {args.output}')
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Generates synthetic CheckPoint and Huawei firewall log file (mixed with unparsable junk lines).'
+    )
+    parser.add_argument(
+        'output',
+        help='the path to the generated log file',
+        action='store',
+        type=str
+    )
+    parser.add_argument(
+        '-b', '--size',
+        help='minimum size of the generated file in bytes (defaults to 100`000`000 B or ~100 MB)',
+        metavar='<bytes>',
+        action='store',
+        default=100_000_000,
+        type=int
+    )
+    parser.add_argument(
+        '-j', '--junk-ratio',
+        help='fraction of junk lines none of the parsers accepts (defaults to 0.05)',
+        metavar='<ratio>',
+        action='store',
+        default=0.05,
+        type=float
+    )
+    parser.add_argument(
+        '-w', '--hw-ratio',
+        help='fraction of Huawei lines among the parsable lines (defaults to 0.5)',
+        metavar='<ratio>',
+        action='store',
+        default=0.5,
+        type=float
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        help='random seed of the log generator (defaults to 0)',
+        metavar='<num>',
+        action='store',
+        default=0,
+        type=int
+    )
+    return parser
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import random
+import sys
+from typing import Callable, List
+
+from src.log_parsers import CheckPointLogParser, HuaweiLogParser
+from src.params_tokenizers import tokenize_cp_params, tokenize_hw_params_1, tokenize_hw_params_2
+from src.utils import Timer
+
+
+# equivalence corpus with typical params as well as edge cases of the params grammars
+CP_PARAMS_CORPUS = [
+    'action="Accept" src="10.0.0.1" dst="10.0.0.2" service="443" proto="6"',
+    'time:="1606560000" action:="Drop" i/f_dir:="inbound" rule_name:="Cleanup rule"',
+    'msg="value with \\"escaped\\" quotes" empty="" last="x',
+    'a="1"b="2" c="3"',
+    'key = "spaced" k2=value k3="x=y" k4:="a:=b"',
+    '  leading="space" trailing="space"   ',
+    '="no key" :="colon only"',
+    'no params at all',
+    '',
+]
+HW_PARAMS_1_CORPUS = [
+    'vsys=public, protocol=6, source-ip=10.0.0.1, source-port=1234, destination-ip=10.0.0.2, destination-port=443.',
+    'User="admin", IP=10.0.0.1, Result=success)',
+    'a=1,b="2",c="3".',
+    'key with space=1, (inner=2), x=a,b,c, y=z',
+    '=lead, a==b, c="", d=".',
+    'no terminator=value',
+    'x=1, y="quoted".',
+    '',
+]
+HW_PARAMS_2_CORPUS = [
+    'AttackType:Syn flood; Interface:GE1/0/1; SrcIP:10.0.0.1; Count:12;',
+    'SessionID:"abc"; Info:a:b:c; Empty:;',
+    '(Type:x; y:z;',
+    'Key (bad):1; Good:2;',
+    '[vsys]Name:value; Other:1;',
+    'no:terminator',
+    ';;a:1;',
+    '',
+]
+
+
+def main():
+    args = get_args_parser().parse_args(sys.argv[1:])
+    rand = random.Random(args.seed)
+
+    cp_parser, hw_parser = CheckPointLogParser(), HuaweiLogParser()
+    suites = [
+        ('cp params', lambda p: dict(cp_parser.params_mask.findall('" ' + p.strip())), tokenize_cp_params,
+         CP_PARAMS_CORPUS + [generate_cp_params(rand) for _ in range(args.params)]),
+        ('hw params 1', lambda p: dict(hw_parser.params_mask_1.findall(',' + p.strip())), tokenize_hw_params_1,
+         HW_PARAMS_1_CORPUS + [generate_hw_params_1(rand) for _ in range(args.params)]),
+        ('hw params 2', lambda p: dict(hw_parser.params_mask_2.findall(';' + p.strip())), tokenize_hw_params_2,
+         HW_PARAMS_2_CORPUS + [generate_hw_params_2(rand) for _ in range(args.params)]),
+    ]
+
+    print(f'{"params":<14}{"regex [params/s]":>20}{"scan [params/s]":>20}{"speedup":>10}{"fallbacks":>12}')
+    for name, regex_tokenizer, scan_tokenizer, corpus in suites:
+        fallbacks = check_equivalence(regex_tokenizer, scan_tokenizer, corpus)
+        regex_rate = measure_throughput(regex_tokenizer, corpus)
+        scan_rate = measure_throughput(scan_tokenizer, corpus)
+        print(f'{name:<14}{regex_rate:>20,.0f}{scan_rate:>20,.0f}{scan_rate / regex_rate:>9.2f}x{fallbacks:>12}')
+
+
+def check_equivalence(regex_tokenizer: Callable, scan_tokenizer: Callable, corpus: List[str]) -> int:
+    """Assert that the scan tokenizer returns the same dicts as the regex one, return number of fallbacks."""
+    fallbacks = 0
+    for params_str in corpus:
+        if (params := scan_tokenizer(params_str)) is None:
+            fallbacks += 1
+            continue
+        expected = regex_tokenizer(params_str)
+        assert params == expected, f'Tokenizers differ for `{params_str}`: {params} != {expected}'
+    return fallbacks
+
+
+def measure_throughput(tokenizer: Callable, corpus: List[str]) -> float:
+    with Timer() as timer:
+        for params_str in corpus:
+            tokenizer(params_str)
+    return len(corpus) / max(timer.time, 1e-9)
+
+
+def generate_cp_params(rand: random.Random) -> str:
+    keys = ['action', 'src', 'dst', 'service', 'proto', 'rule', 'product', 'origin', 'xlatesrc', 's_port', 'i/f_dir',
+            'rule_name', 'service_id', 'layer_name', 'policy_name', 'sequencenum', 'contextnum', 'loguid']
+    values = ['Accept', 'Drop', '10.0.0.1', '192.168.12.254', '443', 'Cleanup rule', 'inbound', 'x=y', '']
+    return ' '.join(f'{key}{rand.choice(["", ":"])}="{rand.choice(values)}"'
+                    for key in rand.sample(keys, rand.randint(5, len(keys))))
+
+
+def generate_hw_params_1(rand: random.Random) -> str:
+    keys = ['vsys', 'protocol', 'source-ip', 'source-port', 'destination-ip', 'destination-port', 'time', 'user',
+            'source-zone', 'destination-zone', 'application-name', 'rule-name']
+    values = ['public', '6', '10.0.0.1', '1234', 'trust', '"untrust"', '"unknown"', 'rule 1']
+    params = ', '.join(f'{key}={rand.choice(values)}' for key in rand.sample(keys, rand.randint(3, len(keys))))
+    return params + rand.choice(['.', ')', ''])
+
+
+def generate_hw_params_2(rand: random.Random) -> str:
+    keys = ['AttackType', 'Interface', 'SrcIP', 'DstIP', 'SrcPort', 'DstPort', 'Count', 'Action', 'Protocol']
+    values = ['Syn flood', 'GE1/0/1', '10.0.0.1', '80', '12', 'discard', '"TCP"']
+    return ' '.join(f'{key}:{rand.choice(values)};' for key in rand.sample(keys, rand.randint(3, len(keys))))
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Checks equivalence of params tokenizers with params regexes and benchmarks their throughput.'
+    )
+    parser.add_argument(
+        '-n', '--params',
+        help='number of generated params strings per params grammar (defaults to 100`000)',
+        metavar='<num>',
+        action='store',
+        default=100_000,
+        type=int
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        help='random seed of the params generator (defaults to 0)',
+        metavar='<num>',
+        action='store',
+        default=0,
+        type=int
+    )
+    return parser
+
+
+if __name__ == '__main__':
+    main()
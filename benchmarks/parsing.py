@@ -0,0 +1,261 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Callable, List
+
+from benchmarks.log_generator import LogGenerator
+from src.file_parser import FileParser
+from src.log_parsers import CheckPointLogParser, HuaweiLogParser, PARAMS_TOKENIZERS, TimestampDecoder
+from src.parallel_executor import script_logger
+from src.utils import Timer
+
+
+def main():
+    args = get_args_parser().parse_args(sys.argv[1:])
+    if not args.verbose:
+        script_logger.setLevel(logging.WARNING)
+
+    results = {
+        'environment': get_environment(),
+        'config': vars(args),
+        'micro': run_microbenchmarks(args.lines, args.seed, args.repeat),
+        'end_to_end': run_end_to_end_benchmarks(args.sizes, args.processes, args.chunk_sizes, args.engine,
+                                                args.seed, args.repeat),
+    }
+
+    if args.output:
+        with open(args.output, mode='w', encoding='utf8') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as file:
+            print_comparison(json.load(file), results)
+
+
+def get_environment() -> dict:
+    """Describe the commit and the machine the benchmarks ran on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'datetime': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_microbenchmarks(lines_num: int, seed: int, repeat: int) -> List[dict]:
+    """Measure throughput of parsing single lines, params extraction and timestamp decoding."""
+    generator = LogGenerator(seed=seed, junk_ratio=0)
+    cp_lines = [generator.cp_line() for _ in range(lines_num)]
+    hw_lines = [generator.hw_line() for _ in range(lines_num)]
+    results = []
+
+    for params_tokenizer in PARAMS_TOKENIZERS:
+        cp_parser = CheckPointLogParser(params_tokenizer=params_tokenizer)
+        hw_parser = HuaweiLogParser(params_tokenizer=params_tokenizer)
+        cp_params = [cp_parser.entry_mask.match(line).group(5) for line in cp_lines]
+        hw_params = [hw_parser.entry_mask.match(line).group('params') for line in hw_lines]
+
+        for parser, lines in ((cp_parser, cp_lines), (hw_parser, hw_lines)):
+            results.append(measure(f'parse/{parser.short_name}/{params_tokenizer}', 'lines',
+                                   lambda: [parser.parse(line) for line in lines], len(lines), repeat))
+            results.append(measure(f'parse_batch/{parser.short_name}/{params_tokenizer}', 'lines',
+                                   lambda: parser.parse_batch(lines), len(lines), repeat))
+        results.append(measure(f'params/cp/{params_tokenizer}', 'params',
+                               lambda: [cp_parser._parse_params(p) for p in cp_params], len(cp_params), repeat))
+        results.append(measure(f'params/hw/{params_tokenizer}', 'params',
+                               lambda: [(hw_parser._parse_params_1(p), hw_parser._parse_params_2(p))
+                                        for p in hw_params], len(hw_params), repeat))
+
+    # decode timestamps with a cold cache and with the cache of recently seen timestamps
+    date_bases = [line[:15] for line in cp_lines]
+    timestamp_decoder = TimestampDecoder()
+    results.append(measure('timestamp/uncached', 'timestamps',
+                           lambda: [timestamp_decoder._decode(d) for d in date_bases], len(date_bases), repeat))
+    results.append(measure('timestamp/cached', 'timestamps',
+                           lambda: [timestamp_decoder.decode(d) for d in date_bases], len(date_bases), repeat))
+    return results
+
+
+def run_end_to_end_benchmarks(sizes: List[int],
+                              processes: List[int],
+                              chunk_sizes: List[int],
+                              engine: str,
+                              seed: int,
+                              repeat: int
+                              ) -> List[dict]:
+    """Measure wall time of parsing generated files of each size with each number of processes and chunk size."""
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='parse_benchmark_')
+    try:
+        for size in sizes:
+            src_file_path = os.path.join(work_dir, f'bench_{size}.log')
+            lines_num = LogGenerator(seed=seed).write_file(src_file_path, size)
+            file_size = os.path.getsize(src_file_path)
+
+            for processes_num in processes:
+                for chunk_size in chunk_sizes:
+                    file_parser = FileParser(log_parsers=[HuaweiLogParser, CheckPointLogParser],
+                                             max_processes=processes_num,
+                                             max_threads=1,
+                                             parse_chunk_size=chunk_size,
+                                             engine=engine)
+                    out_dir_path = os.path.join(work_dir, 'out')
+
+                    def parse_file():
+                        shutil.rmtree(out_dir_path, ignore_errors=True)
+                        file_parser.parse_file(src_file_path, out_dir_path)
+                        # parse file logs exceptions instead of raising them
+                        assert os.path.exists(os.path.join(out_dir_path, f'bench_{size}.cp.tsv')), \
+                            f'Parsing of {src_file_path} failed.'
+
+                    result = measure(f'parse_file/{engine}/{size}/{processes_num}/{chunk_size}', 'lines',
+                                     parse_file, lines_num, repeat)
+                    result.update(file_bytes=file_size,
+                                  processes=processes_num,
+                                  chunk_size=chunk_size,
+                                  mb_per_s=file_size / 1_000_000 / result['min_s'])
+                    results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def measure(name: str, unit: str, func: Callable, items_num: int, repeat: int) -> dict:
+    """Time the function a given number of times, report the best and median times and the best throughput."""
+    times = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            func()
+        times.append(timer.time)
+    return {
+        'name': name,
+        'items': items_num,
+        'unit': unit,
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'per_s': items_num / max(min(times), 1e-9),
+    }
+
+
+def print_comparison(baseline: dict, results: dict) -> None:
+    """Print throughput change of each benchmark against the baseline results (to stderr, next to the json)."""
+    baseline_rates = {r['name']: r['per_s'] for r in baseline['micro'] + baseline['end_to_end']}
+    print(f'baseline commit: {baseline["environment"]["commit"]}', file=sys.stderr)
+    print(f'{"benchmark":<48}{"baseline [/s]":>16}{"current [/s]":>16}{"change":>10}', file=sys.stderr)
+    for result in results['micro'] + results['end_to_end']:
+        if (baseline_rate := baseline_rates.get(result['name'])) is None:
+            continue
+        change = result['per_s'] / baseline_rate - 1
+        print(f'{result["name"]:<48}{baseline_rate:>16,.0f}{result["per_s"]:>16,.0f}{change:>+10.1%}', file=sys.stderr)
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v.replace('_', '')) for v in value.split(',')]
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks log parsers (microbenchmarks) and parsing of generated log files (end to end), '
+                    'emits results as json.'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='the path to the json file with results (printed to stdout by default)',
+        metavar='<path>',
+        action='store',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '-b', '--baseline',
+        help='the path to json results of a previous run to compare throughput with',
+        metavar='<path>',
+        action='store',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '-n', '--lines',
+        help='number of generated lines per parser for microbenchmarks (defaults to 20`000)',
+        metavar='<num>',
+        action='store',
+        default=20_000,
+        type=int
+    )
+    parser.add_argument(
+        '-S', '--sizes',
+        help='comma separated sizes of generated files in bytes (defaults to 10`000`000,50`000`000)',
+        metavar='<bytes>',
+        action='store',
+        default=[10_000_000, 50_000_000],
+        type=int_list
+    )
+    parser.add_argument(
+        '-p', '--processes',
+        help='comma separated numbers of processes (defaults to 1,2,4)',
+        metavar='<num>',
+        action='store',
+        default=[1, 2, 4],
+        type=int_list
+    )
+    parser.add_argument(
+        '-c', '--chunk-sizes',
+        help='comma separated chunk sizes in bytes (defaults to 5`000`000,25`000`000)',
+        metavar='<bytes>',
+        action='store',
+        default=[5_000_000, 25_000_000],
+        type=int_list
+    )
+    parser.add_argument(
+        '-e', '--engine',
+        help=f'parsing engine: {", ".join(f"`{e}`" for e in FileParser.engines)} (defaults to `staged`)',
+        metavar='<name>',
+        action='store',
+        default='staged',
+        choices=FileParser.engines,
+        type=str
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        help='number of times each benchmark is repeated (defaults to 3)',
+        metavar='<num>',
+        action='store',
+        default=3,
+        type=int
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        help='random seed of the log generator (defaults to 0)',
+        metavar='<num>',
+        action='store',
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        help='show logs of the file parser',
+        action='store_true',
+        default=False
+    )
+    return parser
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import io
+import random
+import sys
+
+from src.log_parsers import ParsedBatch
+from src.record_formats import RECORD_FORMATS, RecordFormat, msgpack
+from src.utils import Timer
+
+
+class LegacyEvalRecordFormat(RecordFormat):
+    """Previous intermediate record path (`str(record)` per line loaded with `eval`), kept as a baseline."""
+    short_name = 'eval (legacy)'
+    binary = False
+
+    def dump(self, batches, file):
+        for batch in batches:
+            for record in batch.records():
+                file.write(str(record) + '\n')
+
+    def load(self, file):
+        batch = ParsedBatch()
+        for record in map(eval, file.readlines()):
+            batch.append(record.keys(), record.values())
+        yield batch
+
+
+def main():
+    args = get_args_parser().parse_args(sys.argv[1:])
+    records = generate_records(args.records, seed=args.seed)
+
+    print(f'{"format":<16}{"size [MB]":>12}{"dump [rec/s]":>16}{"load [rec/s]":>16}'
+          f'{"dump [MB/s]":>14}{"load [MB/s]":>14}')
+    formats = [LegacyEvalRecordFormat, *(f for f in RECORD_FORMATS.values() if f.short_name != 'msgpack' or msgpack)]
+    for record_format in formats:
+        result = benchmark_record_format(record_format(), records)
+        print(f'{record_format.short_name:<16}'
+              f'{result["size_mb"]:>12.1f}'
+              f'{result["dump_records_per_s"]:>16,.0f}'
+              f'{result["load_records_per_s"]:>16,.0f}'
+              f'{result["dump_mb_per_s"]:>14.1f}'
+              f'{result["load_mb_per_s"]:>14.1f}')
+
+
+def generate_records(n: int, seed: int = 0) -> ParsedBatch:
+    """Generate batch of records resembling the output of CheckPoint log parser."""
+    rand = random.Random(seed)
+    keys = ['action', 'src', 'dst', 'service', 'proto', 'rule', 'product', 'origin', 'xlatesrc', 's_port', 'i/f_dir']
+
+    records = ParsedBatch()
+    for _ in range(n):
+        record = {
+            '_a_timestamp': f'2020112811{rand.randint(0, 59):02d}{rand.randint(0, 59):02d}',
+            '_b_datetime': f'2020-11-28 11:{rand.randint(0, 59):02d}:{rand.randint(0, 59):02d}',
+            '_c_interface_1': f'10.0.{rand.randint(0, 255)}.{rand.randint(0, 255)}',
+            '_d_interface_2': f'10.1.{rand.randint(0, 255)}.{rand.randint(0, 255)}',
+        }
+        for key in rand.sample(keys, rand.randint(4, len(keys))):
+            record[key] = str(rand.randint(0, 65535))
+        records.append(record.keys(), record.values())
+    records.pad()
+    return records
+
+
+def benchmark_record_format(record_format: RecordFormat, records: ParsedBatch) -> dict:
+    """Measure serialization and deserialization throughput of a record format."""
+    file = io.BytesIO() if record_format.binary else io.StringIO()
+    with Timer() as dump_timer:
+        record_format.dump([records], file)
+
+    size_mb = len(file.getvalue()) / 1_000_000
+    file.seek(0)
+    with Timer() as load_timer:
+        loaded = ParsedBatch()
+        for batch in record_format.load(file):
+            loaded.extend(batch)
+    assert list(loaded.records()) == list(records.records()), f'{record_format} does not round trip records.'
+
+    return {
+        'size_mb': size_mb,
+        'dump_records_per_s': len(records) / max(dump_timer.time, 1e-9),
+        'load_records_per_s': len(records) / max(load_timer.time, 1e-9),
+        'dump_mb_per_s': size_mb / max(dump_timer.time, 1e-9),
+        'load_mb_per_s': size_mb / max(load_timer.time, 1e-9),
+    }
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks serialization and deserialization throughput of intermediate record formats.'
+    )
+    parser.add_argument(
+        '-n', '--records',
+        help='number of generated records (defaults to 200`000)',
+        metavar='<num>',
+        action='store',
+        default=200_000,
+        type=int
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        help='random seed of the record generator (defaults to 0)',
+        metavar='<num>',
+        action='store',
+        default=0,
+        type=int
+    )
+    return parser
+
+
+if __name__ == '__main__':
+    main()
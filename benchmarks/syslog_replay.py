@@ -0,0 +1,122 @@
+import argparse
+import socket
+import sys
+import time
+from typing import Iterator, List
+
+from src.distributed import parse_address
+from src.utils import Timer
+
+
+def iter_blocks(file_path: str, priority: int = None, block_size: int = 1_000) -> Iterator[List[bytes]]:
+    """Iterate over blocks of log lines of the file as syslog messages (prefixed with the priority, if any)."""
+    prefix = f'<{priority}>'.encode() if priority is not None else b''
+    with open(file_path, mode='rb') as file:
+        block = []
+        for line in file:
+            if line.strip():
+                block.append(prefix + line.rstrip(b'\r\n') + b'\n')
+            if len(block) >= block_size:
+                yield block
+                block = []
+        if block:
+            yield block
+
+
+def replay(file_path: str,
+           udp_address: tuple = None,
+           tcp_address: tuple = None,
+           rate: float = None,
+           priority: int = None
+           ) -> int:
+    """Send log lines of the file to a syslog server (one datagram per line over UDP, newline delimited over TCP),
+    at most at the given rate of lines per second, and return the number of lines sent."""
+    assert (udp_address is None) != (tcp_address is None), "Logs are replayed either over UDP or over TCP."
+    if tcp_address is not None:
+        sock = socket.create_connection(tcp_address)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # rate limited lines are sent in blocks of about 10ms worth of lines, so that they do not come in bursts
+    block_size = max(1, min(1_000, int(rate / 100))) if rate else 1_000
+    lines_num, start = 0, time.monotonic()
+    with sock:
+        for block in iter_blocks(file_path, priority, block_size):
+            if tcp_address is not None:
+                sock.sendall(b''.join(block))
+            else:
+                for line in block:
+                    sock.sendto(line, udp_address)
+            lines_num += len(block)
+            if rate and (ahead := lines_num / rate - (time.monotonic() - start)) > 0:
+                time.sleep(ahead)
+        if tcp_address is not None:
+            sock.shutdown(socket.SHUT_WR)
+    return lines_num
+
+
+def main():
+    args = get_args_parser().parse_args(sys.argv[1:])
+    with Timer() as timer:
+        lines_num = replay(args.src_file_path,
+                           udp_address=parse_address(args.udp) if args.udp else None,
+                           tcp_address=parse_address(args.tcp) if args.tcp else None,
+                           rate=args.rate,
+                           priority=None if args.no_priority else args.priority)
+    print(f'Sent {lines_num:,} lines in {timer.time_string} ({lines_num / max(timer.time, 1e-9):,.0f} lines/s)')
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(
+        description='Replays log file into a syslog server (`parse.py serve`) as syslog messages.'
+    )
+    parser.add_argument(
+        'src_file_path',
+        metavar='<path>',
+        help='the path to the log file to replay',
+        action='store',
+        type=str
+    )
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument(
+        '-u', '--udp',
+        help='send one datagram per line to a given address',
+        metavar='<host:port>',
+        action='store',
+        default=None,
+        type=str
+    )
+    address.add_argument(
+        '-t', '--tcp',
+        help='send newline delimited lines over a single connection to a given address',
+        metavar='<host:port>',
+        action='store',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '-r', '--rate',
+        help='limit the number of lines sent per second (no limit by default)',
+        metavar='<lines>',
+        action='store',
+        default=None,
+        type=float
+    )
+    parser.add_argument(
+        '-P', '--priority',
+        help='priority the lines are prefixed with (defaults to 134, i.e. local0.info)',
+        metavar='<num>',
+        action='store',
+        default=134,
+        type=int
+    )
+    parser.add_argument(
+        '-n', '--no-priority',
+        help='send lines as they are, without the priority prefix',
+        action='store_true'
+    )
+    return parser
+
+
+if __name__ == '__main__':
+    main()
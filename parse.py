@@ -1,44 +1,171 @@
 import argparse
+import asyncio
+import contextlib
+import datetime
 import multiprocessing
+import os
+import signal
 import sys
+from src.distributed import Coordinator, parse_address, run_workers
 from src.file_parser import FileParser
-from src.log_parsers import HuaweiLogParser, CheckPointLogParser
+from src.log_parsers import HuaweiLogParser, CheckPointLogParser, DEFAULT_YEAR, PARAMS_TOKENIZERS
+from src.output_formats import OUTPUT_FORMATS, lookup_table
+from src.parallel_executor import SCHEDULING_MODES
+from src.record_filters import RecordFilter
+from src.record_formats import RECORD_FORMATS
+from src.syslog_server import SyslogServer
+from src.utils import tsv_writer
 
 
 def main():
-    args_parser = get_args_parser()
-    args = args_parser.parse_args(sys.argv[1:])
+    # `lookup` subcommand reads time ranges of sorted outputs, `worker` subcommand executes tasks of a coordinator,
+    # `serve` subcommand parses logs received over the network, any other arguments are those of log file parsing
+    if sys.argv[1:2] == ['lookup']:
+        command, args = lookup, get_lookup_args_parser().parse_args(sys.argv[2:])
+    elif sys.argv[1:2] == ['worker']:
+        command, args = worker, get_worker_args_parser().parse_args(sys.argv[2:])
+    elif sys.argv[1:2] == ['serve']:
+        command, args = serve, get_serve_args_parser().parse_args(sys.argv[2:])
+    else:
+        command, args = init, get_args_parser().parse_args(sys.argv[1:])
     try:
-        init(args)
+        command(args)
     except KeyboardInterrupt:
         sys.exit(0)
 
 
 def init(args):
+    coordinator = None
+    if args.coordinate is not None:
+        assert args.authkey, 'Coordinator requires an authentication key (`--authkey` or `PARSE_AUTHKEY` variable)'
+        coordinator = Coordinator(address=parse_address(args.coordinate), authkey=args.authkey.encode())
     fp = FileParser(
         log_parsers=[HuaweiLogParser, CheckPointLogParser],
         max_processes=args.max_processes,
         max_threads=args.max_threads,
         parse_chunk_size=args.chunk_size,
-        delete_intermediate_result_dirs=(not args.preserve_intermediate_results)
+        delete_intermediate_result_dirs=(not args.preserve_intermediate_results),
+        zero_copy_chunking=args.zero_copy_chunking,
+        engine=args.engine,
+        record_format=RECORD_FORMATS[args.record_format],
+        adaptive_parser_order=(not args.fixed_parser_order),
+        log_parser_kwargs=dict(year=args.year, params_tokenizer=args.params_tokenizer),
+        output_format=OUTPUT_FORMATS[args.output_format],
+        scheduling=args.scheduling,
+        result_transport=args.result_transport,
+        profile=args.profile,
+        max_worker_memory=args.max_worker_memory,
+        record_filter=get_record_filter(args),
+        sort_output=args.sort_output,
+        coordinator=coordinator,
+        partition_output=args.partition_output
     )
-    fp.parse_file(
-        src_file_path=args.src_file_path,
-        out_dir_path=args.out_dir_path
+    many_files = len(args.src_paths) > 1 or not os.path.isfile(args.src_paths[0])
+    assert not (many_files and (args.incremental or args.follow is not None)), \
+        'Only a single source file can be parsed incrementally'
+    with coordinator or contextlib.nullcontext():
+        if many_files:
+            fp.parse_files(
+                src_paths=args.src_paths,
+                out_dir_path=args.out_dir_path
+            )
+        elif args.follow is not None:
+            # keep worker processes (and log parsers built by them) alive between incremental runs
+            with fp.persistent_pool():
+                fp.follow_file(
+                    src_file_path=args.src_paths[0],
+                    out_dir_path=args.out_dir_path,
+                    interval=args.follow
+                )
+        else:
+            fp.parse_file(
+                src_file_path=args.src_paths[0],
+                out_dir_path=args.out_dir_path,
+                incremental=args.incremental
+            )
+
+
+def worker(args):
+    assert args.authkey, 'Worker requires an authentication key (`--authkey` or `PARSE_AUTHKEY` variable)'
+    run_workers(
+        address=parse_address(args.address),
+        authkey=args.authkey.encode(),
+        processes_num=args.processes,
+        connect_timeout=args.wait
+    )
+
+
+def serve(args):
+    assert args.udp or args.tcp, 'Server has to listen on UDP (`--udp`) or TCP (`--tcp`) address'
+    server = SyslogServer(
+        log_parsers=[HuaweiLogParser, CheckPointLogParser],
+        out_dir_path=args.out_dir_path,
+        udp_address=parse_address(args.udp) if args.udp else None,
+        tcp_address=parse_address(args.tcp) if args.tcp else None,
+        max_processes=args.max_processes,
+        batch_size=args.batch_size,
+        batch_interval=args.batch_interval,
+        max_pending_batches=args.max_pending_batches,
+        roll_size=args.roll_size,
+        roll_interval=args.roll_interval,
+        output_format=OUTPUT_FORMATS[args.output_format],
+        log_parser_kwargs=dict(year=args.year, params_tokenizer=args.params_tokenizer),
+        adaptive_parser_order=(not args.fixed_parser_order),
+        report_interval=args.report_interval
+    )
+
+    async def serve_until_signalled():
+        # write out logs received so far before exiting
+        loop = asyncio.get_running_loop()
+        for signal_num in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_num, server.stop)
+        await server.serve()
+
+    asyncio.run(serve_until_signalled())
+
+
+def lookup(args):
+    headers, rows = lookup_table(args.table_path, start=args.since, end=args.until)
+    out_file = open(args.output, mode='w', encoding='utf8', newline='') if args.output else sys.stdout
+    try:
+        writer = tsv_writer(out_file)
+        writer.writerow(headers)
+        writer.writerows(rows)
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+
+
+def get_record_filter(args):
+    if not any((args.fields, args.parsers, args.since, args.until, args.event_names)):
+        return None
+    return RecordFilter(
+        fields=args.fields,
+        parsers=args.parsers,
+        start=args.since,
+        end=args.until,
+        event_names=args.event_names
     )
 
 
+def comma_separated_list(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
 def get_args_parser():
     parser = argparse.ArgumentParser(
-        description='Parses log file under specified path and saves the results in a tabular format in a directory '
-                    'named after the source file (appended with timestamp).'
+        description='Parses log file under specified path (or many log files) and saves the results in a tabular '
+                    'format in a directory named after the source file (appended with timestamp).'
     )
     parser.add_argument(
-        'src_file_path',
+        'src_paths',
         metavar='<path>',
         action='store',
+        nargs='+',
         type=str,
-        help='the path to the source file with logs'
+        help='the path to the source file with logs (plain, `.gz` compressed or `.zst` compressed, the latter '
+             'requiring `zstandard` package), or many paths, glob patterns and directories (searched recursively) '
+             'parsed in a single run into one set of outputs with a `_z_source_file` column'
     )
     parser.add_argument(
         '-o', '--out-dir-path',
@@ -77,6 +204,401 @@ def get_args_parser():
         help='do not delete temporary directories with intermediate results created during parsing process',
         action='store_true'
     )
+    parser.add_argument(
+        '-z', '--zero-copy-chunking',
+        help='do not split source file into chunk files, parse newline aligned byte ranges of the source file in place',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-e', '--engine',
+        help='parsing engine: `staged` runs separate split/parse/tabularize/merge stages, `streaming` parses byte '
+             'ranges of the source file and streams rows straight into parts of the final outputs (defaults to '
+             '`staged`)',
+        metavar='<name>',
+        action='store',
+        default='staged',
+        choices=FileParser.engines,
+        type=str
+    )
+    parser.add_argument(
+        '-r', '--record-format',
+        help='format of intermediate files with parsed records (defaults to `pickle`)',
+        metavar='<name>',
+        action='store',
+        default='pickle',
+        choices=list(RECORD_FORMATS),
+        type=str
+    )
+    parser.add_argument(
+        '-f', '--fixed-parser-order',
+        help='always try log parsers in the predefined order instead of trying the most frequently hit parser first',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-y', '--year',
+        help=f'year of the logs, as syslog timestamps do not include it (defaults to {DEFAULT_YEAR})',
+        metavar='<year>',
+        action='store',
+        default=DEFAULT_YEAR,
+        type=int
+    )
+    parser.add_argument(
+        '-k', '--params-tokenizer',
+        help='log params extraction method: `regex` uses params regexes, `scan` uses equivalent linear time '
+             'tokenizers (defaults to `regex`)',
+        metavar='<name>',
+        action='store',
+        default='regex',
+        choices=PARAMS_TOKENIZERS,
+        type=str
+    )
+    parser.add_argument(
+        '-w', '--output-format',
+        help='format of the final output tables: `tsv` writes quoted text columns, `parquet` writes compressed typed '
+             'columns and requires `pyarrow` package (defaults to `tsv`)',
+        metavar='<name>',
+        action='store',
+        default='tsv',
+        choices=list(OUTPUT_FORMATS),
+        type=str
+    )
+    parser.add_argument(
+        '-s', '--scheduling',
+        help='task scheduling: `static` spreads tasks over processes up front, `dynamic` hands out tasks (the largest '
+             'first) to whichever process is free (defaults to `static`)',
+        metavar='<name>',
+        action='store',
+        default='static',
+        choices=SCHEDULING_MODES,
+        type=str
+    )
+    parser.add_argument(
+        '-m', '--result-transport',
+        help='how workers of the `staged` engine return parsed chunks: `files` saves them as intermediate files, '
+             '`memory` sends chunks of up to 250`000 records straight back to the main process (defaults to `files`)',
+        metavar='<name>',
+        action='store',
+        default='files',
+        choices=FileParser.result_transports,
+        type=str
+    )
+    parser.add_argument(
+        '-u', '--incremental',
+        help='parse only logs appended to the source file since the previous incremental run and append them to its '
+             'outputs (the output directory defaults to the source file name appended with `_incremental`)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-F', '--follow',
+        help='keep parsing logs appended to the source file incrementally every given number of seconds',
+        metavar='<seconds>',
+        action='store',
+        default=None,
+        type=float
+    )
+    parser.add_argument(
+        '-M', '--max-worker-memory',
+        help='limit the memory each worker process of the `staged` engine may use for parsed logs of a chunk before '
+             'flushing them to intermediate files (no limit by default, so whole chunks are kept in memory)',
+        metavar='<bytes>',
+        action='store',
+        default=None,
+        type=int
+    )
+    parser.add_argument(
+        '-P', '--profile',
+        help='profile each stage and each task of the workers (with cProfile and tracemalloc) and save a report with '
+             'wall time and peak memory of the workers and the top functions of each stage next to the outputs',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-l', '--fields',
+        help='comma separated fields (entry fields like `_b_datetime` or param keys) to output, params are not '
+             'extracted at all when only entry fields are selected (all fields by default)',
+        metavar='<names>',
+        action='store',
+        default=None,
+        type=comma_separated_list
+    )
+    parser.add_argument(
+        '-a', '--parsers',
+        help='comma separated short names of parsers whose records are output (logs of the other parsers are '
+             'recognized and dropped instead of ending up unparsed)',
+        metavar='<names>',
+        action='store',
+        default=None,
+        type=comma_separated_list
+    )
+    parser.add_argument(
+        '-S', '--since',
+        help='output only records logged at or after a given datetime (e.g. `2020-11-28 10:00:00`)',
+        metavar='<datetime>',
+        action='store',
+        default=None,
+        type=datetime.datetime.fromisoformat
+    )
+    parser.add_argument(
+        '-U', '--until',
+        help='output only records logged before a given datetime (e.g. `2020-11-28 12:00:00`)',
+        metavar='<datetime>',
+        action='store',
+        default=None,
+        type=datetime.datetime.fromisoformat
+    )
+    parser.add_argument(
+        '-E', '--event-names',
+        help='comma separated event names of records to output (e.g. `SEC/5/POLICYPERMIT`), records of parsers '
+             'without event names are dropped',
+        metavar='<names>',
+        action='store',
+        default=None,
+        type=comma_separated_list
+    )
+    parser.add_argument(
+        '-D', '--coordinate',
+        help='hand out parallel tasks to `parse.py worker` processes (possibly on other hosts, seeing the source file '
+             'and the output directory under the same paths) connecting to a given address instead of local '
+             'processes, reassigning tasks of workers that die',
+        metavar='<host:port>',
+        action='store',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '-K', '--authkey',
+        help='authentication key shared by the coordinator and its workers (defaults to `PARSE_AUTHKEY` variable)',
+        metavar='<key>',
+        action='store',
+        default=os.environ.get('PARSE_AUTHKEY'),
+        type=str
+    )
+    parser.add_argument(
+        '-O', '--sort-output',
+        help='sort output tables by `_a_timestamp` (merging sorted chunks in parallel) and save a sidecar index next '
+             'to each of them for `lookup` of time ranges (requires the `staged` engine with `files` result transport)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-L', '--partition-output',
+        help='write outputs as hive style partitions (`parser=hw/date=2020-11-28/event=<name>/part-N`), each chunk '
+             'writing its own parts without merging them into single tables (requires the `staged` engine with '
+             '`files` result transport)',
+        action='store_true'
+    )
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.epilog = 'authors:\n  Mateusz Wolski (github.com/WolskiDev)'
+
+    return parser
+
+
+def get_worker_args_parser():
+    parser = argparse.ArgumentParser(
+        prog='parse.py worker',
+        description='Connects to a coordinator (`parse.py --coordinate`) and executes parsing tasks it hands out '
+                    'until it is done.'
+    )
+    parser.add_argument(
+        'address',
+        metavar='<host:port>',
+        action='store',
+        type=str,
+        help='the address of the coordinator'
+    )
+    parser.add_argument(
+        '-p', '--processes',
+        help='number of worker processes connecting to the coordinator (defaults to one)',
+        metavar='<num>',
+        action='store',
+        default=1,
+        type=int
+    )
+    parser.add_argument(
+        '-K', '--authkey',
+        help='authentication key shared by the coordinator and its workers (defaults to `PARSE_AUTHKEY` variable)',
+        metavar='<key>',
+        action='store',
+        default=os.environ.get('PARSE_AUTHKEY'),
+        type=str
+    )
+    parser.add_argument(
+        '-W', '--wait',
+        help='keep trying to connect to the coordinator for a given number of seconds (defaults to 60)',
+        metavar='<seconds>',
+        action='store',
+        default=60.0,
+        type=float
+    )
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.epilog = 'authors:\n  Mateusz Wolski (github.com/WolskiDev)'
+
+    return parser
+
+
+def get_serve_args_parser():
+    parser = argparse.ArgumentParser(
+        prog='parse.py serve',
+        description='Receives syslog messages over UDP and/or TCP, parses them in micro-batches and writes them into '
+                    'rolling output tables in a directory (until interrupted).'
+    )
+    parser.add_argument(
+        'out_dir_path',
+        metavar='<dir>',
+        action='store',
+        type=str,
+        help='the path to the output directory (created if it does not exist)'
+    )
+    parser.add_argument(
+        '-u', '--udp',
+        help='listen for syslog messages (one per datagram) on a given address',
+        metavar='<host:port>',
+        action='store',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '-t', '--tcp',
+        help='listen for newline delimited syslog messages on a given address',
+        metavar='<host:port>',
+        action='store',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '-p', '--max-processes',
+        help='limit the maximum number of spawned processes (defaults to the number of CPUs in the system minus one)',
+        metavar='<num>',
+        action='store',
+        default=multiprocessing.cpu_count() - 1,
+        type=int
+    )
+    parser.add_argument(
+        '-b', '--batch-size',
+        help='parse received lines in batches of a given number of lines (defaults to 10`000)',
+        metavar='<lines>',
+        action='store',
+        default=10_000,
+        type=int
+    )
+    parser.add_argument(
+        '-B', '--batch-interval',
+        help='parse received lines at least every given number of seconds, even if the batch is not full (defaults '
+             'to 1)',
+        metavar='<seconds>',
+        action='store',
+        default=1.0,
+        type=float
+    )
+    parser.add_argument(
+        '-q', '--max-pending-batches',
+        help='limit the number of batches being parsed or written, before TCP connections are no longer read from '
+             'and UDP messages are dropped (defaults to twice the number of processes)',
+        metavar='<num>',
+        action='store',
+        default=None,
+        type=int
+    )
+    parser.add_argument(
+        '-R', '--roll-size',
+        help='roll output tables over to new files once they reach a given size (defaults to 100`000`000 B or '
+             '~100 MB)',
+        metavar='<bytes>',
+        action='store',
+        default=100_000_000,
+        type=int
+    )
+    parser.add_argument(
+        '-I', '--roll-interval',
+        help='roll output tables over to new files at least every given number of seconds (defaults to 3600)',
+        metavar='<seconds>',
+        action='store',
+        default=3600.0,
+        type=float
+    )
+    parser.add_argument(
+        '-w', '--output-format',
+        help='format of the output tables: `tsv` writes quoted text columns, `parquet` writes compressed typed '
+             'columns and requires `pyarrow` package (defaults to `tsv`)',
+        metavar='<name>',
+        action='store',
+        default='tsv',
+        choices=list(OUTPUT_FORMATS),
+        type=str
+    )
+    parser.add_argument(
+        '-y', '--year',
+        help=f'year of the logs, as syslog timestamps do not include it (defaults to {DEFAULT_YEAR})',
+        metavar='<year>',
+        action='store',
+        default=DEFAULT_YEAR,
+        type=int
+    )
+    parser.add_argument(
+        '-k', '--params-tokenizer',
+        help='log params extraction method: `regex` uses params regexes, `scan` uses equivalent linear time '
+             'tokenizers (defaults to `regex`)',
+        metavar='<name>',
+        action='store',
+        default='regex',
+        choices=PARAMS_TOKENIZERS,
+        type=str
+    )
+    parser.add_argument(
+        '-f', '--fixed-parser-order',
+        help='always try log parsers in the predefined order instead of trying the most frequently hit parser first',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-r', '--report-interval',
+        help='log numbers of received lines and percentiles of their latency (from receiving a line to writing it) '
+             'every given number of seconds (defaults to 10)',
+        metavar='<seconds>',
+        action='store',
+        default=10.0,
+        type=float
+    )
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.epilog = 'authors:\n  Mateusz Wolski (github.com/WolskiDev)'
+
+    return parser
+
+
+def get_lookup_args_parser():
+    parser = argparse.ArgumentParser(
+        prog='parse.py lookup',
+        description='Prints rows of a sorted output table logged within a time range as tsv, seeking straight to the '
+                    'range with the sidecar index of the table.'
+    )
+    parser.add_argument(
+        'table_path',
+        metavar='<path>',
+        action='store',
+        type=str,
+        help='the path to the output table parsed with `--sort-output`'
+    )
+    parser.add_argument(
+        '-S', '--since',
+        help='print only rows logged at or after a given datetime (e.g. `2020-11-28 02:00:00`)',
+        metavar='<datetime>',
+        action='store',
+        default=None,
+        type=datetime.datetime.fromisoformat
+    )
+    parser.add_argument(
+        '-U', '--until',
+        help='print only rows logged before a given datetime (e.g. `2020-11-28 02:15:00`)',
+        metavar='<datetime>',
+        action='store',
+        default=None,
+        type=datetime.datetime.fromisoformat
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='the path to the tsv file with the rows (printed to stdout by default)',
+        metavar='<path>',
+        action='store',
+        default=None,
+        type=str
+    )
     parser.formatter_class = argparse.RawDescriptionHelpFormatter
     parser.epilog = 'authors:\n  Mateusz Wolski (github.com/WolskiDev)'
 
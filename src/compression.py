@@ -0,0 +1,253 @@
+"""Reading compressed log files in independently decodable byte ranges.
+
+Gzip files may consist of many members (e.g. files written by `bgzip` or appended with `cat`) and zstd files of many
+frames, each of which can be decompressed on its own. Byte ranges of such files are planned on member boundaries, so
+that every range can be decompressed by a separate worker. Member boundaries rarely match line boundaries, so each
+range (but the first one) starts with the last member of the previous range, which is decompressed only to find out
+whether the range starts in the middle of a line, and each range is read past its end until its last line ends.
+"""
+import os
+import struct
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_EXTENSIONS: Dict[str, str] = {'.gz': 'gzip', '.zst': 'zstd'}
+
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_DEFLATE_HEADER = GZIP_MAGIC + b'\x08'  # magic followed by the deflate compression method
+GZIP_FLAG_EXTRA = 0x04
+ZSTD_MAGIC = 0xFD2FB528
+ZSTD_SKIPPABLE_MAGIC_MASK = 0xFFFFFFF0
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+
+
+def get_compression(file_path: str) -> Optional[str]:
+    """Return compression of the file based on its extension (or none for plain files)."""
+    compression = COMPRESSION_EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+    assert compression != 'zstd' or zstandard is not None, \
+        "Reading zstd compressed files requires `zstandard` package to be installed."
+    return compression
+
+
+def strip_compression_ext(file_path: str) -> str:
+    """Return file path without the compression extension (e.g. `x.log` for `x.log.gz`)."""
+    file_path_base, file_ext = os.path.splitext(file_path)
+    return file_path_base if file_ext.lower() in COMPRESSION_EXTENSIONS else file_path
+
+
+def plan_compressed_file_ranges(file_path: str, chunk_byte_size: int, compression: str) -> List[Tuple[int, int]]:
+    """Split compressed file into (offset, length) byte ranges of roughly the given size, starting on member
+    boundaries (every range but the first one also covers the last member of the previous range)."""
+    assert int(chunk_byte_size) > 0, "Chunk size has to be greater than zero."
+    file_size = os.path.getsize(file_path)
+    if file_size <= chunk_byte_size:
+        return [(0, file_size)] if file_size > 0 else []
+    if compression == 'zstd':
+        with open(file_path, mode='rb') as file:
+            member_offsets = _find_zstd_frames(file)
+    else:
+        member_offsets = _find_gzip_members(file_path)
+
+    # group members into ranges of at least the given size (the second member never starts a range, as only ranges
+    # starting past the beginning of the file are read with the previous member)
+    previous_member_offsets = dict(zip(member_offsets[1:], member_offsets))
+    range_starts = [0]
+    for member_offset in member_offsets[2:]:
+        if member_offset - range_starts[-1] >= chunk_byte_size:
+            range_starts.append(member_offset)
+
+    # step each range back by one member (the last one of the previous range)
+    ranges = []
+    for range_start, range_end in zip(range_starts, [*range_starts[1:], file_size]):
+        if range_start > 0:
+            range_start = previous_member_offsets[range_start]
+        ranges.append((range_start, range_end - range_start))
+
+    return ranges if file_size > 0 else []
+
+
+def read_compressed_file_range(file_path: str,
+                               compression: str,
+                               offset: int = 0,
+                               length: int = None,
+                               encoding: str = 'utf8'
+                               ) -> Iterator[str]:
+    """Iterate over decoded lines of the compressed file starting within specified byte range (planned with
+    `plan_compressed_file_ranges`)."""
+    end = os.path.getsize(file_path) if length is None else offset + length
+    in_lookbehind = offset > 0
+    skip_first_line = False
+    last_byte = b''
+    pending = b''
+
+    for member_offset, data, member_end in _iter_members(file_path, offset, compression):
+        # decompress the last member of the previous range only to check whether it ends with a whole line
+        if in_lookbehind:
+            last_byte = data[-1:] or last_byte
+            if member_end:
+                in_lookbehind = False
+                skip_first_line = last_byte != b'\n'
+            continue
+
+        # read members of the next range only until the last line of this range ends
+        if member_offset >= end:
+            if not pending:
+                return
+            if (idx := data.find(b'\n')) != -1:
+                yield (pending + data[:idx + 1]).decode(encoding, errors='replace')
+                return
+            pending += data
+            continue
+
+        # skip the line started in the previous range
+        if skip_first_line:
+            if (idx := data.find(b'\n')) == -1:
+                continue
+            data = data[idx + 1:]
+            skip_first_line = False
+
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield (line + b'\n').decode(encoding, errors='replace')
+
+    if pending:
+        yield pending.decode(encoding, errors='replace')
+
+
+def _iter_members(file_path: str,
+                  offset: int,
+                  compression: str,
+                  read_size: int = 1_048_576
+                  ) -> Iterator[Tuple[int, bytes, bool]]:
+    # yield (member offset, decompressed data, end of member flag) for consecutive members starting at the offset
+    with open(file_path, mode='rb') as file:
+        file.seek(offset)
+        buffer = b''
+        decompressor = None
+        member_offset = offset
+        while True:
+            if len(buffer) < 8 and (data := file.read(read_size)):
+                buffer += data
+            if not buffer:
+                if decompressor is not None:
+                    raise EOFError(f'Compressed file ended in the middle of a member starting at byte {member_offset}')
+                return
+
+            # skip padding between members (zeros after gzip members, skippable zstd frames)
+            if decompressor is None:
+                if padding_size := _padding_size(buffer, compression):
+                    if padding_size > len(buffer):
+                        file.seek(padding_size - len(buffer), os.SEEK_CUR)
+                        padding_size = len(buffer)
+                    buffer = buffer[padding_size:]
+                    continue
+                member_offset = file.tell() - len(buffer)
+                decompressor = _new_decompressor(compression)
+
+            data = decompressor.decompress(buffer)
+            if decompressor.eof:
+                buffer = decompressor.unused_data
+                decompressor = None
+                yield member_offset, data, True
+            else:
+                buffer = b''
+                yield member_offset, data, False
+
+
+def _new_decompressor(compression: str):
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+
+def _padding_size(buffer: bytes, compression: str) -> int:
+    if compression == 'zstd':
+        if len(buffer) >= 8 and struct.unpack_from('<I', buffer)[0] & ZSTD_SKIPPABLE_MAGIC_MASK == ZSTD_SKIPPABLE_MAGIC:
+            return 8 + struct.unpack_from('<I', buffer, 4)[0]
+        return 0
+    return len(buffer) - len(buffer.lstrip(b'\x00'))
+
+
+def _find_gzip_members(file_path: str) -> List[int]:
+    # bgzip files store the size of each member in its header, so members can be found without decompression, while
+    # files without a single member header past the first one (i.e. plain gzip files) consist of a single member
+    with open(file_path, mode='rb') as file:
+        if (member_offsets := _find_bgzf_members(file)) is not None:
+            return member_offsets
+        if not _has_gzip_header_past_start(file):
+            return [0]
+
+    # otherwise decompress the file once (discarding the output) to find where each member starts
+    member_offsets = []
+    for member_offset, _, _ in _iter_members(file_path, 0, 'gzip'):
+        if not member_offsets or member_offsets[-1] != member_offset:
+            member_offsets.append(member_offset)
+    return member_offsets
+
+
+def _find_bgzf_members(file: BinaryIO) -> Optional[List[int]]:
+    member_offsets = []
+    file_size = file.seek(0, os.SEEK_END)
+    offset = 0
+    while offset < file_size:
+        file.seek(offset)
+        header = file.read(18)
+        if len(header) < 18 or header[:2] != GZIP_MAGIC or not header[3] & GZIP_FLAG_EXTRA \
+                or header[12:14] != b'BC' or struct.unpack_from('<H', header, 14)[0] != 2:
+            return None
+        member_offsets.append(offset)
+        offset += struct.unpack_from('<H', header, 16)[0] + 1
+    return member_offsets
+
+
+def _has_gzip_header_past_start(file: BinaryIO, block_size: int = 1 << 20) -> bool:
+    # look for bytes of a member header anywhere past the first header (compressed data may contain them by chance,
+    # but every member header past the first one is found)
+    file.seek(1)
+    tail = b''
+    while block := file.read(block_size):
+        if (tail + block).find(GZIP_DEFLATE_HEADER) >= 0:
+            return True
+        tail = block[-(len(GZIP_DEFLATE_HEADER) - 1):]
+    return False
+
+
+def _find_zstd_frames(file: BinaryIO) -> List[int]:
+    # walk frame and block headers (sizes of compressed blocks are stored in their headers)
+    frame_offsets = []
+    file_size = file.seek(0, os.SEEK_END)
+    offset = 0
+    while offset < file_size:
+        file.seek(offset)
+        header = file.read(14)
+        magic = struct.unpack_from('<I', header)[0]
+        if magic & ZSTD_SKIPPABLE_MAGIC_MASK == ZSTD_SKIPPABLE_MAGIC:
+            offset += 8 + struct.unpack_from('<I', header, 4)[0]
+            continue
+        assert magic == ZSTD_MAGIC, f'Invalid zstd frame at byte {offset}.'
+        frame_offsets.append(offset)
+
+        # frame header: descriptor, optional window descriptor, dictionary id and frame content size
+        descriptor = header[4]
+        single_segment = bool(descriptor & 0x20)
+        fcs_size = (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+        offset += 5 + (0 if single_segment else 1) + (0, 1, 2, 4)[descriptor & 0x03] + fcs_size
+
+        # blocks: 3 byte header with last block flag, block type and block size
+        while True:
+            file.seek(offset)
+            block_header = int.from_bytes(file.read(3), 'little')
+            block_type, block_size = (block_header >> 1) & 0x03, block_header >> 3
+            offset += 3 + (1 if block_type == 1 else block_size)
+            if block_header & 0x01:
+                break
+        offset += 4 if descriptor & 0x04 else 0
+
+    return frame_offsets
@@ -0,0 +1,389 @@
+"""Distributed execution of parallel tasks by worker processes connected over sockets (possibly from other hosts).
+
+Coordinator hands out tasks one at a time to whichever connected worker is free and reassigns tasks of workers that
+disconnect or stop sending heartbeats. Tasks are pickled along with their executor, so workers have to run the same
+code and see files under the same paths (e.g. on shared storage). Only peers authenticated with the shared key are
+exchanging pickles, which are still meant for trusted networks only.
+
+Every attempt at a task is fenced with a token of its own: files the attempt writes (under paths returned by
+`attempt_file_path`) stay hidden until the coordinator accepts the result of the current attempt of the task, so that
+a stalled worker whose task was reassigned cannot overwrite files written by the attempt that replaced it.
+"""
+import collections
+import contextlib
+import multiprocessing
+import os
+import secrets
+import socket
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from src.parallel_executor import script_logger
+
+
+# token of the task attempt executed by this worker process and final paths of files it writes -> their temp paths
+_ATTEMPT: Optional[Tuple[str, Dict[str, str]]] = None
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """Split `host:port` address (host defaults to all interfaces)."""
+    host, _, port = address.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+
+def attempt_file_path(file_path: str) -> str:
+    """Return the path a task should write the file under: a hidden path of the task attempt executed by a remote
+    worker, moved to the given path (along with files written next to it under names it prefixes, e.g. index sidecars)
+    once the coordinator accepts the attempt, or the given path itself outside of remote workers."""
+    if _ATTEMPT is None:
+        return file_path
+    token, file_paths = _ATTEMPT
+    if file_path not in file_paths:
+        dir_path, file_name = os.path.split(file_path)
+        file_paths[file_path] = os.path.join(dir_path, f'.{file_name}.attempt-{token}')
+    return file_paths[file_path]
+
+
+@contextlib.contextmanager
+def _attempt(token: str) -> Iterator[Dict[str, str]]:
+    global _ATTEMPT
+    _ATTEMPT = (token, dict())
+    try:
+        yield _ATTEMPT[1]
+    finally:
+        _ATTEMPT = None
+
+
+def _get_attempt_files(file_paths: Dict[str, str]) -> Iterator[Tuple[str, str]]:
+    # temp files written by the attempt along with files named after them, and their final paths
+    for file_path, temp_file_path in file_paths.items():
+        dir_path, temp_file_name = os.path.split(temp_file_path)
+        with contextlib.suppress(FileNotFoundError):
+            for entry in os.scandir(dir_path):
+                if entry.name.startswith(temp_file_name):
+                    yield entry.path, file_path + entry.name[len(temp_file_name):]
+
+
+def _commit_attempt_files(file_paths: Dict[str, str]) -> None:
+    for temp_file_path, file_path in list(_get_attempt_files(file_paths)):
+        os.replace(temp_file_path, file_path)
+
+
+def _discard_attempt_files(file_paths: Dict[str, str]) -> None:
+    for temp_file_path, _ in list(_get_attempt_files(file_paths)):
+        with contextlib.suppress(OSError):
+            os.remove(temp_file_path)
+
+
+class _Job:
+    """Calls executed by a single `Coordinator.execute` call."""
+
+    def __init__(self, calls: List[Tuple[Callable, tuple]]):
+        self.calls = calls
+        self.results: Dict[int, Any] = dict()
+        self.attempts = [0] * len(calls)
+        self.tokens: List[Optional[str]] = [None] * len(calls)  # tokens of the current attempts at the calls
+        self.error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.error is not None or len(self.results) == len(self.calls)
+
+
+class Coordinator:
+    """Hands out parallel tasks to worker processes connected over sockets (see `run_worker`).
+
+    Worker that stalls (rather than dies) may still complete its task after it was reassigned, in which case its files
+    are discarded (as it is no longer connected to accept them), still the heartbeat timeout should be well above
+    pauses workers may take (e.g. swapping), as the task is executed twice.
+    """
+
+    def __init__(self,
+                 address: Tuple[str, int],
+                 authkey: bytes,
+                 heartbeat_timeout: float = 60.0,
+                 max_attempts: int = 3):
+        assert authkey, "Coordinator requires an authentication key shared with its workers."
+        assert heartbeat_timeout > 0, "Heartbeat timeout has to be greater than zero."
+        assert int(max_attempts) > 0, "Max number of attempts has to be greater than zero."
+        self.log = script_logger
+        self.address = address
+        self.authkey = authkey
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = int(max_attempts)
+        self._listener = None
+        self._cond = threading.Condition()
+        self._pending: Deque[Tuple[_Job, int]] = collections.deque()
+        self._workers: Dict[str, Optional[int]] = dict()  # worker name -> number of the task it executes
+        self._closed = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self) -> None:
+        """Start listening for workers (in a background thread)."""
+        if self._listener is not None:
+            return
+        self._listener = Listener(self.address, authkey=self.authkey)
+        self.address = self._listener.address
+        self._closed = False
+        threading.Thread(target=self._accept_workers, name='Coordinator', daemon=True).start()
+        self.log.info(f'(coordinator) Listening for workers on {self.address[0]}:{self.address[1]}')
+
+    def close(self) -> None:
+        """Stop listening and let connected workers know there are no more tasks."""
+        if self._listener is None:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._listener.close()
+        self._listener = None
+        self.log.info('(coordinator) Closed')
+
+    def execute(self, calls: List[Tuple[Callable, tuple]]) -> List[Any]:
+        """Have the workers execute function calls (given as function and args pairs, in the order they should be
+        handed out) and return their results in the same order."""
+        assert self._listener is not None, "Coordinator has to be opened before executing tasks."
+        job = _Job(calls)
+        with self._cond:
+            self._pending.extend((job, idx) for idx in range(len(calls)))
+            self._cond.notify_all()
+            while not job.done:
+                if not self._workers:
+                    self.log.info(f'(coordinator) Waiting for workers to connect to '
+                                  f'{self.address[0]}:{self.address[1]}...')
+                self._cond.wait(timeout=self.heartbeat_timeout)
+
+            # drop tasks that were not handed out (once the job fails)
+            self._pending = collections.deque(p for p in self._pending if p[0] is not job)
+
+        if job.error is not None:
+            raise RuntimeError(job.error)
+        return [job.results[idx] for idx in range(len(calls))]
+
+    def _accept_workers(self) -> None:
+        listener = self._listener
+        while True:
+            try:
+                conn = listener.accept()
+            except (multiprocessing.AuthenticationError, EOFError) as e:
+                self.log.warning(f'(coordinator) Rejected connection: {repr(e)}')
+                continue
+            except OSError:
+                # listener was closed
+                return
+            threading.Thread(target=self._serve_worker, args=(conn, ), daemon=True).start()
+
+    def _serve_worker(self, conn: Connection) -> None:
+        # worker introduces itself and learns how often to send heartbeats while it executes tasks
+        try:
+            worker_name = conn.recv()
+            conn.send(self.heartbeat_timeout / 4)
+        except (EOFError, OSError):
+            conn.close()
+            return
+        with self._cond:
+            self._workers[worker_name] = None
+            self._cond.notify_all()
+        self.log.info(f'(coordinator) Worker `{worker_name}` connected ({len(self._workers)} workers)')
+
+        task = None
+        try:
+            while (task := self._next_task(worker_name)) is not None:
+                job, idx, token = task
+                try:
+                    conn.send(('task', *job.calls[idx], token))
+                except (EOFError, OSError):
+                    raise
+                except Exception as e:
+                    self._fail(job, f'Task {idx + 1} could not be sent to worker `{worker_name}`: {repr(e)}')
+                    task = None
+                    continue
+
+                # wait for the result, as long as the worker keeps sending heartbeats
+                message = self._recv_message(conn)
+
+                # have the worker move files of the attempt into place, unless the attempt is stale (files of
+                # failed attempts are discarded by the worker right away)
+                if message[0] == 'result':
+                    accepted = self._accept(job, idx, token)
+                    conn.send(('commit', ) if accepted else ('discard', ))
+                    if accepted and (reply := self._recv_message(conn))[0] != 'committed':
+                        message = reply
+                self._complete(job, idx, token, worker_name, message)
+                task = None
+            conn.send(('close', ))
+        except (EOFError, OSError) as e:
+            self.log.warning(f'(coordinator) Worker `{worker_name}` lost: {repr(e)}')
+            if task is not None:
+                self._reassign(*task[:2])
+        finally:
+            conn.close()
+            with self._cond:
+                del self._workers[worker_name]
+                self._cond.notify_all()
+            self.log.info(f'(coordinator) Worker `{worker_name}` disconnected ({len(self._workers)} workers)')
+
+    def _recv_message(self, conn: Connection) -> tuple:
+        # receive the next message other than a heartbeat, as long as the worker keeps sending heartbeats
+        while True:
+            if not conn.poll(self.heartbeat_timeout):
+                raise TimeoutError(f'no heartbeat for {self.heartbeat_timeout}s')
+            message = conn.recv()
+            if message[0] != 'heartbeat':
+                return message
+
+    def _next_task(self, worker_name: str) -> Optional[Tuple[_Job, int, str]]:
+        # wait for a task of a job that has not failed (or for the coordinator to close), each attempt at the task
+        # being fenced with a new token
+        with self._cond:
+            self._workers[worker_name] = None
+            while True:
+                while self._pending and self._pending[0][0].error is not None:
+                    self._pending.popleft()
+                if self._closed:
+                    return None
+                if self._pending:
+                    job, idx = self._pending.popleft()
+                    job.tokens[idx] = token = secrets.token_hex(8)
+                    self._workers[worker_name] = idx + 1
+                    return job, idx, token
+                self._cond.wait()
+
+    def _accept(self, job: _Job, idx: int, token: str) -> bool:
+        # only the current attempt at a task of a job that is still running is accepted
+        with self._cond:
+            return not job.done and idx not in job.results and job.tokens[idx] == token
+
+    def _complete(self, job: _Job, idx: int, token: str, worker_name: str, message: tuple) -> None:
+        # results (and errors) of stale attempts are ignored
+        with self._cond:
+            if job.tokens[idx] == token and idx not in job.results:
+                if message[0] == 'result':
+                    job.results[idx] = message[1]
+                elif job.error is None:
+                    _, error, error_traceback = message
+                    job.error = (f'Task {idx + 1} failed on worker `{worker_name}` with exception: {error}\n'
+                                 f'{error_traceback}')
+            self._cond.notify_all()
+
+    def _fail(self, job: _Job, error: str) -> None:
+        with self._cond:
+            job.error = job.error or error
+            self._cond.notify_all()
+
+    def _reassign(self, job: _Job, idx: int) -> None:
+        # hand the task of a lost worker out again (first in line), unless it was lost too many times already
+        with self._cond:
+            job.attempts[idx] += 1
+            if job.attempts[idx] >= self.max_attempts:
+                job.error = job.error or f'Task {idx + 1} was lost along with {job.attempts[idx]} workers'
+            elif not job.done:
+                self._pending.appendleft((job, idx))
+                self.log.info(f'(coordinator) Task {idx + 1} reassigned')
+            self._cond.notify_all()
+
+
+def run_worker(address: Tuple[str, int], authkey: bytes, connect_timeout: float = 60.0) -> None:
+    """Connect to the coordinator and execute tasks it hands out until it closes the connection."""
+    worker_name = f'{socket.gethostname()}:{os.getpid()}'
+    multiprocessing.current_process().name = worker_name
+
+    # coordinator may not be listening yet
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1.0)
+        except (EOFError, ConnectionResetError):
+            script_logger.info('(worker) Coordinator closed before the worker connected')
+            return
+
+    with conn:
+        conn.send(worker_name)
+        heartbeat_interval = conn.recv()
+        script_logger.info(f'(worker) Connected to coordinator at {address[0]}:{address[1]}')
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message[0] == 'close':
+                break
+            _, func, args, token = message
+
+            # let the coordinator know the worker is alive while the task is being executed
+            done = threading.Event()
+
+            def send_heartbeats():
+                while not done.wait(heartbeat_interval):
+                    conn.send(('heartbeat', ))
+
+            heartbeat_thread = threading.Thread(target=send_heartbeats, name='Heartbeat', daemon=True)
+            heartbeat_thread.start()
+            with _attempt(token) as attempt_files:
+                try:
+                    reply = ('result', func(*args))
+                except Exception as e:
+                    reply = ('error', repr(e), traceback.format_exc())
+                finally:
+                    done.set()
+                    heartbeat_thread.join()
+
+            try:
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    raise
+                except Exception as e:
+                    # result that cannot be pickled fails the task instead of the worker
+                    reply = ('error', f'Result could not be sent: {repr(e)}', '')
+                    conn.send(reply)
+                if reply[0] != 'result':
+                    continue
+
+                # files of the attempt are moved into place only if the coordinator still waits for them
+                if conn.recv()[0] == 'commit':
+                    try:
+                        _commit_attempt_files(attempt_files)
+                    except OSError as e:
+                        conn.send(('error', f'Files could not be committed: {repr(e)}', traceback.format_exc()))
+                    else:
+                        conn.send(('committed', ))
+            except (EOFError, OSError):
+                # coordinator gave up on the attempt (e.g. after it was reassigned) and closed the connection
+                break
+            finally:
+                # files that were not moved into place are left over by failed or stale attempts only
+                _discard_attempt_files(attempt_files)
+    script_logger.info('(worker) Disconnected from coordinator')
+
+
+def run_workers(address: Tuple[str, int],
+                authkey: bytes,
+                processes_num: int = 1,
+                connect_timeout: float = 60.0
+                ) -> None:
+    """Run a number of worker processes connected to the same coordinator."""
+    assert int(processes_num) > 0, "Number of worker processes has to be greater than zero."
+    if processes_num == 1:
+        run_worker(address, authkey, connect_timeout)
+        return
+    processes = [multiprocessing.Process(target=run_worker, args=(address, authkey, connect_timeout))
+                 for _ in range(processes_num)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
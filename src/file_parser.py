@@ -1,17 +1,38 @@
+import bisect
+import contextlib
 import datetime
+import glob
+import heapq
+import itertools
+import json
 import os
 import pandas as pd
 import re
 import shutil
+import sys
+import threading
+import time
+import uuid
 from fsplit.filesplit import Filesplit
-from typing import Callable, Dict, List, Tuple, Type
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
 
-from src.log_parsers import UnparsableLogError, LogParser
+from src.compression import get_compression, plan_compressed_file_ranges, read_compressed_file_range, \
+    strip_compression_ext
+from src.distributed import Coordinator, attempt_file_path
+from src.log_parsers import LogParser, LogParserDispatcher, ParsedBatch
+from src.output_formats import OutputFormat, TsvOutputFormat
 from src.parallel_executor import ParallelExecutor, params
-from src.utils import Timer, df2tsv
+from src.partitions import get_part_file_name, get_partition_dir_name
+from src.profiling import write_profile_report
+from src.record_filters import RecordFilter
+from src.record_formats import PickleRecordFormat, RecordFormat
+from src.table_index import TableIndex
+from src.utils import Timer, copy_file_data, df2tsv, find_last_line_end, plan_file_ranges, read_file_range, \
+    tsv_reader, tsv_writer
 
 
 FILE_CHUNK_SORT_MASK = re.compile(r'^chunk_(?P<id>\d+)(?:[.].*)?$')
+LOG_PARSERS_CACHE = threading.local()
 
 
 class FileParser(ParallelExecutor):
@@ -19,6 +40,15 @@ class FileParser(ParallelExecutor):
     unparsed_short_name = 'na'
     records_ext = '.records'
     keys_ext = '.keys'
+    part_ext = '.part'
+    state_file_name = '.parse_state.json'
+    profile_report_ext = '.profile.txt'
+    profile_stats_ext = '.profile.prof'
+    sort_column = '_a_timestamp'
+    source_file_column = '_z_source_file'
+    partition_columns = (('date', '_b_datetime'), ('event', '_e_event_name'))  # partition keys and their columns
+    engines = ('staged', 'streaming')
+    result_transports = ('files', 'memory')
 
     def __init__(self,
                  log_parsers: List[Type[LogParser]],
@@ -26,86 +56,565 @@ class FileParser(ParallelExecutor):
                  max_threads: int = None,
                  parse_chunk_size: int = 1_000_000_000,  # ~1GB
                  delete_intermediate_result_dirs: bool = True,
-                 df_export_func: Callable = df2tsv):
+                 df_export_func: Callable = df2tsv,
+                 zero_copy_chunking: bool = False,
+                 engine: str = 'staged',
+                 record_format: Type[RecordFormat] = PickleRecordFormat,
+                 adaptive_parser_order: bool = True,
+                 log_parser_kwargs: dict = None,
+                 parse_batch_size: int = 10_000,
+                 output_format: Type[OutputFormat] = TsvOutputFormat,
+                 scheduling: str = 'static',
+                 result_transport: str = 'files',
+                 in_memory_chunk_records: int = 250_000,
+                 profile: bool = False,
+                 max_worker_memory: int = None,
+                 record_filter: RecordFilter = None,
+                 sort_output: bool = False,
+                 coordinator: Coordinator = None,
+                 partition_output: bool = False):
         super().__init__(max_processes=max_processes,
                          max_threads=max_threads,
-                         auto_log_msg_prefix="(parallel executor) ")
-        self.log_parsers = log_parsers
+                         auto_log_msg_prefix="(parallel executor) ",
+                         scheduling=scheduling,
+                         coordinator=coordinator)
+        # logs of parsers rejected by the record filter are still recognized (so that they don't end up unparsed), but
+        # none of their records are output
+        self.record_filter = record_filter
+        self.all_log_parsers = log_parsers
+        self.log_parsers = [p for p in log_parsers
+                            if record_filter is None or record_filter.accepts_parser(str(p.short_name))]
         self.chunk_byte_size = parse_chunk_size
         self.delete_intermediate_result_dirs = delete_intermediate_result_dirs
-        self.export_df = df_export_func
-
-    def parse_file(self, src_file_path: str, out_dir_path: str = None) -> None:
+        # tables exported with `df2tsv` are streamed by the output format instead (tsv writer produces the same format),
+        # only custom export functions are given whole tables as data frames
+        self.export_df = df_export_func if df_export_func is not df2tsv else None
+        self.zero_copy_chunking = zero_copy_chunking
+
+        assert engine in self.engines, f"Engine has to be one of: {', '.join(self.engines)}."
+        self.engine = engine
+        self.record_format = record_format
+        self.adaptive_parser_order = adaptive_parser_order
+        self.log_parser_kwargs = log_parser_kwargs or dict()
+
+        assert int(parse_batch_size) > 0, "Parse batch size has to be greater than zero."
+        self.parse_batch_size = int(parse_batch_size)
+        self.output_format = output_format
+
+        assert result_transport in self.result_transports, \
+            f"Result transport has to be one of: {', '.join(self.result_transports)}."
+        self.result_transport = result_transport
+        self.in_memory_chunk_records = int(in_memory_chunk_records)
+        self.profile = profile
+
+        assert max_worker_memory is None or int(max_worker_memory) > 0, "Max worker memory has to be greater than zero."
+        self.max_worker_memory = int(max_worker_memory) if max_worker_memory is not None else None
+
+        # sorted outputs are merged from sorted runs, which are the tabularized chunk files of the staged engine
+        assert not sort_output or (engine == 'staged' and result_transport == 'files' and self.export_df is None), \
+            "Sorted output requires the `staged` engine with `files` result transport (and no custom export function)."
+        self.sort_output = sort_output
+
+        # partitions are written by the workers tabularizing intermediate files of the staged engine
+        assert not partition_output or (engine == 'staged' and result_transport == 'files'
+                                        and self.export_df is None and not sort_output), \
+            "Partitioned output requires the `staged` engine with `files` result transport (and neither a custom " \
+            "export function nor sorted output)."
+        self.partition_output = partition_output
+        self.parser_stats = None
+        self.run_id = None  # id of the current parse_file (or parse_files) call, sent to workers along with its tasks
+
+    def parse_file(self, src_file_path: str, out_dir_path: str = None, incremental: bool = False) -> None:
         assert os.path.exists(src_file_path), 'Specified source file path does not exist'
-        if out_dir_path:
+        if self.coordinator is not None:
+            # remote workers see the same (shared) files under the same absolute paths
+            src_file_path = os.path.abspath(src_file_path)
+            out_dir_path = os.path.abspath(out_dir_path) if out_dir_path else None
+        if out_dir_path and not incremental:
             assert not os.path.exists(out_dir_path), 'Specified output directory already exists'
+        assert not (incremental and self.sort_output), 'Sorted outputs cannot be parsed incrementally'
+        assert not (incremental and self.partition_output), 'Partitioned outputs cannot be parsed incrementally'
         self.log.info(f'Parsing: {src_file_path}')
+        self.run_id = uuid.uuid4().hex
         try:
-            with Timer() as timer:
-                self._parse_file_main(src_file_path, out_dir_path)
+            # all stages share the same workers (and log parsers built by them)
+            with self.persistent_pool(), Timer() as timer:
+                if incremental:
+                    self._parse_file_incremental(src_file_path, out_dir_path)
+                else:
+                    self._parse_file_main(src_file_path, out_dir_path)
         except Exception as e:
             self.log.critical(f'Parsing failed with exception: {str(e)}', exc_info=True)
         else:
             self.log.info(f'Parsing completed (wall time: {timer.time_string})')
 
-    def _parse_file_main(self, logs_file_path: str, out_dir_path: str = None) -> None:
+    def parse_files(self, src_paths: List[str], out_dir_path: str = None) -> None:
+        """Parse many log files (given as file paths, glob patterns or directories searched recursively) in a single
+        run, with ranges of all files planned together, into one set of outputs tagging each record with its source
+        file (outputs are named after the deepest directory common to all source files)."""
+        src_file_paths = self.find_src_files(src_paths)
+        assert src_file_paths, 'Specified source paths do not match any files'
+        if self.coordinator is not None:
+            # remote workers see the same (shared) files under the same absolute paths
+            src_file_paths = [os.path.abspath(p) for p in src_file_paths]
+            out_dir_path = os.path.abspath(out_dir_path) if out_dir_path else None
+        if out_dir_path:
+            assert not os.path.exists(out_dir_path), 'Specified output directory already exists'
+
+        # outputs are named as if the common directory was a single log file next to it (unparsed logs keep the
+        # extension of the source files if they all share one)
+        common_path = os.path.commonpath([os.path.abspath(p) for p in src_file_paths])
+        if os.path.isdir(common_path):
+            common_dir, common_name_base = os.path.split(common_path)
+        else:
+            common_dir, common_name_base, _ = self.split_file_path(common_path)
+        src_file_exts = {self.split_file_path(p)[2] for p in src_file_paths}
+        src_file_ext = src_file_exts.pop() if len(src_file_exts) == 1 else '.log'
+        logs_file_path = os.path.join(common_dir, f'{common_name_base or "logs"}{src_file_ext}')
+
+        self.log.info(f'Parsing {len(src_file_paths)} files: {common_path}')
+        self.run_id = uuid.uuid4().hex
+        try:
+            # all stages share the same workers (and log parsers built by them)
+            with self.persistent_pool(), Timer() as timer:
+                self._parse_file_main(logs_file_path, out_dir_path, src_file_paths=src_file_paths)
+        except Exception as e:
+            self.log.critical(f'Parsing failed with exception: {str(e)}', exc_info=True)
+        else:
+            self.log.info(f'Parsing completed (wall time: {timer.time_string})')
+
+    def follow_file(self, src_file_path: str, out_dir_path: str = None, interval: float = 10.0) -> None:
+        # parse logs appended to the source file every given number of seconds (until interrupted)
+        while True:
+            self.parse_file(src_file_path, out_dir_path, incremental=True)
+            time.sleep(interval)
+
+    def _parse_file_incremental(self, logs_file_path: str, out_dir_path: str = None) -> None:
+        assert get_compression(logs_file_path) is None, 'Compressed files cannot be parsed incrementally'
+
+        # define main output directory (the same one for every run)
+        logs_file_dir, logs_file_name_base, logs_file_ext = self.split_file_path(logs_file_path)
+        output_dir_path = out_dir_path or os.path.join(logs_file_dir, f'{logs_file_name_base}_incremental')
+        state_file_path = os.path.join(output_dir_path, self.state_file_name)
+
+        # load state of the previous run
+        state = None
+        if os.path.exists(state_file_path):
+            with open(state_file_path) as file:
+                state = json.load(file)
+        elif os.path.exists(output_dir_path):
+            assert not os.listdir(output_dir_path), 'Specified output directory is not empty and has no parse state'
+        self._create_temp_directory(output_dir_path, exist_ok=True)
+
+        # plan (file path, offset, end) ranges with logs that were not parsed yet
+        logs_file_stat = os.stat(logs_file_path)
+        ranges = []
+        if state is None:
+            offset = 0
+        elif (logs_file_stat.st_dev, logs_file_stat.st_ino) != (state['device'], state['inode']):
+            # source file was rotated, parse what is left of the rotated file (if it can still be found) from scratch
+            self.log.info('Source file was rotated, parsing it from the beginning')
+            if rotated_file_path := self._find_rotated_file(logs_file_dir, state):
+                self.log.info(f'Parsing the rest of the rotated file: {rotated_file_path}')
+                ranges.append((rotated_file_path, state['offset'], os.path.getsize(rotated_file_path)))
+            offset = 0
+        elif logs_file_stat.st_size < state['offset']:
+            self.log.info('Source file was truncated, parsing it from the beginning')
+            offset = 0
+        else:
+            offset = state['offset']
+
+        # only whole lines are parsed, an incomplete last line is left for the next run
+        end = find_last_line_end(logs_file_path, offset=offset, end=logs_file_stat.st_size)
+        ranges.append((logs_file_path, offset, end))
+
+        # parse new logs of each range into a temporary directory and append results to the existing outputs
+        for file_path, range_offset, range_end in ranges:
+            if range_end <= range_offset:
+                self.log.info(f'No new logs in: {file_path}')
+                continue
+            self.log.info(f'Parsing bytes {range_offset}-{range_end} of: {file_path}')
+            run_timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            increment_dir_path = os.path.join(output_dir_path, f'.increment_{run_timestamp}')
+            self._parse_file_main(file_path, increment_dir_path, byte_range=(range_offset, range_end - range_offset))
+
+            _, file_name_base, file_ext = self.split_file_path(file_path)
+            for parser in self.log_parsers:
+                parser_name = str(parser.short_name)
+                self._append_output_table(
+                    parser_name=parser_name,
+                    src_file_path=os.path.join(increment_dir_path,
+                                               f'{file_name_base}.{parser_name}{self.output_format.ext}'),
+                    dst_file_path=os.path.join(output_dir_path,
+                                               f'{logs_file_name_base}.{parser_name}{self.output_format.ext}')
+                )
+            unparsed_file_path = os.path.join(increment_dir_path,
+                                              f'{file_name_base}.{self.unparsed_short_name}{file_ext}')
+            with open(os.path.join(output_dir_path, f'{logs_file_name_base}.{self.unparsed_short_name}{logs_file_ext}'),
+                      mode='ab') as dst_file:
+                with open(unparsed_file_path, mode='rb') as unparsed_file:
+                    copy_file_data(unparsed_file, dst_file)
+
+            # keep profile reports of every run
+            for profile_ext in (self.profile_report_ext, self.profile_stats_ext):
+                profile_file_path = os.path.join(increment_dir_path, f'{file_name_base}{profile_ext}')
+                if os.path.exists(profile_file_path):
+                    os.replace(profile_file_path,
+                               os.path.join(output_dir_path, f'{logs_file_name_base}_{run_timestamp}{profile_ext}'))
+            self._remove_temp_directory(increment_dir_path)
+
+        # save the new state only after the outputs are complete
+        state = {
+            'src_file_path': os.path.abspath(logs_file_path),
+            'device': logs_file_stat.st_dev,
+            'inode': logs_file_stat.st_ino,
+            'size': logs_file_stat.st_size,
+            'offset': end,
+        }
+        with open(state_file_path + '.tmp', mode='w') as file:
+            json.dump(state, file, indent=2)
+        os.replace(state_file_path + '.tmp', state_file_path)
+
+    def _find_rotated_file(self, dir_path: str, state: Dict[str, Any]) -> Optional[str]:
+        # rotated file is usually renamed within the same directory, so it still has the same inode
+        for entry in os.scandir(dir_path):
+            if entry.is_file(follow_symlinks=False):
+                entry_stat = entry.stat(follow_symlinks=False)
+                if (entry_stat.st_dev, entry_stat.st_ino) == (state['device'], state['inode']):
+                    return entry.path
+        return None
+
+    def _append_output_table(self, parser_name: str, src_file_path: str, dst_file_path: str) -> None:
+        if not os.path.exists(dst_file_path):
+            os.replace(src_file_path, dst_file_path)
+            return
+
+        # append rows in place if headers did not change, otherwise rewrite the table with extended headers
+        output_format = self.output_format()
+        dst_headers = output_format.read_headers(dst_file_path)
+        headers = self.sort_table_headers({*dst_headers, *output_format.read_headers(src_file_path)})
+        column_types = self._get_column_types(parser_name)
+        if headers == dst_headers and output_format.appendable:
+            with output_format.open_table(dst_file_path, headers, column_types, append=True) as table:
+                table.append_table(src_file_path)
+        else:
+            self.log.info(f'Rewriting output table to append new rows: {dst_file_path}')
+            tmp_file_path = dst_file_path + '.tmp'
+            with output_format.open_table(tmp_file_path, headers, column_types) as table:
+                table.append_table(dst_file_path)
+                table.append_table(src_file_path)
+            os.replace(tmp_file_path, dst_file_path)
+
+    def _parse_file_main(self,
+                         logs_file_path: str,
+                         out_dir_path: str = None,
+                         byte_range: Tuple[int, int] = None,
+                         src_file_paths: List[str] = None
+                         ) -> None:
         # define main output directory
         logs_file_dir, logs_file_name_base, _ = self.split_file_path(logs_file_path)
         run_timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         output_dir_path = out_dir_path or os.path.join(logs_file_dir, f'{logs_file_name_base}_{run_timestamp}')
 
+        # initialize main output directory
+        self.log.info(f'Initializing output directory: {output_dir_path}')
+        os.makedirs(output_dir_path)
+
+        # collect profile dumps of the stages and their tasks into a temporary directory
+        if self.profile:
+            self.profile_dir_path = os.path.join(output_dir_path, '.profile')
+            self._create_temp_directory(self.profile_dir_path)
+
+        try:
+            parse_file = self._parse_file_streaming if self.engine == 'streaming' else self._parse_file_staged
+            parse_file(logs_file_path=logs_file_path,
+                       output_dir_path=output_dir_path,
+                       orig_file_name_base=logs_file_name_base,
+                       byte_range=byte_range,
+                       src_file_paths=src_file_paths)
+        finally:
+            profile_dir_path, self.profile_dir_path = self.profile_dir_path, None
+
+        # merge profile dumps of all workers into a single report
+        if profile_dir_path is not None:
+            self._write_profile_report(src_dir_path=profile_dir_path,
+                                       dst_dir_path=output_dir_path,
+                                       orig_file_name_base=logs_file_name_base)
+            self._remove_temp_directory(profile_dir_path)
+
+    def _parse_file_staged(self,
+                           logs_file_path: str,
+                           output_dir_path: str,
+                           orig_file_name_base: str,
+                           byte_range: Tuple[int, int] = None,
+                           src_file_paths: List[str] = None
+                           ) -> None:
         # define temporary output subdirectories
         split_dir_path = os.path.join(output_dir_path, '.0_split')
         parsed_dir_path = os.path.join(output_dir_path, '.1_parsed')
         tabularized_dir_path = os.path.join(output_dir_path, '.2_tabularized')
 
-        # initialize main output directory
-        self.log.info(f'Initializing output directory: {output_dir_path}')
-        os.makedirs(output_dir_path)
-
-        # split source file into evenly sized chunks of logs
-        self.log.info('STAGE_1: Splitting source file into chunks...')
-        self._create_temp_directory(split_dir_path)
-        self._split_file_into_chunks(src_file_path=logs_file_path,
-                                     dst_dir_path=split_dir_path)
-        self.log.info(f'STAGE_1: Source file split into chunks')
+        # split source file into evenly sized chunks of logs (or only plan byte ranges of such chunks, which is the
+        # only option when just a byte range of the source file is parsed, when the source file is compressed, when
+        # results are kept in memory, when ranges are handed out to remote workers or when many files are parsed)
+        in_memory = self.result_transport == 'memory'
+        plan_chunk_ranges = (self.zero_copy_chunking or byte_range is not None or in_memory
+                             or src_file_paths is not None or get_compression(logs_file_path) is not None
+                             or self.coordinator is not None)
+        with self.profile_stage('STAGE_1'):
+            if plan_chunk_ranges:
+                chunks = self._plan_chunks(logs_file_path, byte_range, src_file_paths)
+            else:
+                self.log.info('STAGE_1: Splitting source file into chunks...')
+                self._create_temp_directory(split_dir_path)
+                self._split_file_into_chunks(src_file_path=logs_file_path,
+                                             dst_dir_path=split_dir_path)
+                self.log.info(f'STAGE_1: Source file split into chunks')
 
         # extract features from chunks of logs and save them as records
-        self.log.info('STAGE_2: Parsing source file chunks...')
-        self._create_temp_directory(parsed_dir_path)
-        self._parse_file_chunks(src_dir_path=split_dir_path,
-                                dst_dir_path=parsed_dir_path)
-        self._remove_temp_directory(split_dir_path)
-        self.log.info('STAGE_2: Done parsing source file chunks')
+        with self.profile_stage('STAGE_2'):
+            self.log.info('STAGE_2: Parsing source file chunks...')
+            self._create_temp_directory(parsed_dir_path)
+            if plan_chunk_ranges:
+                chunk_results = self._parse_file_ranges(src_file_path=logs_file_path,
+                                                        chunks=chunks,
+                                                        dst_dir_path=parsed_dir_path)
+            else:
+                chunk_results = self._parse_file_chunks(src_dir_path=split_dir_path,
+                                                        dst_dir_path=parsed_dir_path)
+                self._remove_temp_directory(split_dir_path)
+            self._log_parser_stats([chunk_result['stats'] for chunk_result in chunk_results])
+            self.log.info('STAGE_2: Done parsing source file chunks')
 
         # get all unique feature names extracted from chunks by each parser and order them to form column names
-        self.log.info('STAGE_3: Gathering unique feature names...')
-        records_table_headers_dict = self._get_final_table_headers(src_dir_path=parsed_dir_path)
-        self.log.info('STAGE_3: Done gathering unique feature names')
-
-        # convert files with records into tabularic tsv files with matching headers
-        self.log.info('STAGE_4: Tabularizing parsed file chunks...')
-        self._create_temp_directory(tabularized_dir_path)
-        self._tabularize_parsed_chunks(src_dir_path=parsed_dir_path,
-                                       dst_dir_path=tabularized_dir_path,
-                                       records_table_headers_dict=records_table_headers_dict)
-        self.log.info('STAGE_4: Done tabularizing parsed file chunks')
+        with self.profile_stage('STAGE_3'):
+            self.log.info('STAGE_3: Gathering unique feature names...')
+            if in_memory:
+                records_table_headers_dict = self._merge_table_headers(chunk_results)
+            else:
+                records_table_headers_dict = self._get_final_table_headers(src_dir_path=parsed_dir_path)
+            self.log.info('STAGE_3: Done gathering unique feature names')
+
+        # convert files with records into tabularic tsv files with matching headers (or straight into parts of the
+        # output partitions, which are final)
+        with self.profile_stage('STAGE_4'):
+            self.log.info('STAGE_4: Tabularizing parsed file chunks...')
+            if not self.partition_output:
+                self._create_temp_directory(tabularized_dir_path)
+            self._tabularize_parsed_chunks(src_dir_path=parsed_dir_path,
+                                           dst_dir_path=output_dir_path if self.partition_output
+                                           else tabularized_dir_path,
+                                           records_table_headers_dict=records_table_headers_dict)
+            self.log.info('STAGE_4: Done tabularizing parsed file chunks')
 
         # merge files with leftover logs that were not parsed by any of the parsers
-        self.log.info('STAGE_5: Merging unparsed file chunks...')
-        self._concatenate_unparsed_chunks(src_dir_path=parsed_dir_path,
+        with self.profile_stage('STAGE_5'):
+            self.log.info('STAGE_5: Merging unparsed file chunks...')
+            if self.partition_output:
+                self._move_unparsed_chunks(src_dir_path=parsed_dir_path,
+                                           dst_dir_path=output_dir_path)
+            elif in_memory:
+                self._merge_unparsed_chunk_results(chunk_results=chunk_results,
+                                                   src_dir_path=parsed_dir_path,
+                                                   dst_dir_path=output_dir_path,
+                                                   orig_file_path=logs_file_path)
+            else:
+                self._concatenate_unparsed_chunks(src_dir_path=parsed_dir_path,
+                                                  dst_dir_path=output_dir_path,
+                                                  orig_file_name_base=orig_file_name_base)
+            self._remove_temp_directory(parsed_dir_path)
+            self.log.info('STAGE_5: Done merging unparsed file chunks')
+
+        # merge parsed table chunks (partitions need no merging)
+        if self.partition_output:
+            return
+        with self.profile_stage('STAGE_6'):
+            self.log.info('STAGE_6: Merging parsed file chunks...')
+            if self.sort_output:
+                self._merge_sorted_chunks(src_dir_path=tabularized_dir_path,
                                           dst_dir_path=output_dir_path,
-                                          orig_file_name_base=logs_file_name_base)
-        self._remove_temp_directory(parsed_dir_path)
-        self.log.info('STAGE_5: Done merging unparsed file chunks')
-
-        # merge parsed table chunks
-        self.log.info('STAGE_6: Merging parsed file chunks...')
-        self._concatenate_tabularized_chunks(src_dir_path=tabularized_dir_path,
-                                             dst_dir_path=output_dir_path,
-                                             orig_file_name_base=logs_file_name_base)
-        self._remove_temp_directory(tabularized_dir_path)
-        self.log.info('STAGE_6: Done merging parsed file chunks')
+                                          orig_file_name_base=orig_file_name_base,
+                                          records_table_headers_dict=records_table_headers_dict)
+            elif in_memory:
+                self._merge_tabularized_chunk_results(chunk_results=chunk_results,
+                                                      src_dir_path=tabularized_dir_path,
+                                                      dst_dir_path=output_dir_path,
+                                                      orig_file_name_base=orig_file_name_base,
+                                                      records_table_headers_dict=records_table_headers_dict)
+            else:
+                self._concatenate_tabularized_chunks(src_dir_path=tabularized_dir_path,
+                                                     dst_dir_path=output_dir_path,
+                                                     orig_file_name_base=orig_file_name_base,
+                                                     records_table_headers_dict=records_table_headers_dict)
+            self._remove_temp_directory(tabularized_dir_path)
+            self.log.info('STAGE_6: Done merging parsed file chunks')
+
+    def _parse_file_streaming(self,
+                              logs_file_path: str,
+                              output_dir_path: str,
+                              orig_file_name_base: str,
+                              byte_range: Tuple[int, int] = None,
+                              src_file_paths: List[str] = None
+                              ) -> None:
+        # define temporary output subdirectory for parts of the final outputs
+        parts_dir_path = os.path.join(output_dir_path, '.parts')
+
+        # plan byte ranges of the source file (or files), which is never copied
+        with self.profile_stage('STAGE_1'):
+            chunks = self._plan_chunks(logs_file_path, byte_range, src_file_paths)
+
+        # parse byte ranges and stream rows straight into parts of the final outputs
+        with self.profile_stage('STAGE_2'):
+            self.log.info('STAGE_2: Streaming source file chunks into output parts...')
+            self._create_temp_directory(parts_dir_path)
+            params_list, weights = self._get_chunk_params(logs_file_path, parts_dir_path, chunks)
+            part_results = self.execute_parallel_task(task=self._stream_file_chunk,
+                                                      params_list=params_list,
+                                                      weights=weights)
+            part_columns_list, parser_stats_list = map(list, zip(*part_results))
+            self._log_parser_stats(parser_stats_list)
+            self.log.info('STAGE_2: Done streaming source file chunks into output parts')
+
+        # resolve final table headers from columns reported by the workers (no intermediate files are read)
+        with self.profile_stage('STAGE_3'):
+            self.log.info('STAGE_3: Resolving final table headers...')
+            records_table_headers_dict = dict()
+            for parser in self.log_parsers:
+                parser_name = str(parser.short_name)
+                unique_keys = set()
+                for part_columns in part_columns_list:
+                    unique_keys.update(part_columns[parser_name])
+                records_table_headers_dict[parser_name] = self.sort_table_headers(unique_keys)
+            self.log.info('STAGE_3: Done resolving final table headers')
+
+        # merge parts into the final outputs, realigning part columns with the final table headers
+        with self.profile_stage('STAGE_4'):
+            self.log.info('STAGE_4: Merging output parts...')
+            _, _, src_file_ext = self.split_file_path(logs_file_path)
+            params_list = [params(parts_dir_path, output_dir_path, orig_file_name_base, src_file_ext)]
+            for parser in self.log_parsers:
+                parser_name = str(parser.short_name)
+                params_list.append(
+                    params(
+                        parser_name=parser_name,
+                        src_dir_path=parts_dir_path,
+                        dst_dir_path=output_dir_path,
+                        orig_file_name_base=orig_file_name_base,
+                        table_headers=records_table_headers_dict[parser_name],
+                        parts_columns=[part_columns[parser_name] for part_columns in part_columns_list]
+                    )
+                )
+            weights = [self.get_dir_size(os.path.join(parts_dir_path, self.unparsed_short_name))]
+            weights.extend(self.get_dir_size(os.path.join(parts_dir_path, str(p.short_name))) for p in self.log_parsers)
+            self.execute_parallel_task(task=self._merge_output_parts,
+                                       params_list=params_list,
+                                       weights=weights)
+            self._remove_temp_directory(parts_dir_path)
+            self.log.info('STAGE_4: Done merging output parts')
+
+    def _stream_file_chunk(self,
+                           src_file_path: str,
+                           dst_dir_path: str,
+                           chunk_name: str,
+                           byte_range: Tuple[int, int] = None,
+                           pieces: List[Tuple[str, Tuple[int, int]]] = None
+                           ) -> Tuple[Dict[str, List[str]], Dict[str, Any]]:
+        # parse file path
+        _, _, src_file_ext = self.split_file_path(src_file_path)
+
+        # initialize log parsers
+        dispatcher = self._init_parser_dispatcher()
+        parser_names = [str(p.short_name) for p in self.log_parsers]
+
+        # initialize part columns (in order of first appearance) for each parser
+        columns_dict = {k: [] for k in parser_names}
+
+        # create output directories (if they don't already exist)
+        for dir_name in [*parser_names, self.unparsed_short_name]:
+            self._create_temp_directory(os.path.join(dst_dir_path, dir_name), exist_ok=True)
+
+        with contextlib.ExitStack() as stack:
+            # open part files (tsv parts for tsv outputs, record files for any other output format)
+            record_format = self.record_format()
+            part_files, writers = dict(), dict()
+            for parser_name in parser_names:
+                part_file_name = f'{chunk_name}{self.part_ext}'
+                part_file_path = attempt_file_path(os.path.join(dst_dir_path, parser_name, part_file_name))
+                self.log.debug(f'Creating file: {part_file_path}')
+                if self.output_format.tsv:
+                    part_file = stack.enter_context(open(part_file_path, mode='w', encoding='utf8', newline=''))
+                    writers[parser_name] = tsv_writer(part_file)
+                else:
+                    part_files[parser_name] = stack.enter_context(
+                        open(part_file_path, mode='w' + record_format.file_mode_suffix))
+            unparsed_file_path = attempt_file_path(
+                os.path.join(dst_dir_path, self.unparsed_short_name, f'{chunk_name}{src_file_ext}'))
+            self.log.debug(f'Creating file: {unparsed_file_path}')
+            unparsed_file = stack.enter_context(open(unparsed_file_path, mode='w', encoding='utf8'))
+
+            # parse batches of logs and write their rows right away (rows are as long as the part columns known at
+            # the time of writing, so the part columns are only allowed to grow)
+            for batches, unparsed_logs in self._iter_chunk_batches(dispatcher, src_file_path, byte_range, pieces):
+                for parser_name, batch in batches.items():
+                    columns = columns_dict[parser_name]
+                    columns.extend(k for k in batch.columns if k not in columns)
+                    if self.output_format.tsv:
+                        writers[parser_name].writerows(batch.rows(columns))
+                    else:
+                        record_format.dump([batch], part_files[parser_name])
+                unparsed_file.writelines(log + '\n' for log in unparsed_logs)
+
+        return columns_dict, dispatcher.stats
+
+    def _merge_output_parts(self,
+                            src_dir_path: str,
+                            dst_dir_path: str,
+                            orig_file_name_base: str,
+                            src_file_ext: str = '',
+                            parser_name: str = None,
+                            table_headers: List[str] = None,
+                            parts_columns: List[List[str]] = None
+                            ) -> None:
+        # merge parts with unparsed logs when no parser is specified
+        if parser_name is None:
+            part_dir_path = os.path.join(src_dir_path, self.unparsed_short_name)
+            dst_file_name = f'{orig_file_name_base}.{self.unparsed_short_name}{src_file_ext}'
+            dst_file_path = attempt_file_path(os.path.join(dst_dir_path, dst_file_name))
+            with open(dst_file_path, mode='wb') as dst_file:
+                for part_file_name in self.get_sorted_chunk_names(src_dir_path=part_dir_path):
+                    with open(os.path.join(part_dir_path, part_file_name), mode='rb') as part_file:
+                        copy_file_data(part_file, dst_file)
+            return
+
+        # merge record parts into a table of the output format
+        part_dir_path = os.path.join(src_dir_path, parser_name)
+        part_file_names = self.get_sorted_chunk_names(src_dir_path=part_dir_path)
+        dst_file_path = attempt_file_path(
+            os.path.join(dst_dir_path, f'{orig_file_name_base}.{parser_name}{self.output_format.ext}'))
+        if not self.output_format.tsv:
+            record_format = self.record_format()
+            with self.output_format().open_table(dst_file_path, table_headers,
+                                                 self._get_column_types(parser_name)) as table:
+                for part_file_name in part_file_names:
+                    part_file_path = os.path.join(part_dir_path, part_file_name)
+                    with open(part_file_path, mode='r' + record_format.file_mode_suffix) as part_file:
+                        for batch in record_format.load(part_file):
+                            table.write_batch(batch)
+            return
+
+        # merge table parts, placing each part column under its final header
+        header_ids = {header: idx for idx, header in enumerate(table_headers)}
+        with open(dst_file_path, mode='w', encoding='utf8', newline='') as dst_file:
+            writer = tsv_writer(dst_file)
+            writer.writerow(table_headers)
+            for part_file_name, part_columns in zip(part_file_names, parts_columns):
+                part_header_ids = [header_ids[column] for column in part_columns]
+                with open(os.path.join(part_dir_path, part_file_name), encoding='utf8', newline='') as part_file:
+                    for part_row in tsv_reader(part_file):
+                        row = [None] * len(table_headers)
+                        for header_id, value in zip(part_header_ids, part_row):
+                            row[header_id] = value
+                        writer.writerow(row)
 
     def _split_file_into_chunks(self, src_file_path: str, dst_dir_path: str) -> None:
         # define helper method that renames file chunks created with FileSplit
@@ -148,10 +657,86 @@ class FileParser(ParallelExecutor):
             dst_file_path = os.path.join(dst_dir_path, f'chunk_1{extension}')
             shutil.copy(src_file_path, dst_file_path)
 
+    def _plan_file_chunks(self, src_file_path: str, byte_range: Tuple[int, int] = None) -> List[Tuple[int, int]]:
+        # plan byte ranges of compressed files on boundaries of independently compressed members
+        if compression := get_compression(src_file_path):
+            assert byte_range is None, 'Byte ranges of compressed files cannot be parsed separately'
+            return plan_compressed_file_ranges(src_file_path, self.chunk_byte_size, compression) or [(0, 0)]
+
+        # plan newline aligned byte ranges of the whole file or its byte range (an empty file still yields a single
+        # empty chunk)
+        offset, length = byte_range or (0, None)
+        return plan_file_ranges(src_file_path, self.chunk_byte_size, offset=offset, length=length) or [(offset, 0)]
+
+    def _plan_chunks(self,
+                     logs_file_path: str,
+                     byte_range: Tuple[int, int] = None,
+                     src_file_paths: List[str] = None
+                     ) -> List[Union[Tuple[int, int], List[Tuple[str, Tuple[int, int]]]]]:
+        # plan byte ranges of the source file, or pieces of chunks of many source files
+        if src_file_paths is not None:
+            self.log.info('STAGE_1: Planning source files chunk byte ranges...')
+            chunks = self._plan_files_chunks(src_file_paths)
+            self.log.info(f'STAGE_1: {len(src_file_paths)} source files divided into {len(chunks)} chunks')
+            return chunks
+        self.log.info('STAGE_1: Planning source file chunk byte ranges...')
+        chunks = self._plan_file_chunks(src_file_path=logs_file_path, byte_range=byte_range)
+        self.log.info(f'STAGE_1: Source file divided into {len(chunks)} chunk byte ranges')
+        return chunks
+
+    def _plan_files_chunks(self, src_file_paths: List[str]) -> List[List[Tuple[str, Tuple[int, int]]]]:
+        # split files into byte ranges and pack consecutive ranges into chunks of roughly the chunk size (small files
+        # are packed together, big ones are split), making chunks small enough for every worker to get one
+        total_size = sum(os.path.getsize(p) for p in src_file_paths)
+        workers_num = self.max_processes * self.max_threads
+        chunk_byte_size = max(min(self.chunk_byte_size, -(-total_size // workers_num)), 1)
+
+        chunks, chunk, chunk_size = [], [], 0
+        for src_file_path in src_file_paths:
+            if get_compression(src_file_path):
+                ranges = plan_compressed_file_ranges(src_file_path, chunk_byte_size, get_compression(src_file_path))
+            else:
+                ranges = plan_file_ranges(src_file_path, chunk_byte_size)
+            for offset, length in ranges:
+                if chunk and chunk_size + length > chunk_byte_size:
+                    chunks.append(chunk)
+                    chunk, chunk_size = [], 0
+                chunk.append((src_file_path, (offset, length)))
+                chunk_size += length
+        return [*chunks, chunk] if chunk else chunks or [[(src_file_paths[0], (0, 0))]]
+
+    def _get_chunk_params(self,
+                          src_file_path: str,
+                          dst_dir_path: str,
+                          chunks: List[Union[Tuple[int, int], List[Tuple[str, Tuple[int, int]]]]]
+                          ) -> Tuple[List[Tuple[tuple, dict]], List[int]]:
+        # chunks are either byte ranges of the source file or lists of pieces (byte ranges) of many source files
+        params_list, weights = [], []
+        for chunk_id, chunk in enumerate(chunks, start=1):
+            if isinstance(chunk, list):
+                chunk_params = params(src_file_path, dst_dir_path, chunk_name=f'chunk_{chunk_id}', pieces=chunk)
+                weights.append(sum(length for _, (_, length) in chunk))
+            else:
+                chunk_params = params(src_file_path, dst_dir_path, chunk_name=f'chunk_{chunk_id}', byte_range=chunk)
+                weights.append(chunk[1])
+            params_list.append(chunk_params)
+        return params_list, weights
+
+    def _parse_file_ranges(self,
+                           src_file_path: str,
+                           chunks: List[Union[Tuple[int, int], List[Tuple[str, Tuple[int, int]]]]],
+                           dst_dir_path: str
+                           ) -> List[Dict[str, Any]]:
+        # parse byte ranges of the source file (or of many source files) in place (concurrently)
+        params_list, weights = self._get_chunk_params(src_file_path, dst_dir_path, chunks)
+        return self.execute_parallel_task(task=self._parse_file_chunk,
+                                          params_list=params_list,
+                                          weights=weights)
+
     def _parse_file_chunks(self,
                            src_dir_path: str,
                            dst_dir_path: str
-                           ) -> None:
+                           ) -> List[Dict[str, Any]]:
 
         # get chunk file paths
         chunk_file_names = self.get_sorted_chunk_names(src_dir_path=src_dir_path)
@@ -159,84 +744,207 @@ class FileParser(ParallelExecutor):
 
         # parse chunk files (concurrently)
         params_list = [params(src_file_path, dst_dir_path) for src_file_path in chunk_file_paths]
-        self.execute_parallel_task(task=self._parse_file_chunk,
-                                   params_list=params_list)
+        return self.execute_parallel_task(task=self._parse_file_chunk,
+                                          params_list=params_list,
+                                          weights=[os.path.getsize(p) for p in chunk_file_paths])
 
     def _parse_file_chunk(self,
                           src_file_path: str,
-                          dst_dir_path: str
-                          ) -> None:
-        # parse file path
+                          dst_dir_path: str,
+                          chunk_name: str = None,
+                          byte_range: Tuple[int, int] = None,
+                          pieces: List[Tuple[str, Tuple[int, int]]] = None
+                          ) -> Dict[str, Any]:
+        # parse file path (chunks defined by byte ranges are named explicitly)
         _, src_file_name, src_file_ext = self.split_file_path(src_file_path)
+        src_file_name = chunk_name or src_file_name
 
         # initialize log parsers
-        parsers = {p.short_name: p() for p in self.log_parsers}
+        dispatcher = self._init_parser_dispatcher()
+        parser_names = [str(p.short_name) for p in self.log_parsers]
 
-        # initialize log parsing results
-        records_dict = {k: [] for k in parsers.keys()}
-        keys_dict = {k: set() for k in parsers.keys()}
+        # initialize log parsing results (flushed to files whenever they exceed the memory budget of the worker)
+        batches_dict = {k: ParsedBatch() for k in parser_names}
+        keys_dict = {k: dict() for k in parser_names}
         unparsed_logs = []
-
-        # parse logs file chunk
-        with open(src_file_path) as file:
-            for log_entry in file:
-                for parser_name, parser in parsers.items():
-                    try:
-                        record = parser.parse(log_entry)
-                        records_dict[parser_name].append(record)
-                        keys_dict[parser_name].update(record)
-                        break
-                    except UnparsableLogError:
-                        pass
-                else:
-                    unparsed_logs.append(log_entry.strip())
-
-        # save records and keys of parsed logs
+        memory_budget = self._get_memory_budget()
+        buffered_size, spilled = 0, False
+
+        # parse logs file chunk (either a whole chunk file, a byte range of the source file or pieces of many source
+        # files) in batches
+        for batches, batch_unparsed_logs in self._iter_chunk_batches(dispatcher, src_file_path, byte_range, pieces):
+            for parser_name, batch in batches.items():
+                batches_dict[parser_name].extend(batch)
+                keys_dict[parser_name].update(dict.fromkeys(batch.columns))
+            unparsed_logs.extend(batch_unparsed_logs)
+            if memory_budget is None:
+                continue
+
+            # append buffered results to the chunk files once they take more memory than the worker can spare
+            buffered_size += sum(batch.memory_size() for batch in batches.values())
+            buffered_size += sum(map(sys.getsizeof, batch_unparsed_logs))
+            if buffered_size > memory_budget:
+                self._persist_parsed_data(src_file_name, dst_dir_path, batches_dict, append=spilled)
+                self._persist_unparsed_logs(src_file_name, dst_dir_path, src_file_ext, unparsed_logs,
+                                            append=spilled)
+                batches_dict = {k: ParsedBatch() for k in parser_names}
+                unparsed_logs = []
+                buffered_size, spilled = 0, True
+
+        # report keys of each parser's records along with parser stats
+        chunk_result = {
+            'chunk_name': src_file_name,
+            'stats': dispatcher.stats,
+            'keys': {parser_name: list(keys) for parser_name, keys in keys_dict.items()},
+            'batches': None,
+            'unparsed_logs': None,
+        }
+
+        # send small results straight back to the main process (through the pool result pipe) instead of saving them
+        records_num = sum(len(batch) for batch in batches_dict.values()) + len(unparsed_logs)
+        if self.result_transport == 'memory' and not spilled and records_num <= self.in_memory_chunk_records:
+            chunk_result['batches'] = batches_dict
+            chunk_result['unparsed_logs'] = unparsed_logs
+            return chunk_result
+
+        # save records and keys of parsed logs (after the records saved already, if there are any)
         self._persist_parsed_data(src_file_name=src_file_name,
                                   dst_dir_path=dst_dir_path,
-                                  records_dict=records_dict,
-                                  keys_dict=keys_dict)
+                                  batches_dict=batches_dict,
+                                  append=spilled)
 
         # save unparsed logs
         self._persist_unparsed_logs(src_file_name=src_file_name,
                                     dst_dir_path=dst_dir_path,
                                     file_ext=src_file_ext,
-                                    unparsed_logs=unparsed_logs)
-
-    def _persist_parsed_data(self, src_file_name: str, dst_dir_path: str, records_dict: dict, keys_dict: dict) -> None:
+                                    unparsed_logs=unparsed_logs,
+                                    append=spilled)
+
+        return chunk_result
+
+    def _get_memory_budget(self) -> Optional[int]:
+        # memory available for buffered results of a single task (threads of a worker process share its budget)
+        if self.max_worker_memory is None:
+            return None
+        return self.max_worker_memory // self.max_threads
+
+    def _init_worker(self) -> None:
+        # build log parsers (and compile their regexes) once per worker process and each of its threads
+        self._get_log_parsers()
+
+    def _init_parser_dispatcher(self) -> LogParserDispatcher:
+        return LogParserDispatcher(parsers=self._get_log_parsers(), adaptive=self.adaptive_parser_order)
+
+    def _get_log_parsers(self) -> List[LogParser]:
+        # log parsers are reused by all tasks (and parse_file calls) executed by the same thread, as long as they
+        # are configured in the same way
+        parsers_cache = LOG_PARSERS_CACHE.__dict__.setdefault('parsers', dict())
+        key = (tuple(self.all_log_parsers), repr(sorted(self.log_parser_kwargs.items())), repr(self.record_filter))
+        if (parsers := parsers_cache.get(key)) is None:
+            parsers = parsers_cache[key] = [p(**self.log_parser_kwargs) for p in self.all_log_parsers]
+            for parser in parsers:
+                parser.record_filter = self.record_filter
+
+        # keys and values cached by schemas of the parsers are dropped once the thread parses logs of another run, so
+        # that they do not pile up in long-lived workers
+        if LOG_PARSERS_CACHE.__dict__.get('run_id') != self.run_id:
+            for cached_parsers in parsers_cache.values():
+                for parser in cached_parsers:
+                    parser.schema.clear()
+            LOG_PARSERS_CACHE.run_id = self.run_id
+        return parsers
+
+    def _iter_parsed_batches(self,
+                             dispatcher: LogParserDispatcher,
+                             log_entries: Iterable[str]
+                             ) -> Iterator[Tuple[Dict[str, ParsedBatch], List[str]]]:
+        # yield batches of records parsed by each parser and stripped logs that were not parsed, batch by batch
+        log_entries = iter(log_entries)
+        while block := list(itertools.islice(log_entries, self.parse_batch_size)):
+            batches, unparsed = dispatcher.parse_batch(block)
+            if self.record_filter is not None:
+                batches = {name: batch for name, batch in batches.items() if self.record_filter.accepts_parser(name)}
+            yield batches, [block[idx].strip() for idx in unparsed]
+
+    def _iter_chunk_batches(self,
+                            dispatcher: LogParserDispatcher,
+                            src_file_path: str,
+                            byte_range: Tuple[int, int] = None,
+                            pieces: List[Tuple[str, Tuple[int, int]]] = None
+                            ) -> Iterator[Tuple[Dict[str, ParsedBatch], List[str]]]:
+        # parse a chunk of the source file, or pieces of many source files tagging records with their source file
+        # (unless the tag is projected out) and prefixing unparsed logs with it (followed by a tab)
+        if pieces is None:
+            with self._open_file_chunk(src_file_path, byte_range) as file:
+                yield from self._iter_parsed_batches(dispatcher, file)
+            return
+        tag_source = (self.record_filter is None or self.record_filter.fields is None
+                      or self.source_file_column in self.record_filter.fields)
+        for piece_file_path, piece_range in pieces:
+            with self._open_file_chunk(piece_file_path, piece_range) as file:
+                for batches, unparsed_logs in self._iter_parsed_batches(dispatcher, file):
+                    if tag_source:
+                        for batch in batches.values():
+                            batch.pad()
+                            batch.columns[self.source_file_column] = [piece_file_path] * batch.size
+                    yield batches, [f'{piece_file_path}\t{log}' for log in unparsed_logs]
+
+    def _get_column_types(self, parser_name: str) -> Dict[str, str]:
+        return next(p.column_types for p in self.log_parsers if str(p.short_name) == parser_name)
+
+    def _log_parser_stats(self, parser_stats_list: List[Dict[str, Any]]) -> None:
+        # sum up parser hit and miss counters of all chunks
+        self.parser_stats = LogParserDispatcher.merge_stats(parser_stats_list)
+        for parser_name, hits in self.parser_stats['hits'].items():
+            self.log.info(f'Parser `{parser_name}`: {hits} hits, {self.parser_stats["misses"][parser_name]} misses, '
+                          f'{self.parser_stats["filtered"][parser_name]} filtered out')
+        self.log.info(f'Unparsed logs: {self.parser_stats["unparsed"]}')
+
+    def _persist_parsed_data(self,
+                             src_file_name: str,
+                             dst_dir_path: str,
+                             batches_dict: Dict[str, ParsedBatch],
+                             append: bool = False
+                             ) -> None:
         # create output directories (if they don't already exist)
-        for parser_name in records_dict.keys():
+        for parser_name in batches_dict.keys():
             self._create_temp_directory(os.path.join(dst_dir_path, parser_name), exist_ok=True)
 
         # save successfully parsed results as records and keys (unique features from all records)
-        for parser_name, records in records_dict.items():
+        record_format = self.record_format()
+        for parser_name, batch in batches_dict.items():
             records_file_name = f'{src_file_name}.{parser_name}{self.records_ext}'
-            records_file_path = os.path.join(dst_dir_path, parser_name, records_file_name)
+            records_file_path = attempt_file_path(os.path.join(dst_dir_path, parser_name, records_file_name))
 
-            self.log.debug(f'Creating file: {records_file_path}')
-            with open(records_file_path, mode='w+') as file:
-                for record in records:
-                    file.write(str(record) + '\n')
+            self.log.debug(f'{"Appending to" if append else "Creating"} file: {records_file_path}')
+            with open(records_file_path, mode=('a' if append else 'w+') + record_format.file_mode_suffix) as file:
+                record_format.dump([batch], file)
 
-        for parser_name, keys in keys_dict.items():
+        for parser_name, batch in batches_dict.items():
             keys_file_name = f'{src_file_name}.{parser_name}{self.keys_ext}'
-            keys_file_path = os.path.join(dst_dir_path, parser_name, keys_file_name)
+            keys_file_path = attempt_file_path(os.path.join(dst_dir_path, parser_name, keys_file_name))
 
-            self.log.debug(f'Creating file: {keys_file_path}')
-            with open(keys_file_path, mode='w+') as file:
-                for key in keys:
+            self.log.debug(f'{"Appending to" if append else "Creating"} file: {keys_file_path}')
+            with open(keys_file_path, mode='a' if append else 'w+') as file:
+                for key in batch.columns:
                     file.write(str(key) + '\n')
 
-    def _persist_unparsed_logs(self, src_file_name: str, dst_dir_path: str, file_ext: str, unparsed_logs: list) -> None:
+    def _persist_unparsed_logs(self,
+                               src_file_name: str,
+                               dst_dir_path: str,
+                               file_ext: str,
+                               unparsed_logs: list,
+                               append: bool = False
+                               ) -> None:
         # create output directory
         self._create_temp_directory(os.path.join(dst_dir_path, self.unparsed_short_name), exist_ok=True)
 
         # save unparsed logs
         unparsed_file_name = f'{src_file_name}.{self.unparsed_short_name}{file_ext}'
-        unparsed_file_path = os.path.join(dst_dir_path, self.unparsed_short_name, unparsed_file_name)
+        unparsed_file_path = attempt_file_path(os.path.join(dst_dir_path, self.unparsed_short_name, unparsed_file_name))
 
-        with open(unparsed_file_path, mode='w+') as file:
-            self.log.debug(f'Creating file: {unparsed_file_path}')
+        with open(unparsed_file_path, mode='a' if append else 'w+') as file:
+            self.log.debug(f'{"Appending to" if append else "Creating"} file: {unparsed_file_path}')
             for log in unparsed_logs:
                 file.write(str(log) + '\n')
 
@@ -260,10 +968,19 @@ class FileParser(ParallelExecutor):
                 keys = filter(None, lines.split('\n'))
                 unique_keys.update(keys)
 
-            # sort keys so that user made fields (starting with '_') are a the beginning
-            sorted_keys = sorted(unique_keys,
-                                 key=lambda x: '0' + str(x).lower() if str(x).startswith('_') else '1' + str(x).lower())
-            headers_dict[parser_name] = sorted_keys
+            headers_dict[parser_name] = self.sort_table_headers(unique_keys)
+
+        return headers_dict
+
+    def _merge_table_headers(self, chunk_results: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        # union keys reported by the workers (no intermediate files are read)
+        headers_dict = dict()
+        for parser in self.log_parsers:
+            parser_name = str(parser.short_name)
+            unique_keys = set()
+            for chunk_result in chunk_results:
+                unique_keys.update(chunk_result['keys'][parser_name])
+            headers_dict[parser_name] = self.sort_table_headers(unique_keys)
 
         return headers_dict
 
@@ -272,12 +989,14 @@ class FileParser(ParallelExecutor):
                                   dst_dir_path: str,
                                   records_table_headers_dict: Dict[str, List[str]],
                                   ) -> None:
-        # get params for tabularizer function
-        params_list = []
+        # get params for tabularizer function (weighted by the size of record files)
+        params_list, weights = [], []
         for parser in self.log_parsers:
             # get directory with parser's output
             parser_name = str(parser.short_name)
             parser_results_dir = os.path.join(src_dir_path, parser_name)
+            if not os.path.exists(parser_results_dir):
+                continue
 
             # get chunk .records file paths
             chunk_records_file_names = self.get_sorted_chunk_names(src_dir_path=parser_results_dir,
@@ -294,10 +1013,14 @@ class FileParser(ParallelExecutor):
                         table_headers=records_table_headers_dict[parser_name]
                     )
                 )
+                weights.append(os.path.getsize(chunk_records_file_path))
 
         # convert record files into tables (tsv) with specified headers
+        if not params_list:
+            return
         self.execute_parallel_task(task=self._tabularize_parsed_chunk,
-                                   params_list=params_list)
+                                   params_list=params_list,
+                                   weights=weights)
 
     def _tabularize_parsed_chunk(self,
                                  parser_name: str,
@@ -309,50 +1032,259 @@ class FileParser(ParallelExecutor):
         src_file_dir, src_file_name, src_file_ext = self.split_file_path(src_file_path)
 
         # get result file path
-        dst_file_name = f'{src_file_name}.tsv'
-        dst_file_path = os.path.join(dst_dir_path, parser_name, dst_file_name)
+        dst_file_name = f'{src_file_name}{self.output_format.ext}'
+        dst_file_path = attempt_file_path(os.path.join(dst_dir_path, parser_name, dst_file_name))
 
-        # load records from file
-        with open(src_file_path) as file:
-            lines = file.readlines()
-        records = list(map(eval, lines))
+        record_format = self.record_format()
+        with open(src_file_path, mode='r' + record_format.file_mode_suffix) as file:
+            batches = record_format.load(file)
 
-        # format records as table
-        result_df = pd.DataFrame(columns=table_headers)
-        result_df = result_df.append(records, ignore_index=True)
+            # split the chunk into parts of output partitions
+            if self.partition_output:
+                self._write_chunk_partitions(parser_name, src_file_name, batches, dst_dir_path, table_headers)
+                return
 
-        # export table to tsv
-        self._create_temp_directory(os.path.join(dst_dir_path, parser_name), exist_ok=True)
-        self.export_df(result_df, dst_file_path)
+            # create output directory (if it doesn't already exist)
+            self._create_temp_directory(os.path.join(dst_dir_path, parser_name), exist_ok=True)
 
-    def _concatenate_tabularized_chunks(self, src_dir_path: str, dst_dir_path: str, orig_file_name_base: str) -> None:
+            # format records as table and export it with custom export function (requires the whole table in memory)
+            if self.export_df is not None:
+                batch_dfs = [pd.DataFrame(list(batch.records())) for batch in batches]
+                result_df = pd.concat([pd.DataFrame(columns=table_headers), *batch_dfs], ignore_index=True)
+                self.export_df(result_df, dst_file_path)
+                return
+
+            # sort the whole chunk into an indexed run of the sorted output (the chunk was held in memory at once when
+            # it was parsed anyway), records lacking the sort column altogether are left as they are
+            column_types = self._get_column_types(parser_name)
+            index_column = self.sort_column if self.sort_output and self.sort_column in table_headers else None
+            if index_column is not None:
+                run = ParsedBatch()
+                for batch in batches:
+                    run.extend(batch)
+                run.sort(index_column, TableIndex.get_key_func(column_types.get(index_column, 'string')))
+                batches = [run]
+
+            # stream batches of records into table of the output format (in headers order)
+            self.log.debug(f'Creating file: {dst_file_path}')
+            with self.output_format().open_table(dst_file_path, table_headers, column_types,
+                                                 index_column=index_column) as table:
+                for batch in batches:
+                    table.write_batch(batch)
+
+    def _write_chunk_partitions(self,
+                                parser_name: str,
+                                chunk_name: str,
+                                batches: Iterable[ParsedBatch],
+                                dst_dir_path: str,
+                                table_headers: List[str]
+                                ) -> None:
+        # group records of the whole chunk by partition (the chunk was held in memory at once when it was parsed
+        # anyway), partitioning only by columns the parser has (dates are the date part of datetimes)
+        partition_columns = [(key, column) for key, column in self.partition_columns if column in table_headers]
+        partitions: Dict[tuple, List[ParsedBatch]] = dict()
+        for batch in batches:
+            batch.pad()
+            values = [batch.columns.get(column) or [None] * batch.size for _, column in partition_columns]
+            values = [[v[:10] if v else None for v in column_values] if key == 'date' else column_values
+                      for (key, _), column_values in zip(partition_columns, values)]
+            record_ids: Dict[tuple, List[int]] = dict()
+            for record_id, partition_values in enumerate(zip(*values) if values else [()] * batch.size):
+                record_ids.setdefault(partition_values, []).append(record_id)
+            for partition_values, ids in record_ids.items():
+                if len(ids) == batch.size:
+                    partitions.setdefault(partition_values, []).append(batch)
+                else:
+                    partitions.setdefault(partition_values, []).append(
+                        ParsedBatch({k: [column[i] for i in ids] for k, column in batch.columns.items()}, len(ids)))
+
+        # every chunk writes its own part of each partition it has records of, so that no file is shared by workers
+        part_file_name = get_part_file_name(int(FILE_CHUNK_SORT_MASK.match(chunk_name).group('id')),
+                                            self.output_format.ext)
+        column_types = self._get_column_types(parser_name)
+        for partition_values, partition_batches in partitions.items():
+            partition_dir_names = [get_partition_dir_name('parser', parser_name)]
+            for (key, _), value in zip(partition_columns, partition_values):
+                partition_dir_names.append(get_partition_dir_name(key, value))
+            partition_dir_path = os.path.join(dst_dir_path, *partition_dir_names)
+            os.makedirs(partition_dir_path, exist_ok=True)
+            part_file_path = attempt_file_path(os.path.join(partition_dir_path, part_file_name))
+            self.log.debug(f'Creating file: {part_file_path}')
+            with self.output_format().open_table(part_file_path, table_headers, column_types) as table:
+                for batch in partition_batches:
+                    table.write_batch(batch)
+
+    def _concatenate_tabularized_chunks(self,
+                                        src_dir_path: str,
+                                        dst_dir_path: str,
+                                        orig_file_name_base: str,
+                                        records_table_headers_dict: Dict[str, List[str]]
+                                        ) -> None:
         # create separate output table for each parser
         for parser_no, parser in enumerate(self.log_parsers, start=1):
             # get directory with tables with data produced by the selected parser
             parser_name = str(parser.short_name)
             parser_tables_dir = os.path.join(src_dir_path, parser_name)
 
-            # get chunk .records file paths
+            # get chunk table file paths
             chunk_tables_file_names = self.get_sorted_chunk_names(src_dir_path=parser_tables_dir)
             chunk_tables_file_paths = [os.path.join(src_dir_path, parser_name, n) for n in chunk_tables_file_names]
 
-            # parse first of the table files paths
-            _, _, src_file_ext = self.split_file_path(chunk_tables_file_paths[0])
-
             # get final table file path
-            dst_file_name = f'{orig_file_name_base}.{parser_name}{src_file_ext}'
+            dst_file_name = f'{orig_file_name_base}.{parser_name}{self.output_format.ext}'
             dst_file_path = os.path.join(dst_dir_path, dst_file_name)
 
             # concatenate
-            for table_idx, table_file_path in enumerate(chunk_tables_file_paths, start=1):
-                self.log.info(f'(file {parser_no}/{len(self.log_parsers)}) Merging file chunk {table_idx} of'
-                              f' {len(chunk_tables_file_paths)}')
-                with open(dst_file_path, mode='a+') as dst_file:
-                    with open(table_file_path) as table_file:
-                        if table_idx > 1:
-                            next(table_file)
-                        lines = table_file.readlines()
-                    dst_file.writelines(lines)
+            with self.output_format().open_table(dst_file_path, records_table_headers_dict[parser_name],
+                                                 self._get_column_types(parser_name)) as table:
+                for table_idx, table_file_path in enumerate(chunk_tables_file_paths, start=1):
+                    self.log.info(f'(file {parser_no}/{len(self.log_parsers)}) Merging file chunk {table_idx} of'
+                                  f' {len(chunk_tables_file_paths)}')
+                    table.append_table(table_file_path)
+
+    def _merge_sorted_chunks(self,
+                             src_dir_path: str,
+                             dst_dir_path: str,
+                             orig_file_name_base: str,
+                             records_table_headers_dict: Dict[str, List[str]]
+                             ) -> None:
+        output_format = self.output_format()
+        run_ext_mask = rf'^.*{re.escape(self.output_format.ext)}$'
+
+        # split keys of each parser's sorted runs into ranges with similar numbers of rows (as run indexes hold keys of
+        # every `interval`-th row), so that each range can be merged from all runs by a separate task
+        params_list, weights, parts_dict = [], [], dict()
+        for parser in self.log_parsers:
+            parser_name = str(parser.short_name)
+            table_headers = records_table_headers_dict[parser_name]
+            runs_dir_path = os.path.join(src_dir_path, parser_name)
+            run_file_names = self.get_sorted_chunk_names(src_dir_path=runs_dir_path, mask=run_ext_mask) \
+                if os.path.exists(runs_dir_path) else []
+            run_file_paths = [os.path.join(runs_dir_path, n) for n in run_file_names]
+            dst_file_path = os.path.join(dst_dir_path, f'{orig_file_name_base}.{parser_name}{self.output_format.ext}')
+
+            # records lacking the sort column altogether (e.g. no records at all) are output in chunk order
+            if self.sort_column not in table_headers:
+                with output_format.open_table(dst_file_path, table_headers,
+                                              self._get_column_types(parser_name)) as table:
+                    for run_file_path in run_file_paths:
+                        table.append_table(run_file_path)
+                continue
+
+            keys = sorted(k for run_file_path in run_file_paths for k in output_format.read_index(run_file_path).keys)
+            parts_num = max(min(len(keys), 4 * self.max_processes * self.max_threads), 1)
+            bounds = [None, *sorted({keys[i * len(keys) // parts_num] for i in range(1, parts_num)}), None]
+            parts_dir_path = os.path.join(src_dir_path, f'{parser_name}_sorted')
+            self._create_temp_directory(parts_dir_path)
+            parts_dict[parser_name] = []
+            for part_idx, (start, end) in enumerate(zip(bounds, bounds[1:])):
+                part_file_path = os.path.join(parts_dir_path, f'part_{part_idx}{self.output_format.ext}')
+                parts_dict[parser_name].append(part_file_path)
+                params_list.append(
+                    params(
+                        parser_name=parser_name,
+                        run_file_paths=run_file_paths,
+                        dst_file_path=part_file_path,
+                        table_headers=table_headers,
+                        start=start,
+                        end=end
+                    )
+                )
+                start_idx = bisect.bisect_left(keys, start) if start is not None else 0
+                end_idx = bisect.bisect_left(keys, end) if end is not None else len(keys)
+                weights.append(max(end_idx - start_idx, 1))
+
+        # merge key ranges of runs into sorted parts in parallel
+        if params_list:
+            self.execute_parallel_task(task=self._merge_sorted_runs,
+                                       params_list=params_list,
+                                       weights=weights)
+
+        # concatenate sorted parts of each parser (along with their indexes)
+        for parser_no, (parser_name, part_file_paths) in enumerate(parts_dict.items(), start=1):
+            dst_file_path = os.path.join(dst_dir_path, f'{orig_file_name_base}.{parser_name}{self.output_format.ext}')
+            with output_format.open_table(dst_file_path, records_table_headers_dict[parser_name],
+                                          self._get_column_types(parser_name), index_column=self.sort_column) as table:
+                for part_idx, part_file_path in enumerate(part_file_paths, start=1):
+                    self.log.info(f'(file {parser_no}/{len(parts_dict)}) Merging sorted part {part_idx} of'
+                                  f' {len(part_file_paths)}')
+                    table.append_table(part_file_path)
+
+    def _merge_sorted_runs(self,
+                           parser_name: str,
+                           run_file_paths: List[str],
+                           dst_file_path: str,
+                           table_headers: List[str],
+                           start: Any = None,
+                           end: Any = None
+                           ) -> None:
+        # k-way merge rows of all runs within the key range (rows with equal keys are kept in the order of the runs)
+        output_format = self.output_format()
+        with output_format.open_table(attempt_file_path(dst_file_path), table_headers,
+                                      self._get_column_types(parser_name), index_column=self.sort_column) as table:
+            key, key_idx = table.index.key, table_headers.index(self.sort_column)
+            runs = [output_format.iter_range(run_file_path, start, end) for run_file_path in run_file_paths]
+            rows = heapq.merge(*runs, key=lambda row: key(row[key_idx]))
+            while block := list(itertools.islice(rows, table.index.interval)):
+                table.write_rows(block)
+
+    def _merge_tabularized_chunk_results(self,
+                                         chunk_results: List[Dict[str, Any]],
+                                         src_dir_path: str,
+                                         dst_dir_path: str,
+                                         orig_file_name_base: str,
+                                         records_table_headers_dict: Dict[str, List[str]]
+                                         ) -> None:
+        # create separate output table for each parser, writing records of chunks kept in memory directly and
+        # appending tables of chunks saved to files
+        for parser_no, parser in enumerate(self.log_parsers, start=1):
+            parser_name = str(parser.short_name)
+            dst_file_path = os.path.join(dst_dir_path, f'{orig_file_name_base}.{parser_name}{self.output_format.ext}')
+            with self.output_format().open_table(dst_file_path, records_table_headers_dict[parser_name],
+                                                 self._get_column_types(parser_name)) as table:
+                for chunk_idx, chunk_result in enumerate(chunk_results, start=1):
+                    self.log.info(f'(file {parser_no}/{len(self.log_parsers)}) Merging file chunk {chunk_idx} of'
+                                  f' {len(chunk_results)}')
+                    if chunk_result['batches'] is not None:
+                        table.write_batch(chunk_result['batches'][parser_name])
+                    else:
+                        table_file_name = f'{chunk_result["chunk_name"]}.{parser_name}{self.output_format.ext}'
+                        table.append_table(os.path.join(src_dir_path, parser_name, table_file_name))
+
+    def _merge_unparsed_chunk_results(self,
+                                      chunk_results: List[Dict[str, Any]],
+                                      src_dir_path: str,
+                                      dst_dir_path: str,
+                                      orig_file_path: str
+                                      ) -> None:
+        # write unparsed logs of chunks kept in memory directly and append files of chunks saved to files
+        _, orig_file_name_base, orig_file_ext = self.split_file_path(orig_file_path)
+        dst_file_name = f'{orig_file_name_base}.{self.unparsed_short_name}{orig_file_ext}'
+        with open(os.path.join(dst_dir_path, dst_file_name), mode='w') as dst_file:
+            for chunk_idx, chunk_result in enumerate(chunk_results, start=1):
+                self.log.info(f'(file 1/1) Merging file chunk {chunk_idx} of {len(chunk_results)}')
+                if chunk_result['unparsed_logs'] is not None:
+                    dst_file.writelines(str(log) + '\n' for log in chunk_result['unparsed_logs'])
+                else:
+                    unparsed_file_name = f'{chunk_result["chunk_name"]}.{self.unparsed_short_name}{orig_file_ext}'
+                    unparsed_file_path = os.path.join(src_dir_path, self.unparsed_short_name, unparsed_file_name)
+                    with open(unparsed_file_path, mode='rb') as unparsed_file:
+                        dst_file.flush()
+                        copy_file_data(unparsed_file, dst_file.buffer)
+
+    def _move_unparsed_chunks(self, src_dir_path: str, dst_dir_path: str) -> None:
+        # unparsed logs of each chunk (if any) are kept as they are next to the partitions, in a directory that hive
+        # readers skip (so that they are not read as a part of the dataset)
+        unparsed_dir_path = os.path.join(src_dir_path, self.unparsed_short_name)
+        partition_dir_path = os.path.join(dst_dir_path, f'_{self.unparsed_short_name}')
+        for chunk_file_name in self.get_sorted_chunk_names(src_dir_path=unparsed_dir_path):
+            chunk_file_path = os.path.join(unparsed_dir_path, chunk_file_name)
+            if os.path.getsize(chunk_file_path) == 0:
+                continue
+            os.makedirs(partition_dir_path, exist_ok=True)
+            _, _, chunk_file_ext = self.split_file_path(chunk_file_path)
+            chunk_id = int(FILE_CHUNK_SORT_MASK.match(chunk_file_name).group('id'))
+            os.replace(chunk_file_path, os.path.join(partition_dir_path, get_part_file_name(chunk_id, chunk_file_ext)))
 
     def _concatenate_unparsed_chunks(self, src_dir_path: str, dst_dir_path: str, orig_file_name_base: str) -> None:
 
@@ -369,13 +1301,21 @@ class FileParser(ParallelExecutor):
         dst_file_name = f'{orig_file_name_base}.{self.unparsed_short_name}{src_file_ext}'
         dst_file_path = os.path.join(dst_dir_path, dst_file_name)
 
-        # concatenate unparsed logs
-        for file_idx, unparsed_file_path in enumerate(chunk_unparsed_file_paths, start=1):
-            self.log.info(f'(file 1/1) Merging file chunk {file_idx} of {len(chunk_unparsed_file_paths)}')
-            with open(dst_file_path, mode='a+') as dst_file:
-                with open(unparsed_file_path) as unparsed_file:
-                    lines = unparsed_file.readlines()
-                dst_file.writelines(lines)
+        # concatenate unparsed logs (bytes are copied within the kernel where possible, without decoding lines)
+        with open(dst_file_path, mode='wb') as dst_file:
+            for file_idx, unparsed_file_path in enumerate(chunk_unparsed_file_paths, start=1):
+                self.log.info(f'(file 1/1) Merging file chunk {file_idx} of {len(chunk_unparsed_file_paths)}')
+                with open(unparsed_file_path, mode='rb') as unparsed_file:
+                    copy_file_data(unparsed_file, dst_file)
+
+    def _write_profile_report(self, src_dir_path: str, dst_dir_path: str, orig_file_name_base: str) -> None:
+        # text report with top functions per stage, and merged stats of all stages (e.g. for `python -m pstats`)
+        report_file_path = os.path.join(dst_dir_path, f'{orig_file_name_base}{self.profile_report_ext}')
+        stats_file_path = os.path.join(dst_dir_path, f'{orig_file_name_base}{self.profile_stats_ext}')
+        write_profile_report(dump_dir_path=src_dir_path,
+                             report_file_path=report_file_path,
+                             stats_file_path=stats_file_path)
+        self.log.info(f'Profile report saved: {report_file_path}')
 
     def _create_temp_directory(self, dir_path: str, exist_ok: bool = False, **kwargs) -> None:
         if os.path.exists(dir_path):
@@ -390,9 +1330,48 @@ class FileParser(ParallelExecutor):
             self.log.debug(f'Removing directory: {dir_path}')
             shutil.rmtree(dir_path)
 
+    @staticmethod
+    def sort_table_headers(keys: Iterable[str]) -> List[str]:
+        # sort keys so that user made fields (starting with '_') are a the beginning
+        return sorted(keys, key=lambda x: '0' + str(x).lower() if str(x).startswith('_') else '1' + str(x).lower())
+
+    @staticmethod
+    def _open_file_chunk(src_file_path: str, byte_range: Tuple[int, int] = None) -> Iterable[str]:
+        # compressed files are decompressed on the fly
+        if compression := get_compression(src_file_path):
+            offset, length = byte_range or (0, None)
+            return contextlib.closing(read_compressed_file_range(src_file_path, compression,
+                                                                 offset=offset, length=length))
+        if byte_range is None:
+            return open(src_file_path)
+        offset, length = byte_range
+        return contextlib.closing(read_file_range(src_file_path, offset=offset, length=length))
+
+    @staticmethod
+    def find_src_files(src_paths: Iterable[str]) -> List[str]:
+        """Expand paths of source files, glob patterns (matching files only) and directories (searched recursively,
+        skipping hidden entries) into a list of file paths without duplicates."""
+        src_file_paths = []
+        for src_path in src_paths:
+            if os.path.isdir(src_path):
+                for dir_path, dir_names, file_names in os.walk(src_path):
+                    dir_names[:] = sorted(n for n in dir_names if not n.startswith('.'))
+                    src_file_paths.extend(os.path.join(dir_path, n) for n in sorted(file_names)
+                                          if not n.startswith('.'))
+            elif os.path.isfile(src_path):
+                src_file_paths.append(src_path)
+            else:
+                src_file_paths.extend(p for p in sorted(glob.glob(src_path, recursive=True)) if os.path.isfile(p))
+        return list(dict.fromkeys(src_file_paths))
+
+    @staticmethod
+    def get_dir_size(dir_path: str) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(dir_path) if entry.is_file())
+
     @staticmethod
     def split_file_path(file_path: str) -> Tuple[str, str, str]:
-        file_dir, file_name = os.path.split(file_path)
+        # compressed files are named after their content (e.g. `x.log.gz` splits into `x` and `.log`)
+        file_dir, file_name = os.path.split(strip_compression_ext(file_path))
         file_name_base, file_name_ext = os.path.splitext(file_name)
         return file_dir, file_name_base, file_name_ext
 
@@ -404,8 +1383,9 @@ class FileParser(ParallelExecutor):
                 f'File name `{file_name}` does not match the sort key file mask.'
             return int(match.group('id'))
 
-        # get chunk file names matching mask and sort them using custom key
-        chunk_names = [f for f in os.listdir(src_dir_path) if re.match(mask, f)]
+        # get chunk file names matching mask and sort them using custom key (hidden files are written by task attempts
+        # of remote workers that were not accepted yet)
+        chunk_names = [f for f in os.listdir(src_dir_path) if not f.startswith('.') and re.match(mask, f)]
         sorted_chunk_names = sorted(chunk_names, key=key)
 
         return sorted_chunk_names
@@ -1,15 +1,213 @@
 import datetime
+import itertools
 import re
+import sys
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple, Type, Union
+
+from src.params_tokenizers import tokenize_cp_params, tokenize_hw_params_1, tokenize_hw_params_2
+from src.record_filters import RecordFilter
+
+
+DEFAULT_YEAR = 2020
+PARAMS_TOKENIZERS = ('regex', 'scan')
+MONTH_ABBREVIATIONS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
 
 
 class UnparsableLogError(Exception):
     pass
 
 
+class TimestampDecoder:
+    """Decode yearless syslog timestamps (e.g. `Nov 28 11:39:51`), caching results for recently seen timestamps."""
+
+    def __init__(self, year: int = DEFAULT_YEAR, timestamp_type: Type = str, cache_size: int = 4096):
+        assert int(cache_size) > 0, "Cache size has to be greater than zero."
+        self.year = int(year)
+        self.timestamp_type = timestamp_type
+        self.cache_size = int(cache_size)
+        self._months = {name: idx for idx, name in enumerate(MONTH_ABBREVIATIONS, start=1)}
+        self._cache = dict()
+
+    def decode(self, date_base: str) -> Tuple[Union[str, int], str]:
+        """Return compact timestamp (`%Y%m%d%H%M%S`) and datetime string (`%Y-%m-%d %H:%M:%S`)."""
+        if (result := self._cache.get(date_base)) is None:
+            # evict the oldest entry (logs are mostly ordered in time, so it's usually the least recently used one)
+            if len(self._cache) >= self.cache_size:
+                del self._cache[next(iter(self._cache))]
+            result = self._cache[date_base] = self._decode(date_base)
+        return result
+
+    def _decode(self, date_base: str) -> Tuple[Union[str, int], str]:
+        # decode fields arithmetically (invalid dates raise value error, just like `datetime.strptime` does)
+        month_name, day, time = date_base.split()
+        hour, minute, second = time.split(':')
+        if (month := self._months.get(month_name.lower())) is None:
+            raise ValueError(f'Unknown month abbreviation: `{month_name}`')
+        if len(day) > 2:
+            raise ValueError(f'Invalid day of the month: `{day}`')
+        date_dt = datetime.datetime(self.year, month, int(day), int(hour), int(minute), int(second))
+
+        timestamp = (f'{date_dt.year:04d}{date_dt.month:02d}{date_dt.day:02d}'
+                     f'{date_dt.hour:02d}{date_dt.minute:02d}{date_dt.second:02d}')
+        return self.timestamp_type(timestamp), str(date_dt)
+
+
+class RecordSchema:
+    """Interned field keys of records produced by a log parser along with caches of repeated field values, so that
+    records appended to batches share key and value objects instead of holding copies of their own.
+
+    Fields with too many distinct values (e.g. session ids) stop being cached, as are new keys once there are too many
+    of them (e.g. keys made of garbage in malformed params) and new values once all fields hold too many of them in
+    total (schema lives as long as the worker that parsers are cached by, unless it is cleared). Fields outside of the
+    projection (if there is one) are not appended to batches at all.
+    """
+
+    def __init__(self,
+                 max_fields: int = 10_000,
+                 max_field_values: int = 4096,
+                 max_values: int = 32_768,
+                 projection: FrozenSet[str] = None):
+        self.projection = projection
+        self.max_fields = max_fields
+        self.max_field_values = max_field_values
+        self.max_values = max_values
+        self.fields: Dict[str, str] = dict()  # raw key -> stripped and interned key
+        self.values: Dict[str, Optional[Dict[Any, Any]]] = dict()  # key -> value cache (none if not cached)
+        self.values_num = 0  # number of values cached by all fields
+
+    def clear(self) -> None:
+        """Drop cached keys and values (e.g. before parsing logs of another source)."""
+        self.fields.clear()
+        self.values.clear()
+        self.values_num = 0
+
+    def field(self, raw_key: str) -> str:
+        """Return stripped and interned key."""
+        if (key := self.fields.get(raw_key)) is None:
+            key = sys.intern(raw_key.strip())
+            if len(self.fields) < self.max_fields:
+                self.fields[raw_key] = key
+                self.values.setdefault(key, dict())
+        return key
+
+    def value(self, key: str, value: Any) -> Any:
+        """Return the cached object equal to the value (the value itself if it's new or not cached)."""
+        if (cache := self.values.get(key)) is None:
+            return value
+        if (cached_value := cache.get(value)) is not None:
+            return cached_value
+        if len(cache) >= self.max_field_values:
+            # values of the field are released once it turns out to have too many distinct ones
+            self.values[key] = None
+            self.values_num -= len(cache)
+        elif self.values_num < self.max_values:
+            cache[value] = value
+            self.values_num += 1
+        return value
+
+
+class ParsedBatch:
+    """Column oriented batch of records parsed by a single log parser (missing values are filled with none)."""
+
+    def __init__(self, columns: Dict[str, List[Any]] = None, size: int = 0, schema: RecordSchema = None):
+        self.columns = columns if columns is not None else dict()
+        self.size = size
+        self.schema = schema
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_rows(cls, headers: Sequence[str], rows: Sequence[Sequence[Any]]) -> 'ParsedBatch':
+        """Create batch of records given as rows of values ordered by headers."""
+        return cls({h: list(column) for h, column in zip(headers, zip(*rows))}, len(rows))
+
+    def append(self, keys: Iterable[str], values: Iterable[Any], params: Dict[str, Any] = None) -> None:
+        """Append a record given as keys and values, and optionally params with keys to be stripped."""
+        size, columns, schema = self.size, self.columns, self.schema
+        fields = zip(keys, values)
+        if params:
+            # schema strips keys (once per distinct raw key)
+            fields = itertools.chain(fields, params.items() if schema else ((k.strip(), v) for k, v in params.items()))
+        if schema is not None:
+            schema_fields, schema_values, projection = schema.fields, schema.values, schema.projection
+        for key, value in fields:
+            if schema is not None:
+                # look up caches directly, falling back to schema methods for keys and values not cached yet
+                key = schema_fields.get(key) or schema.field(key)
+                if projection is not None and key not in projection:
+                    continue
+                if (values_cache := schema_values.get(key)) is not None:
+                    value = values_cache.get(value) or schema.value(key, value)
+            if (column := columns.get(key)) is None:
+                column = columns[key] = [None] * size
+            elif len(column) > size:
+                # key repeated within the record, the latest value wins (as it does in a dict)
+                column[-1] = value
+                continue
+            elif len(column) < size:
+                column.extend([None] * (size - len(column)))
+            column.append(value)
+        self.size = size + 1
+
+    def extend(self, batch: 'ParsedBatch') -> None:
+        """Append all records of another batch."""
+        batch.pad()
+        for key, column in batch.columns.items():
+            if (own_column := self.columns.get(key)) is None:
+                own_column = self.columns[key] = [None] * self.size
+            elif len(own_column) < self.size:
+                own_column.extend([None] * (self.size - len(own_column)))
+            own_column.extend(column)
+        self.size += batch.size
+
+    def pad(self) -> None:
+        """Fill columns missing values at the end of the batch with none."""
+        for column in self.columns.values():
+            if len(column) < self.size:
+                column.extend([None] * (self.size - len(column)))
+
+    def memory_size(self, sample_size: int = 100) -> int:
+        """Estimate memory taken by the batch in bytes from sizes of a sample of values of each column (values shared
+        by many records are counted for each one)."""
+        size = sys.getsizeof(self.columns)
+        for column in self.columns.values():
+            sample = column[::max(len(column) // sample_size, 1)]
+            size += sys.getsizeof(column) + sum(map(sys.getsizeof, sample)) * len(column) // max(len(sample), 1)
+        return size
+
+    def rows(self, headers: Sequence[str]) -> Iterator[tuple]:
+        """Iterate over records as rows of values ordered by headers (missing columns are filled with none)."""
+        self.pad()
+        if not headers:
+            return iter([()] * self.size)
+        return zip(*(self.columns.get(h) or itertools.repeat(None, self.size) for h in headers))
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over records as dicts."""
+        keys = list(self.columns)
+        return (dict(zip(keys, row)) for row in self.rows(keys))
+
+    def sort(self, column: str, key: Callable[[Any], Any]) -> None:
+        """Sort records by the values of the column normalized with the key function (stable)."""
+        self.pad()
+        values = self.columns.get(column) or [None] * self.size
+        order = sorted(range(self.size), key=lambda idx: key(values[idx]))
+        self.columns = {k: [c[idx] for idx in order] for k, c in self.columns.items()}
+
+    def split(self, max_size: int) -> Iterator['ParsedBatch']:
+        """Iterate over consecutive slices of the batch holding at most given number of records."""
+        self.pad()
+        for start in range(0, self.size, max_size):
+            end = min(start + max_size, self.size)
+            yield ParsedBatch({k: c[start:end] for k, c in self.columns.items()}, end - start)
+
+
 class LogParser(ABC):
     """Abstract class for log parsers."""
+    column_types: Dict[str, str] = dict()  # types of typed output columns (any other column is a string column)
+    record_filter: Optional[RecordFilter] = None  # projection and predicates applied by `parse_batch`
 
     @property
     @abstractmethod
@@ -20,6 +218,39 @@ class LogParser(ABC):
     def parse(self, log_entry) -> Dict[str, str]:
         pass
 
+    @property
+    def schema(self) -> RecordSchema:
+        """Schema shared by all batches parsed by the parser (created on first use)."""
+        if (schema := self.__dict__.get('_schema')) is None:
+            projection = self.record_filter.fields if self.record_filter is not None else None
+            schema = self._schema = RecordSchema(projection=projection)
+        return schema
+
+    def sniff(self, log_entry: str) -> bool:
+        """Cheaply pre-check whether the entry can be parsed (false negatives are not allowed)."""
+        return True
+
+    def try_parse(self, log_entry: str) -> Optional[Dict[str, str]]:
+        """Parse log entry, return none instead of raising exception when it's unparsable."""
+        if not self.sniff(log_entry):
+            return None
+        try:
+            return self.parse(log_entry)
+        except UnparsableLogError:
+            return None
+
+    def parse_batch(self, log_entries: Sequence[str]) -> Tuple[ParsedBatch, List[int]]:
+        """Parse log entries into a column oriented batch, return it with indices of unparsable entries (parsed entries
+        rejected by the record filter are in neither)."""
+        batch, unparsed = ParsedBatch(schema=self.schema), []
+        record_filter, parser_name = self.record_filter, str(self.short_name)
+        for idx, log_entry in enumerate(log_entries):
+            if (record := self.try_parse(log_entry)) is None:
+                unparsed.append(idx)
+            elif record_filter is None or record_filter.accepts_record(parser_name, record):
+                batch.append(record.keys(), record.values())
+        return batch, unparsed
+
     def __repr__(self):
         return self.__class__.__name__
 
@@ -30,8 +261,17 @@ class LogParser(ABC):
 class CheckPointLogParser(LogParser):
     """Checkpoint firewall log parser."""
     short_name = 'cp'
+    column_types = {'_a_timestamp': 'int64', '_b_datetime': 'timestamp'}
 
-    def __init__(self):
+    def __init__(self,
+                 year: int = DEFAULT_YEAR,
+                 params_tokenizer: str = 'regex',
+                 record_filter: RecordFilter = None):
+        assert params_tokenizer in PARAMS_TOKENIZERS, \
+            f"Params tokenizer has to be one of: {', '.join(PARAMS_TOKENIZERS)}."
+        self.scan_params = params_tokenizer == 'scan'
+        self.record_filter = record_filter
+        self.timestamp_decoder = TimestampDecoder(year=year, timestamp_type=str)
         self.entry_mask = re.compile(r'^(\w+ [ ]?\d+ \d\d:\d\d:\d\d) '
                                      r'([\d.]+) '
                                      r'([+\-]\d\d:\d\d) '
@@ -42,7 +282,18 @@ class CheckPointLogParser(LogParser):
                                       r'\"(.*?)\"')
 
     def parse(self, log_entry: str) -> Dict[str, str]:
-        entry_parts = self._parse_entry(log_entry)
+        if (record := self.try_parse(log_entry)) is None:
+            raise UnparsableLogError('Input does not match entry mask.')
+        return record
+
+    def sniff(self, log_entry: str) -> bool:
+        # entries contain timezone offset preceded by a space
+        return ' +' in log_entry or ' -' in log_entry
+
+    def try_parse(self, log_entry: str) -> Optional[Dict[str, str]]:
+        if not self.sniff(log_entry) or not (match := self.entry_mask.match(log_entry)):
+            return None
+        entry_parts = self._parse_entry(match)
         params_str = entry_parts.pop('params')
         params_dict = self._parse_params(params_str)
         record = entry_parts | params_dict
@@ -52,31 +303,63 @@ class CheckPointLogParser(LogParser):
 
         return record
 
-    def _parse_entry(self, log_entry: str, year: str = '2020') -> Dict[str, Any]:
-        if not (match := self.entry_mask.match(log_entry)):
-            raise UnparsableLogError('Input does not match entry mask.')
-        date_base, interface_1, date_timezone, interface_2, params = match.groups()
+    def parse_batch(self, log_entries: Sequence[str]) -> Tuple[ParsedBatch, List[int]]:
+        # append entry fields and params straight into the batch columns (no intermediate record dicts)
+        batch, unparsed = ParsedBatch(schema=self.schema), []
+        entry_keys = ('_a_timestamp', '_b_datetime', '_c_interface_1', '_d_interface_2')
+
+        # records have no event names, so there is nothing to parse past entry masks when event names are filtered
+        record_filter = self.record_filter
+        drop_all = record_filter is not None and not (record_filter.accepts_parser(self.short_name)
+                                                      and record_filter.accepts_event_name(None))
+        with_params = record_filter is None or record_filter.needs_fields(entry_keys)
 
-        date_str = f'{year}  {date_base}'
-        date_dt = datetime.datetime.strptime(date_str, '%Y %b %d %H:%M:%S')
+        for idx, log_entry in enumerate(log_entries):
+            if not self.sniff(log_entry) or not (match := self.entry_mask.match(log_entry)):
+                unparsed.append(idx)
+                continue
+            if drop_all:
+                continue
+            date_base, interface_1, date_timezone, interface_2, params_str = match.groups()
+            timestamp, date_str = self.timestamp_decoder.decode(date_base)
+            if record_filter is not None and not record_filter.accepts_datetime(date_str):
+                continue
+            batch.append(entry_keys, (timestamp, date_str, interface_1, interface_2),
+                         self._parse_params(params_str) if with_params else None)
+        return batch, unparsed
+
+    def _parse_entry(self, match: re.Match) -> Dict[str, Any]:
+        date_base, interface_1, date_timezone, interface_2, params = match.groups()
+        timestamp, date_str = self.timestamp_decoder.decode(date_base)
 
         return {
-            '_a_timestamp': date_dt.strftime('%Y%m%d%H%M%S'),
-            '_b_datetime': str(date_dt),
+            '_a_timestamp': timestamp,
+            '_b_datetime': date_str,
             '_c_interface_1': interface_1,
             '_d_interface_2': interface_2,
             'params': params
         }
 
     def _parse_params(self, params_str: str) -> dict:
+        if self.scan_params and (params := tokenize_cp_params(params_str)) is not None:
+            return params
         return dict(self.params_mask.findall('" ' + params_str.strip()))
 
 
 class HuaweiLogParser(LogParser):
     """Huawei firewall log parser."""
     short_name = 'hw'
+    column_types = {'_a_timestamp': 'int64', '_b_datetime': 'timestamp'}
 
-    def __init__(self):
+    def __init__(self,
+                 year: int = DEFAULT_YEAR,
+                 params_tokenizer: str = 'regex',
+                 record_filter: RecordFilter = None):
+        assert params_tokenizer in PARAMS_TOKENIZERS, \
+            f"Params tokenizer has to be one of: {', '.join(PARAMS_TOKENIZERS)}."
+        self.scan_params = params_tokenizer == 'scan'
+        self.record_filter = record_filter
+        self.timestamp_decoder = TimestampDecoder(year=year, timestamp_type=int)
         self.entry_mask = re.compile(r'^(?P<timestamp_1>\w+ [ ]?\d+ \d\d:\d\d:\d\d) '
                                      r'(?:(?P<interface_1>[\d.]+) )?'
                                      r'(?:(?P<timestamp_2>\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d) )?'
@@ -97,7 +380,18 @@ class HuaweiLogParser(LogParser):
                                         r'(?:;)')
 
     def parse(self, log_entry: str) -> Dict[str, str]:
-        entry_parts = self._parse_entry(log_entry)
+        if (record := self.try_parse(log_entry)) is None:
+            raise UnparsableLogError('Input does not match entry mask.')
+        return record
+
+    def sniff(self, log_entry: str) -> bool:
+        # entries contain event name preceded by double percent sign
+        return '%%' in log_entry
+
+    def try_parse(self, log_entry: str) -> Optional[Dict[str, str]]:
+        if not self.sniff(log_entry) or not (match := self.entry_mask.match(log_entry)):
+            return None
+        entry_parts = self._parse_entry(match)
         params_str = entry_parts.pop('params')
         params_dict = self._parse_params_1(params_str)
         params_dict.update(self._parse_params_2(params_str))
@@ -108,9 +402,38 @@ class HuaweiLogParser(LogParser):
 
         return record
 
-    def _parse_entry(self, log_entry: str, year: str = '2020') -> Dict[str, Any]:
-        if not (match := self.entry_mask.match(log_entry)):
-            raise UnparsableLogError('Input does not match entry mask.')
+    def parse_batch(self, log_entries: Sequence[str]) -> Tuple[ParsedBatch, List[int]]:
+        # append entry fields and params straight into the batch columns (no intermediate record dicts)
+        batch, unparsed = ParsedBatch(schema=self.schema), []
+        entry_keys = ('_a_timestamp', '_b_datetime', '_c_interface_1', '_d_interface_2', '_e_event_name',
+                      '_f_event_brace_round', '_g_event_brace_square')
+        entry_groups = ('timestamp_1', 'interface_1', 'interface_2', 'event_name', 'event_brace_round',
+                        'event_brace_square', 'params')
+
+        # entry fields are checked against the record filter before params are extracted
+        record_filter = self.record_filter
+        drop_all = record_filter is not None and not record_filter.accepts_parser(self.short_name)
+        with_params = record_filter is None or record_filter.needs_fields(entry_keys)
+
+        for idx, log_entry in enumerate(log_entries):
+            if not self.sniff(log_entry) or not (match := self.entry_mask.match(log_entry)):
+                unparsed.append(idx)
+                continue
+            if drop_all:
+                continue
+            date_base, *entry_values, params_str = match.group(*entry_groups)
+            timestamp, date_str = self.timestamp_decoder.decode(date_base)
+            if record_filter is not None and not (record_filter.accepts_datetime(date_str)
+                                                  and record_filter.accepts_event_name(entry_values[2])):
+                continue
+            params_dict = None
+            if with_params:
+                params_dict = self._parse_params_1(params_str)
+                params_dict.update(self._parse_params_2(params_str))
+            batch.append(entry_keys, (timestamp, date_str, *entry_values), params_dict)
+        return batch, unparsed
+
+    def _parse_entry(self, match: re.Match) -> Dict[str, Any]:
         group_dict = match.groupdict()
 
         date_base = group_dict.get('timestamp_1')
@@ -121,12 +444,11 @@ class HuaweiLogParser(LogParser):
         event_brace_square = group_dict.get('event_brace_square')
         params = group_dict.get('params')
 
-        date_str = f'{year}  {date_base}'
-        date_dt = datetime.datetime.strptime(date_str, '%Y %b %d %H:%M:%S')
+        timestamp, date_str = self.timestamp_decoder.decode(date_base)
 
         return {
-            '_a_timestamp': int(date_dt.strftime('%Y%m%d%H%M%S')),
-            '_b_datetime': str(date_dt),
+            '_a_timestamp': timestamp,
+            '_b_datetime': date_str,
             '_c_interface_1': interface_1,
             '_d_interface_2': interface_2,
             '_e_event_name': event_name,
@@ -136,7 +458,97 @@ class HuaweiLogParser(LogParser):
         }
 
     def _parse_params_1(self, params_str: str) -> dict:
+        if self.scan_params and (params := tokenize_hw_params_1(params_str)) is not None:
+            return params
         return dict(self.params_mask_1.findall(',' + params_str.strip()))
 
     def _parse_params_2(self, params_str: str) -> dict:
+        if self.scan_params and (params := tokenize_hw_params_2(params_str)) is not None:
+            return params
         return dict(self.params_mask_2.findall(';' + params_str.strip()))
+
+
+class LogParserDispatcher:
+    """Dispatch log entries to the first log parser able to parse them and count per-parser hits and misses.
+
+    With adaptive ordering parsers are periodically reordered so that the most frequently hit parser is tried first,
+    which assumes that parsers accept disjoint sets of log entries (as is the case for the predefined parsers).
+    """
+
+    def __init__(self, parsers: Iterable[LogParser], adaptive: bool = True, reorder_interval: int = 1_000):
+        self.parsers = list(parsers)
+        self.adaptive = adaptive
+        self.reorder_interval = reorder_interval
+        self.hits = {p.short_name: 0 for p in self.parsers}
+        self.misses = {p.short_name: 0 for p in self.parsers}
+        self.filtered = {p.short_name: 0 for p in self.parsers}  # parsed, but rejected by record filters of parsers
+        self.unparsed = 0
+        self._until_reorder = reorder_interval
+
+    def dispatch(self, log_entry: str) -> Tuple[Optional[str], Optional[Dict[str, str]]]:
+        """Return name of the parser and the record (none if rejected by the record filter of the parser), or a pair of
+        nones if none of the parsers could parse the entry."""
+        if self.adaptive:
+            self._until_reorder -= 1
+            if self._until_reorder <= 0:
+                self.reorder()
+
+        for parser in self.parsers:
+            if (record := parser.try_parse(log_entry)) is not None:
+                self.hits[parser.short_name] += 1
+                if (record_filter := parser.record_filter) is not None \
+                        and not record_filter.accepts_record(parser.short_name, record):
+                    self.filtered[parser.short_name] += 1
+                    return parser.short_name, None
+                return parser.short_name, record
+            self.misses[parser.short_name] += 1
+
+        self.unparsed += 1
+        return None, None
+
+    def parse_batch(self, log_entries: Sequence[str]) -> Tuple[Dict[str, ParsedBatch], List[int]]:
+        """Return batches of records parsed by each parser and indices of entries none of the parsers could parse."""
+        if self.adaptive:
+            self._until_reorder -= len(log_entries)
+            if self._until_reorder <= 0:
+                self.reorder()
+
+        # pass entries left unparsed by each parser on to the next one
+        batches, pending = dict(), list(range(len(log_entries)))
+        for parser in self.parsers:
+            if not pending:
+                break
+            batch, unparsed = parser.parse_batch([log_entries[idx] for idx in pending])
+            batches[parser.short_name] = batch
+            # entries rejected by the record filter of the parser are neither in the batch nor unparsed
+            self.hits[parser.short_name] += len(pending) - len(unparsed)
+            self.misses[parser.short_name] += len(unparsed)
+            self.filtered[parser.short_name] += len(pending) - len(unparsed) - len(batch)
+            pending = [pending[idx] for idx in unparsed]
+
+        self.unparsed += len(pending)
+        return batches, pending
+
+    def reorder(self) -> None:
+        """Order parsers by the number of hits (descending)."""
+        self.parsers.sort(key=lambda p: self.hits[p.short_name], reverse=True)
+        self._until_reorder = self.reorder_interval
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'filtered': dict(self.filtered),
+            'unparsed': self.unparsed,
+        }
+
+    @staticmethod
+    def merge_stats(stats_list: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        merged = {'hits': {}, 'misses': {}, 'filtered': {}, 'unparsed': 0}
+        for stats in stats_list:
+            for counter in ('hits', 'misses', 'filtered'):
+                for parser_name, count in stats[counter].items():
+                    merged[counter][parser_name] = merged[counter].get(parser_name, 0) + count
+            merged['unparsed'] += stats['unparsed']
+        return merged
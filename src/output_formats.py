@@ -0,0 +1,347 @@
+import datetime
+import io
+import itertools
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple, Type
+
+from src.log_parsers import ParsedBatch
+from src.table_index import TableIndex
+from src.utils import copy_file_data, tsv_reader, tsv_writer
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+class OutputTable(ABC):
+    """Abstract class for output tables with fixed headers, written batch by batch.
+
+    Tables written in the order of one of their columns can be indexed by that column, in which case a sparse index of
+    the table is saved next to it when the table is closed.
+    """
+
+    def __init__(self,
+                 file_path: str,
+                 headers: List[str],
+                 column_types: Dict[str, str] = None,
+                 index_column: str = None):
+        self.file_path = file_path
+        self.headers = headers
+        self.column_types = column_types or dict()
+        self.index = None
+        if index_column is not None:
+            assert index_column in headers, f"Index column `{index_column}` is not one of the table headers."
+            self.index = TableIndex(index_column, self.column_types.get(index_column, 'string'))
+
+    @abstractmethod
+    def write_batch(self, batch: ParsedBatch) -> None:
+        pass
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        """Write rows of values ordered by headers (e.g. rows read back from tables of the same format)."""
+        rows = iter(rows)
+        while block := list(itertools.islice(rows, 10_000)):
+            self.write_batch(ParsedBatch.from_rows(self.headers, block))
+
+    @abstractmethod
+    def append_table(self, file_path: str) -> None:
+        """Append rows of a table previously written in the same output format (with the same or fewer headers)."""
+        pass
+
+    def flush(self) -> None:
+        """Push rows written so far out to the file (for tables read while they are still being written)."""
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TsvOutputTable(OutputTable):
+    """Tab separated table with all values quoted (same format as `df2tsv` produces)."""
+
+    def __init__(self,
+                 file_path: str,
+                 headers: List[str],
+                 column_types: Dict[str, str] = None,
+                 append: bool = False,
+                 index_column: str = None):
+        super().__init__(file_path, headers, column_types, index_column)
+        assert not (append and self.index is not None), "Indexed tables cannot be appended to."
+        self.file = open(file_path, mode='a' if append else 'w', encoding='utf8', newline='')
+        self.writer = tsv_writer(self.file)
+        if not append:
+            self.writer.writerow(headers)
+        self._block_rows = 0  # rows written into the current block of the index
+
+    def write_batch(self, batch: ParsedBatch) -> None:
+        self.write_rows(batch.rows(self.headers))
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        if self.index is None:
+            self.writer.writerows(rows)
+            return
+
+        # note byte offset of the first row of every block of rows
+        key_idx = self.headers.index(self.index.column)
+        rows = iter(rows)
+        while block := list(itertools.islice(rows, self.index.interval - self._block_rows)):
+            if self._block_rows == 0:
+                self.index.add(self.index.key(block[0][key_idx]), self.file.tell())
+            self.writer.writerows(block)
+            self._block_rows = (self._block_rows + len(block)) % self.index.interval
+
+    def append_table(self, file_path: str) -> None:
+        self.file.flush()
+        with open(file_path, mode='rb') as table_file:
+            # copy all lines but the header line if the headers match
+            table_headers = next(tsv_reader([table_file.readline().decode('utf8')]), [])
+            if table_headers == self.headers:
+                if self.index is not None and os.path.exists(index_file_path := file_path + TableIndex.ext):
+                    # shift offsets of the appended table by the difference in the offsets of their first rows
+                    self.index.extend(TableIndex.load(index_file_path), shift=self.file.tell() - table_file.tell())
+                    self._block_rows = 0
+                copy_file_data(table_file, self.file.buffer)
+                return
+
+            # otherwise place each table column under its header
+            header_ids = [self.headers.index(header) for header in table_headers]
+
+            def get_rows():
+                for table_row in tsv_reader(io.TextIOWrapper(table_file, encoding='utf8', newline='')):
+                    row = [None] * len(self.headers)
+                    for header_id, value in zip(header_ids, table_row):
+                        row[header_id] = value
+                    yield row
+
+            self.write_rows(get_rows())
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+        if self.index is not None:
+            self.index.save(self.file_path + TableIndex.ext)
+
+
+class ParquetOutputTable(OutputTable):
+    """Parquet table with typed columns, each written batch being stored as row groups."""
+    arrow_types = {
+        'string': pa.string() if pa else None,
+        'int64': pa.int64() if pa else None,
+        'timestamp': pa.timestamp('ms') if pa else None,  # parquet has no second resolution
+    }
+
+    def __init__(self,
+                 file_path: str,
+                 headers: List[str],
+                 column_types: Dict[str, str] = None,
+                 compression: str = 'snappy',
+                 row_group_size: int = None,
+                 index_column: str = None):
+        super().__init__(file_path, headers, column_types, index_column)
+        # row groups are the blocks of the index
+        self.row_group_size = row_group_size or (self.index.interval if self.index is not None else None)
+        self.schema = pa.schema([(h, self.arrow_types[self.column_types.get(h, 'string')]) for h in headers])
+        self.writer = pq.ParquetWriter(file_path, self.schema, compression=compression)
+
+    def write_batch(self, batch: ParsedBatch) -> None:
+        if not len(batch):
+            return
+        batch.pad()
+        arrays = []
+        for field in self.schema:
+            # parsed values are converted to the column type (e.g. timestamp strings to timestamps)
+            if (column := batch.columns.get(field.name)) is None:
+                arrays.append(pa.nulls(batch.size, type=field.type))
+            else:
+                arrays.append(pa.array(column).cast(field.type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema), row_group_size=self.row_group_size)
+
+    def append_table(self, file_path: str) -> None:
+        # copy row groups one at a time (columns missing in the table are filled with nulls)
+        table_file = pq.ParquetFile(file_path)
+        for row_group_idx in range(table_file.num_row_groups):
+            row_group = table_file.read_row_group(row_group_idx)
+            arrays = [row_group.column(field.name).cast(field.type) if field.name in row_group.column_names
+                      else pa.nulls(row_group.num_rows, type=field.type) for field in self.schema]
+            self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema),
+                                    row_group_size=self.row_group_size)
+
+    def close(self) -> None:
+        self.writer.close()
+        if self.index is None:
+            return
+
+        # index the first key of each row group (rows lacking the key are sorted first, so they are counted in)
+        metadata = pq.read_metadata(self.file_path)
+        column_idx = self.headers.index(self.index.column)
+        for row_group_idx in range(metadata.num_row_groups):
+            statistics = metadata.row_group(row_group_idx).column(column_idx).statistics
+            if statistics is None or not statistics.has_min_max:
+                key = self.index.key(pq.ParquetFile(self.file_path).read_row_group(
+                    row_group_idx, columns=[self.index.column]).column(0)[0].as_py())
+            else:
+                key = self.index.key(None if statistics.null_count else statistics.min)
+            self.index.add(key, row_group_idx)
+        self.index.save(self.file_path + TableIndex.ext)
+
+
+class OutputFormat(ABC):
+    """Abstract class for formats of final output tables."""
+    tsv = False
+    appendable = False
+
+    @property
+    @abstractmethod
+    def short_name(self) -> str:
+        pass
+
+    @property
+    @abstractmethod
+    def ext(self) -> str:
+        pass
+
+    @abstractmethod
+    def open_table(self,
+                   file_path: str,
+                   headers: List[str],
+                   column_types: Dict[str, str] = None,
+                   append: bool = False,
+                   index_column: str = None
+                   ) -> OutputTable:
+        """Open new table (or an existing table with the same headers for appending, if the format allows it),
+        optionally indexed by the column the table is written in the order of."""
+        pass
+
+    @abstractmethod
+    def read_headers(self, file_path: str) -> List[str]:
+        pass
+
+    @abstractmethod
+    def iter_rows(self, file_path: str, position: int = None) -> Iterator[Sequence[Any]]:
+        """Iterate over rows of the table starting with the block at the given position of its index."""
+        pass
+
+    @staticmethod
+    def read_index(file_path: str) -> TableIndex:
+        return TableIndex.load(file_path + TableIndex.ext)
+
+    def iter_range(self,
+                   file_path: str,
+                   start: Any = None,
+                   end: Any = None,
+                   index: TableIndex = None
+                   ) -> Iterator[Sequence[Any]]:
+        """Iterate over rows of an indexed table with keys within the range (start inclusive, end exclusive), seeking
+        straight to the block the range starts in."""
+        index = index or self.read_index(file_path)
+        key_idx = self.read_headers(file_path).index(index.column)
+        for row in self.iter_rows(file_path, index.find(start) if start is not None else None):
+            key = index.key(row[key_idx])
+            if start is not None and key < start:
+                continue
+            if end is not None and key >= end:
+                break
+            yield row
+
+    def __repr__(self):
+        return self.__class__.__name__
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class TsvOutputFormat(OutputFormat):
+    """Tab separated text tables with all columns as quoted strings."""
+    short_name = 'tsv'
+    ext = '.tsv'
+    tsv = True
+    appendable = True
+
+    def open_table(self,
+                   file_path: str,
+                   headers: List[str],
+                   column_types: Dict[str, str] = None,
+                   append: bool = False,
+                   index_column: str = None
+                   ) -> OutputTable:
+        return TsvOutputTable(file_path, headers, column_types, append=append, index_column=index_column)
+
+    def read_headers(self, file_path: str) -> List[str]:
+        with open(file_path, encoding='utf8', newline='') as file:
+            return next(tsv_reader(file), [])
+
+    def iter_rows(self, file_path: str, position: int = None) -> Iterator[Sequence[Any]]:
+        # position is the byte offset of a row (the first row follows the header line)
+        with open(file_path, mode='rb') as file:
+            if position is None:
+                file.readline()
+            else:
+                file.seek(position)
+            yield from tsv_reader(io.TextIOWrapper(file, encoding='utf8', newline=''))
+
+
+class ParquetOutputFormat(OutputFormat):
+    """Compressed Parquet tables with typed columns (requires `pyarrow` package)."""
+    short_name = 'parquet'
+    ext = '.parquet'
+
+    def __init__(self, compression: str = 'snappy', row_group_size: int = None):
+        assert pa is not None, "Parquet output format requires `pyarrow` package to be installed."
+        self.compression = compression
+        self.row_group_size = row_group_size
+
+    def open_table(self,
+                   file_path: str,
+                   headers: List[str],
+                   column_types: Dict[str, str] = None,
+                   append: bool = False,
+                   index_column: str = None
+                   ) -> OutputTable:
+        assert not append, "Parquet tables cannot be appended to in place."
+        return ParquetOutputTable(file_path, headers, column_types,
+                                  compression=self.compression,
+                                  row_group_size=self.row_group_size,
+                                  index_column=index_column)
+
+    def read_headers(self, file_path: str) -> List[str]:
+        return pq.read_schema(file_path).names
+
+    def iter_rows(self, file_path: str, position: int = None) -> Iterator[Sequence[Any]]:
+        # position is the number of a row group
+        table_file = pq.ParquetFile(file_path)
+        for row_group_idx in range(position or 0, table_file.num_row_groups):
+            row_group = table_file.read_row_group(row_group_idx)
+            yield from zip(*(column.to_pylist() for column in row_group.columns))
+
+
+OUTPUT_FORMATS: Dict[str, Type[OutputFormat]] = {
+    f.short_name: f for f in (TsvOutputFormat, ParquetOutputFormat)
+}
+
+
+def lookup_table(file_path: str,
+                 start: datetime.datetime = None,
+                 end: datetime.datetime = None
+                 ) -> Tuple[List[str], Iterator[Sequence[Any]]]:
+    """Return headers and rows of a time sorted output table logged within the time range (start inclusive, end
+    exclusive), read with the sidecar index of the table (indexed by compact `%Y%m%d%H%M%S` timestamps)."""
+    output_format_cls = next((f for f in OUTPUT_FORMATS.values() if file_path.endswith(f.ext)), None)
+    assert output_format_cls is not None, f"Unknown output format of the table: {file_path}"
+    output_format = output_format_cls()
+    assert os.path.exists(file_path + TableIndex.ext), f"Table has no index (it was not sorted): {file_path}"
+    index = output_format.read_index(file_path)
+    start_key = index.key(f'{start:%Y%m%d%H%M%S}') if start is not None else None
+    end_key = index.key(f'{end:%Y%m%d%H%M%S}') if end is not None else None
+    return output_format.read_headers(file_path), output_format.iter_range(file_path, start_key, end_key, index)
@@ -1,16 +1,24 @@
+import contextlib
 import multiprocessing
+import threading
 from multiprocessing.pool import ThreadPool
-from typing import Tuple, List, Iterable, Callable, Any, Union
+from typing import Tuple, List, Iterable, Iterator, Callable, Any, Union
 
+from src.profiling import profiled
 from src.utils import Timer, initialize_logger
 
 
 DEFAULT_PROCESS_NUM = multiprocessing.cpu_count() - 1
 DEFAULT_THREAD_NUM = 1
+SCHEDULING_MODES = ('static', 'dynamic')
 
 
 script_logger = initialize_logger('parallel_executor')
 
+# thread pool of a worker process reused by all of its tasks for as long as the process lives (its threads keep the
+# objects built for them, e.g. cached log parsers)
+PROCESS_THREAD_POOL = None
+
 
 def params(*args, **kwargs):
     return args, kwargs
@@ -22,7 +30,9 @@ class ParallelExecutor:
     def __init__(self,
                  max_processes: int = DEFAULT_PROCESS_NUM,
                  max_threads: int = DEFAULT_THREAD_NUM,
-                 auto_log_msg_prefix: str = ''):
+                 auto_log_msg_prefix: str = '',
+                 scheduling: str = 'static',
+                 coordinator: Any = None):
         self.log = script_logger
         self._auto_log_msg_prefix = auto_log_msg_prefix
 
@@ -32,44 +42,272 @@ class ParallelExecutor:
         assert int(max_processes) > 0, "Max number of threads per process has to be greater than zero."
         self.max_threads = int(max_threads)
 
+        assert scheduling in SCHEDULING_MODES, f"Scheduling mode has to be one of: {', '.join(SCHEDULING_MODES)}."
+        self.scheduling = scheduling
+        self._process_pool = None
+        self._thread_pool = None
+
+        # tasks are handed out to remote workers instead of local processes while there is a coordinator of them
+        # (see `src.distributed.Coordinator`)
+        self.coordinator = coordinator
+
+        # profiling is on while there is a directory for profile dumps (stage name is sent to workers with tasks)
+        self.profile_dir_path = None
+        self._profile_stage_name = None
+
+    def __enter__(self):
+        self.open_pool()
+        return self
+
+    def __exit__(self, *args):
+        self.close_pool()
+
+    def __getstate__(self):
+        # process pool stays with the process that opened it (executor is pickled along with tasks sent to workers)
+        state = self.__dict__.copy()
+        state['_process_pool'] = None
+        state['_thread_pool'] = None
+        state['coordinator'] = None
+        return state
+
+    @property
+    def pool_open(self) -> bool:
+        return self._process_pool is not None or self._thread_pool is not None
+
+    def open_pool(self) -> None:
+        """Start a persistent process pool (or a thread pool, if tasks are executed by a single process) reused by all
+        parallel tasks until it is closed."""
+        if self.pool_open:
+            return
+        if self.max_processes >= 2:
+            self.log.info(f'{self._auto_log_msg_prefix}Initializing persistent process pool...')
+            self._process_pool = multiprocessing.Pool(self.max_processes, initializer=self._init_process)
+            self.log.info(f'{self._auto_log_msg_prefix}Persistent process pool initialized with {self.max_processes} '
+                          f'workers')
+        elif self.max_threads >= 2:
+            self.log.info(f'{self._auto_log_msg_prefix}Initializing persistent thread pool...')
+            self._thread_pool = ThreadPool(self.max_threads, initializer=self._init_worker)
+            self.log.info(f'{self._auto_log_msg_prefix}Persistent thread pool initialized with {self.max_threads} '
+                          f'threads')
+
+    def close_pool(self) -> None:
+        if self._process_pool is not None:
+            self._process_pool.close()
+            self._process_pool.join()
+            self._process_pool = None
+            self.log.info(f'{self._auto_log_msg_prefix}Persistent process pool closed')
+        if self._thread_pool is not None:
+            self._thread_pool.close()
+            self._thread_pool.join()
+            self._thread_pool = None
+            self.log.info(f'{self._auto_log_msg_prefix}Persistent thread pool closed')
+
+    @contextlib.contextmanager
+    def persistent_pool(self) -> Iterator[None]:
+        """Keep a persistent pool open for the block (unless one is open already or tasks are handed out to remote
+        workers), so that all stages executed within it share the same workers."""
+        if self.pool_open or self.coordinator is not None:
+            yield
+            return
+        self.open_pool()
+        try:
+            yield
+        finally:
+            self.close_pool()
+
+    @contextlib.contextmanager
+    def profile_stage(self, stage_name: str) -> Iterator[None]:
+        """Profile the block run by the main process and parallel tasks executed within it as the given stage."""
+        if self.profile_dir_path is None:
+            yield
+            return
+        self._profile_stage_name = stage_name
+        try:
+            with profiled(self.profile_dir_path, stage_name, self.worker_name()):
+                yield
+        finally:
+            self._profile_stage_name = None
+
+    def _profile_task(self, task_id: int) -> contextlib.AbstractContextManager:
+        if self.profile_dir_path is None or self._profile_stage_name is None:
+            return contextlib.nullcontext()
+        return profiled(self.profile_dir_path, self._profile_stage_name, self.worker_name(), task_id)
+
+    def _init_worker(self) -> None:
+        """Prepare worker process (or thread) before it executes any task (e.g. build objects reused by all of its
+        tasks)."""
+        pass
+
+    def _init_process(self) -> None:
+        # threads of the worker process are started once and reused by all of its tasks
+        global PROCESS_THREAD_POOL
+        self._init_worker()
+        if self.max_threads >= 2:
+            PROCESS_THREAD_POOL = ThreadPool(self.max_threads, initializer=self._init_worker)
+
+    @contextlib.contextmanager
+    def _get_process_pool(self, processes_num: int) -> Iterator[multiprocessing.pool.Pool]:
+        # use persistent process pool if there is one, otherwise use a new pool closed as soon as tasks are done
+        if self._process_pool is not None:
+            yield self._process_pool
+            return
+
+        self.log.info(f'{self._auto_log_msg_prefix}Initializing process pool...')
+        with multiprocessing.Pool(processes_num, initializer=self._init_process) as process_pool:
+            self.log.info(f'{self._auto_log_msg_prefix}Process pool initialized with {processes_num} workers')
+            yield process_pool
+
+            # clean up
+            process_pool.close()
+            process_pool.join()
+        self.log.info(f'{self._auto_log_msg_prefix}Process pool closed')
+
+    @contextlib.contextmanager
+    def _get_thread_pool(self, threads_num: int) -> Iterator[ThreadPool]:
+        # use persistent thread pool of the process if there is one, otherwise use a new pool closed as soon as tasks
+        # are done
+        if (thread_pool := self._thread_pool or PROCESS_THREAD_POOL) is not None:
+            yield thread_pool
+            return
+
+        self.log.info(f'{self._auto_log_msg_prefix}Initializing thread pool...')
+        with ThreadPool(threads_num) as thread_pool:
+            self.log.info(f'{self._auto_log_msg_prefix}Thread pool initialized with {threads_num} threads')
+            yield thread_pool
+
+            # clean up
+            thread_pool.close()
+            thread_pool.join()
+        self.log.info(f'{self._auto_log_msg_prefix}Thread pool closed')
+
     def execute_parallel_task(self,
                               task: Callable,
-                              params_list: List[Tuple[tuple, dict]]
+                              params_list: List[Tuple[tuple, dict]],
+                              weights: List[float] = None
                               ) -> List[Union[Any, Exception]]:
         assert any(params_list) is not None, "No params were passed."
         effective_processes_num = min(self.max_processes, len(params_list))
 
         enum_params_list = [((idx, len(params_list)), params) for idx, params in enumerate(params_list, start=1)]
+
+        with Timer() as timer:
+            if self.coordinator is not None:
+                results, worker_stats = self._execute_distributed(task, enum_params_list, weights)
+            elif self.scheduling == 'dynamic':
+                results, worker_stats = self._execute_dynamic(task, enum_params_list, effective_processes_num, weights)
+            else:
+                results, worker_stats = self._execute_static(task, enum_params_list, effective_processes_num)
+        self._log_worker_utilization(worker_stats, timer.time)
+
+        # get result values from task_id-value pairs ordered by the task id
+        results_sorted = list(list(zip(*sorted(results, key=lambda x: x[0]))).pop())
+
+        return results_sorted
+
+    def _execute_static(self,
+                        task: Callable,
+                        enum_params_list: List[Tuple[Tuple[int, int], Tuple[tuple, dict]]],
+                        effective_processes_num: int
+                        ) -> Tuple[List[Tuple[int, Union[Any, Exception]]], List[Tuple[str, int, float]]]:
+        # spread tasks round-robin over processes up front
         params_chunks = self.spread(enum_params_list, effective_processes_num)
 
         if effective_processes_num >= 2:
-            self.log.info(f'{self._auto_log_msg_prefix}Initializing process pool...')
-            with multiprocessing.Pool(effective_processes_num) as process_pool:
-                self.log.info(f'{self._auto_log_msg_prefix}Process pool initialized with {effective_processes_num} '
-                              f'workers')
+            with self._get_process_pool(effective_processes_num) as process_pool:
                 result_objects = []
                 for process_task_id in range(1, effective_processes_num + 1):
                     task_result = process_pool.apply_async(
-                        func=self._process_task,
+                        func=self._timed_process_task,
                         args=(task, params_chunks[process_task_id - 1])
                     )
                     result_objects.append(task_result)
 
-                # clean up
-                process_pool.close()
-                process_pool.join()
-                self.log.info(f'{self._auto_log_msg_prefix}Process pool closed')
-
                 # get unordered results
-                results = [(task_id, r) for ro in result_objects for (task_id, r) in ro.get()]
+                process_results = [ro.get() for ro in result_objects]
+            results = [(task_id, r) for (task_results, _) in process_results for (task_id, r) in task_results]
+            worker_stats = [stats for (_, stats) in process_results]
 
         else:
-            results = self._process_task(task, params_chunks[0])
+            results, stats = self._timed_process_task(task, params_chunks[0])
+            worker_stats = [stats]
 
-        # get result values from task_id-value pairs ordered by the task id
-        results_sorted = list(list(zip(*sorted(results, key=lambda x: x[0]))).pop())
+        return results, worker_stats
 
-        return results_sorted
+    def _execute_dynamic(self,
+                         task: Callable,
+                         enum_params_list: List[Tuple[Tuple[int, int], Tuple[tuple, dict]]],
+                         effective_processes_num: int,
+                         weights: List[float] = None
+                         ) -> Tuple[List[Tuple[int, Union[Any, Exception]]], List[Tuple[str, int, float]]]:
+        # hand out tasks one at a time to whichever worker is free, the heaviest tasks first (if weights are known)
+        if weights is not None:
+            assert len(weights) == len(enum_params_list), "Number of weights has to match the number of params."
+            enum_params_list = [p for _, p in sorted(zip(weights, enum_params_list), key=lambda x: -x[0])]
+        scheduled_params_list = [(task, task_id, task_total, task_args, task_kwargs)
+                                 for (task_id, task_total), (task_args, task_kwargs) in enum_params_list]
+
+        if effective_processes_num >= 2:
+            with self._get_process_pool(effective_processes_num) as process_pool:
+                task_results = list(process_pool.imap_unordered(self._scheduled_task, scheduled_params_list))
+        elif (effective_threads_num := min(self.max_threads, len(scheduled_params_list))) >= 2:
+            with self._get_thread_pool(effective_threads_num) as thread_pool:
+                task_results = list(thread_pool.imap_unordered(self._scheduled_task, scheduled_params_list))
+        else:
+            task_results = [self._scheduled_task(p) for p in scheduled_params_list]
+
+        return self._sum_worker_stats(task_results)
+
+    def _execute_distributed(self,
+                             task: Callable,
+                             enum_params_list: List[Tuple[Tuple[int, int], Tuple[tuple, dict]]],
+                             weights: List[float] = None
+                             ) -> Tuple[List[Tuple[int, Union[Any, Exception]]], List[Tuple[str, int, float]]]:
+        # hand out tasks one at a time to whichever remote worker is free, the heaviest tasks first (if weights are
+        # known), the executor being sent to the workers along with each task
+        if weights is not None:
+            assert len(weights) == len(enum_params_list), "Number of weights has to match the number of params."
+            enum_params_list = [p for _, p in sorted(zip(weights, enum_params_list), key=lambda x: -x[0])]
+        calls = [(self._scheduled_task, ((task, task_id, task_total, task_args, task_kwargs), ))
+                 for (task_id, task_total), (task_args, task_kwargs) in enum_params_list]
+        self.log.info(f'{self._auto_log_msg_prefix}Handing out {len(calls)} tasks to remote workers...')
+        task_results = self.coordinator.execute(calls)
+
+        return self._sum_worker_stats(task_results)
+
+    @staticmethod
+    def _sum_worker_stats(task_results: List[Tuple[int, Union[Any, Exception], str, float]]
+                          ) -> Tuple[List[Tuple[int, Union[Any, Exception]]], List[Tuple[str, int, float]]]:
+        # sum up busy time of each worker
+        results = []
+        worker_stats = dict()
+        for task_id, result, worker_name, busy_time in task_results:
+            results.append((task_id, result))
+            tasks_num, total_busy_time = worker_stats.get(worker_name, (0, 0.0))
+            worker_stats[worker_name] = (tasks_num + 1, total_busy_time + busy_time)
+
+        return results, [(name, tasks_num, busy_time) for name, (tasks_num, busy_time) in worker_stats.items()]
+
+    def _scheduled_task(self,
+                        scheduled_params: Tuple[Callable, int, int, tuple, dict]
+                        ) -> Tuple[int, Union[Any, Exception], str, float]:
+        with Timer() as timer:
+            task_id, result = self._thread_task(*scheduled_params)
+        return task_id, result, self.worker_name(), timer.time
+
+    def _timed_process_task(self,
+                            task: Callable,
+                            params_list: List[Tuple[Tuple[int, int], Tuple[tuple, dict]]]
+                            ) -> Tuple[List[Tuple[int, Union[Any, Exception]]], Tuple[str, int, float]]:
+        with Timer() as timer:
+            results = self._process_task(task, params_list)
+        return results, (self.worker_name(), len(params_list), timer.time)
+
+    def _log_worker_utilization(self, worker_stats: List[Tuple[str, int, float]], wall_time: float) -> None:
+        # report share of the wall time each worker spent executing tasks
+        for worker_name, tasks_num, busy_time in sorted(worker_stats):
+            utilization = busy_time / wall_time if wall_time > 0 else 1.0
+            self.log.info(f'{self._auto_log_msg_prefix}Worker `{worker_name}`: {tasks_num} tasks, busy for '
+                          f'{busy_time:.3f}s ({utilization:.0%} of {wall_time:.3f}s)')
 
     def _process_task(self,
                       task: Callable,
@@ -81,10 +319,7 @@ class ParallelExecutor:
         results = []
         if effective_threads_num >= 2:
             result_objects = []
-            self.log.info(f'{self._auto_log_msg_prefix}Initializing thread pool...')
-            with ThreadPool(effective_threads_num) as thread_pool:
-                self.log.info(f'{self._auto_log_msg_prefix}Thread pool initialized with {effective_threads_num} '
-                              f'threads')
+            with self._get_thread_pool(effective_threads_num) as thread_pool:
                 for (task_id, task_total), (task_args, task_kwargs) in params_list:
                     thread_result = thread_pool.apply_async(
                         func=self._thread_task,
@@ -92,12 +327,9 @@ class ParallelExecutor:
                     )
                     result_objects.append(thread_result)
 
-                # clean up
-                thread_pool.close()
-                thread_pool.join()
-                self.log.info(f'{self._auto_log_msg_prefix}Thread pool closed')
-
-                # get results
+                # get results (waiting for all of them, as the pool may outlive the tasks)
+                for ro in result_objects:
+                    ro.wait()
                 for ro in result_objects:
                     try:
                         (task_id, result) = ro.get()
@@ -130,7 +362,7 @@ class ParallelExecutor:
                      ) -> Tuple[int, Union[Any, Exception]]:
         self.log.info(f'{self._auto_log_msg_prefix}Executing task {task_id} of {task_total}...')
         try:
-            with Timer() as timer:
+            with self._profile_task(task_id), Timer() as timer:
                 result = task(*task_args, **task_kwargs)
             self.log.info(f'{self._auto_log_msg_prefix}Task {task_id} completed (wall time: {timer.time_string})')
         except Exception as e:
@@ -142,6 +374,10 @@ class ParallelExecutor:
 
         return task_id, result
 
+    @staticmethod
+    def worker_name() -> str:
+        return f'{multiprocessing.current_process().name} {threading.current_thread().name}'
+
     @staticmethod
     def spread(lst: Iterable, n: int) -> List[List[Any]]:
         chunks = [[] for _ in range(n)]
@@ -0,0 +1,183 @@
+"""Linear time tokenizers of log params, equivalent to the params regexes of the predefined log parsers.
+
+Each tokenizer returns exactly the same dict as `dict(params_mask.findall(prefix + params_str.strip()))` does for
+the matching log parser mask, or none for rare inputs outside of its scope (e.g. multiline params), in which case
+the caller is expected to fall back to the regex. Well-formed params are handled with a few bulk string operations,
+anything else with a single forward scan.
+"""
+import re
+from typing import Dict, Optional
+
+
+HW_PARAMS_1_INVALID_KEY_MASK = re.compile(r'[\s()&,]')
+HW_PARAMS_2_INVALID_KEY_MASK = re.compile(r'[()&,]')
+
+
+def tokenize_cp_params(params_str: str) -> Optional[Dict[str, str]]:
+    """Tokenize `key="value" key:="value"` params (see `CheckPointLogParser.params_mask`)."""
+    s = params_str.strip()
+    if '\n' in s:
+        return None
+
+    # well-formed params: every quoted value is preceded by `key=` or `key:=` and followed by a space
+    parts = s.split('"')
+    values = parts[1:-1:2]
+    if not values:
+        return {}
+    keys_str = '"'.join(parts[0:-2:2])
+    if keys_str[-1:] == '=' and keys_str.count('=" ') == len(values) - 1:
+        keys = (keys_str + '" ').replace(':=" ', '=" ').split('=" ')
+        keys.pop()
+        return dict(zip(keys, values))
+
+    params = {}
+    key_start = 0
+    while (assignment := s.find('="', key_start)) != -1:
+        if (value_end := s.find('"', assignment + 2)) == -1:
+            break
+        key_end = assignment - 1 if assignment > key_start and s[assignment - 1] == ':' else assignment
+        params[s[key_start:key_end]] = s[assignment + 2:value_end]
+
+        # next key starts after the closing quote followed by a space
+        if (separator := s.find('" ', value_end)) == -1:
+            break
+        key_start = separator + 2
+
+    return params
+
+
+def tokenize_hw_params_1(params_str: str) -> Optional[Dict[str, str]]:
+    """Tokenize `(key=value, key="value").` params (see `HuaweiLogParser.params_mask_1`)."""
+    s = params_str.strip()
+    if '\n' in s:
+        return None
+
+    # well-formed params: comma separated `key=value` pairs with valid keys
+    parts = s.split(',')
+    if s[-1:] in ('.', ')'):
+        parts[-1] = parts[-1][:-1]
+    else:
+        parts.pop()
+    try:
+        params = dict(part.removeprefix(' ').split('=', 1) for part in parts)
+    except ValueError:
+        pass
+    else:
+        if '"' in s:
+            params = {k: v.removeprefix('"').removesuffix('"') for k, v in params.items()}
+        if '' not in params and not HW_PARAMS_1_INVALID_KEY_MASK.search('\0'.join(params)):
+            return params
+
+    params = {}
+    n = len(s)
+    ends_with_terminator = s[-1:] in ('.', ')')
+    key_starts = _KeyStarts(s, separator=',', bracket='(')
+    assignments, commas = _Occurrences(s, '='), _Occurrences(s, ',')
+    invalid_chars = _Occurrences(s, mask=HW_PARAMS_1_INVALID_KEY_MASK)
+    pos = 0
+    while (key_start := key_starts.find(pos)) != -1:
+        if (assignment := assignments.find(key_start + 1)) == -1:
+            break
+        if (invalid_char := invalid_chars.find(key_start)) != -1 and invalid_char < assignment:
+            pos = key_start + 1
+            continue
+
+        # value (optionally quoted) ends with a comma, or with a dot or a closing round bracket at the end of params
+        value_start = assignment + 2 if assignment + 1 < n and s[assignment + 1] == '"' else assignment + 1
+        if (terminator := commas.find(value_start)) == -1:
+            if not ends_with_terminator:
+                break
+            terminator = n - 1
+        value_end = terminator - 1 if terminator - 1 >= value_start and s[terminator - 1] == '"' else terminator
+        params[s[key_start:assignment]] = s[value_start:value_end]
+        pos = terminator + 1
+
+    return params
+
+
+def tokenize_hw_params_2(params_str: str) -> Optional[Dict[str, str]]:
+    """Tokenize `key:value; key:"value";` params (see `HuaweiLogParser.params_mask_2`)."""
+    s = params_str.strip()
+    if '\n' in s:
+        return None
+
+    # well-formed params: semicolon terminated `key:value` pairs with valid keys
+    parts = s.split(';')
+    parts.pop()
+    try:
+        params = dict(part.split(':', 1) for part in parts)
+    except ValueError:
+        pass
+    else:
+        if '"' in s:
+            params = {k: v.removeprefix('"').removesuffix('"') for k, v in params.items()}
+        keys_str = '\0'.join(params)
+        if ('' not in params and keys_str[:1] != '[' and '\0[' not in keys_str
+                and not HW_PARAMS_2_INVALID_KEY_MASK.search(keys_str)):
+            return params
+
+    params = {}
+    n = len(s)
+    key_starts = _KeyStarts(s, separator=';', bracket='(')
+    assignments, semicolons = _Occurrences(s, ':'), _Occurrences(s, ';')
+    invalid_chars = _Occurrences(s, mask=HW_PARAMS_2_INVALID_KEY_MASK)
+    pos = 0
+    while (key_start := key_starts.find(pos)) != -1:
+        # keys prefixed with square brackets are matched greedily by the regex, leave them to it
+        if s[key_start:key_start + 1] == '[':
+            return None
+        if (assignment := assignments.find(key_start + 1)) == -1:
+            break
+        if (invalid_char := invalid_chars.find(key_start)) != -1 and invalid_char < assignment:
+            pos = key_start + 1
+            continue
+
+        # value (optionally quoted) ends with a semicolon
+        value_start = assignment + 2 if assignment + 1 < n and s[assignment + 1] == '"' else assignment + 1
+        if (terminator := semicolons.find(value_start)) == -1:
+            break
+        value_end = terminator - 1 if terminator - 1 >= value_start and s[terminator - 1] == '"' else terminator
+        params[s[key_start:assignment]] = s[value_start:value_end]
+        pos = terminator + 1
+
+    return params
+
+
+class _Occurrences:
+    """Find next occurrence of a substring (or a mask match), caching it so that a forward scan stays linear."""
+
+    def __init__(self, s: str, sub: str = None, mask: re.Pattern = None):
+        self.s = s
+        self.sub = sub
+        self.mask = mask
+        self._idx = None
+
+    def find(self, pos: int) -> int:
+        # positions have to be passed in non-decreasing order
+        if self._idx is None or self._idx != -1 and self._idx < pos:
+            if self.mask is None:
+                self._idx = self.s.find(self.sub, pos)
+            else:
+                self._idx = match.start() if (match := self.mask.search(self.s, pos)) else -1
+        return self._idx
+
+
+class _KeyStarts:
+    """Find next position preceded by the separator, the separator and a space, or the opening bracket."""
+
+    def __init__(self, s: str, separator: str, bracket: str):
+        self.separators = _Occurrences(s, separator)
+        self.brackets = _Occurrences(s, bracket)
+        self.spaced_separators = _Occurrences(s, separator + ' ')
+
+    def find(self, pos: int) -> int:
+        # the beginning of params counts as preceded by the separator
+        if pos == 0:
+            return 0
+        key_start = -1
+        for idx, prefix_length in ((self.separators.find(pos - 1), 1),
+                                   (self.brackets.find(pos - 1), 1),
+                                   (self.spaced_separators.find(max(pos - 2, 0)), 2)):
+            if idx != -1 and (key_start == -1 or idx + prefix_length < key_start):
+                key_start = idx + prefix_length
+        return key_start
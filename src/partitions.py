@@ -0,0 +1,48 @@
+"""Hive style partitioned layout of output tables (e.g. `parser=hw/date=2020-11-28/event=<name>/part-00001.tsv`).
+
+Partition values are percent-encoded in directory names (e.g. `/` of event names) and records lacking a value end up in
+the default partition, as in the layouts written by Hive and read by `pyarrow.dataset` with hive partitioning. Entries
+named with a `_` or `.` prefix (e.g. `_na` with unparsed logs) are not a part of the dataset, as hive readers skip them.
+"""
+import os
+import re
+import urllib.parse
+from typing import Any, Callable, List, Optional, Tuple
+
+
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+IGNORED_PREFIXES = ('.', '_')
+PART_FILE_MASK = re.compile(r'^part-(?P<id>\d+)(?:[.].*)?$')
+
+
+def get_partition_dir_name(key: str, value: Any) -> str:
+    if value is None or value == '':
+        return f'{key}={DEFAULT_PARTITION}'
+    return f'{key}={urllib.parse.quote(str(value), safe="")}'
+
+
+def parse_partition_dir_name(dir_name: str) -> Tuple[str, Optional[str]]:
+    key, _, value = dir_name.partition('=')
+    return key, None if value == DEFAULT_PARTITION else urllib.parse.unquote(value)
+
+
+def get_part_file_name(part_id: int, ext: str) -> str:
+    return f'part-{part_id:05d}{ext}'
+
+
+def find_partition_files(dir_path: str, **predicates: Callable[[Optional[str]], bool]) -> List[str]:
+    """Return paths of part files of partitions whose values are accepted by predicates given for their keys (e.g.
+    `parser=lambda v: v == 'hw', date=lambda v: v >= '2020-11-28'`), skipping rejected partitions without listing
+    their directories."""
+    file_paths = []
+    entries = sorted(os.scandir(dir_path), key=lambda e: e.name)
+    for entry in entries:
+        if entry.name.startswith(IGNORED_PREFIXES):
+            continue
+        if entry.is_dir():
+            key, value = parse_partition_dir_name(entry.name)
+            if (predicate := predicates.get(key)) is None or predicate(value):
+                file_paths.extend(find_partition_files(entry.path, **predicates))
+        elif PART_FILE_MASK.match(entry.name):
+            file_paths.append(entry.path)
+    return file_paths
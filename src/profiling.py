@@ -0,0 +1,121 @@
+"""Profiling of stages and parallel tasks with cProfile and tracemalloc.
+
+Every profiled block (a stage run by the main process or a task run by a worker) dumps its cProfile stats along with
+its wall time and peak traced memory into a directory of its stage. Dumps of all workers are then merged into a single
+report listing time and memory of each worker and the top functions of each stage.
+"""
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import re
+import threading
+import tracemalloc
+from typing import Dict, Iterator, List, TextIO, Tuple
+
+from src.utils import Timer
+
+
+PROFILE_STATS_EXT = '.prof'
+PROFILE_META_EXT = '.json'
+
+_thread_state = threading.local()
+_tracing_lock = threading.Lock()
+_tracing = {'pid': None, 'blocks': 0}
+
+
+@contextlib.contextmanager
+def profiled(dump_dir_path: str, stage_name: str, worker_name: str, task_id: int = None) -> Iterator[None]:
+    """Profile the block run by the current thread and dump its stats into the stage directory (blocks nested in an
+    already profiled block are covered by the outer one)."""
+    if getattr(_thread_state, 'pid', None) == os.getpid():
+        yield
+        return
+    if (inherited_profiler := getattr(_thread_state, 'profiler', None)) is not None:
+        # forked process inherits the profiler of the thread it was forked from
+        inherited_profiler.disable()
+    profiler = cProfile.Profile()
+    _thread_state.pid, _thread_state.profiler = os.getpid(), profiler
+    _start_tracing()
+    try:
+        with Timer() as timer:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+        # traced memory is shared by all threads of the process, so the peak covers blocks run at the same time
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        _stop_tracing()
+        _thread_state.pid = _thread_state.profiler = None
+
+    stage_dir_path = os.path.join(dump_dir_path, stage_name)
+    os.makedirs(stage_dir_path, exist_ok=True)
+    dump_name = re.sub(r'\W+', '_', f'{worker_name} task {task_id}' if task_id is not None else worker_name)
+    profiler.dump_stats(os.path.join(stage_dir_path, dump_name + PROFILE_STATS_EXT))
+    with open(os.path.join(stage_dir_path, dump_name + PROFILE_META_EXT), mode='w') as file:
+        json.dump({'worker': worker_name, 'task': task_id, 'wall_time': timer.time, 'peak_memory': peak_memory}, file)
+
+
+def _start_tracing() -> None:
+    with _tracing_lock:
+        if _tracing['pid'] != os.getpid():
+            _tracing['pid'], _tracing['blocks'] = os.getpid(), 0
+        if _tracing['blocks'] == 0:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        _tracing['blocks'] += 1
+
+
+def _stop_tracing() -> None:
+    with _tracing_lock:
+        _tracing['blocks'] -= 1
+        if _tracing['blocks'] == 0:
+            tracemalloc.stop()
+
+
+def write_profile_report(dump_dir_path: str, report_file_path: str, stats_file_path: str = None, top: int = 20) -> None:
+    """Merge dumps of all stages into a text report (and optionally all stats into a single pstats file)."""
+    total_stats = None
+    with open(report_file_path, mode='w', encoding='utf8') as report_file:
+        for stage_name in sorted(os.listdir(dump_dir_path)):
+            stage_dir_path = os.path.join(dump_dir_path, stage_name)
+            dump_paths = sorted(os.path.join(stage_dir_path, f) for f in os.listdir(stage_dir_path)
+                                if f.endswith(PROFILE_STATS_EXT))
+            if not dump_paths:
+                continue
+            stats = pstats.Stats(*dump_paths)
+            metas = []
+            for dump_path in dump_paths:
+                with open(dump_path[:-len(PROFILE_STATS_EXT)] + PROFILE_META_EXT) as file:
+                    metas.append(json.load(file))
+            _write_stage_report(report_file, stage_name, metas, stats, top)
+            if total_stats is None:
+                total_stats = stats
+            else:
+                total_stats.add(stats)
+
+    if stats_file_path and total_stats is not None:
+        total_stats.dump_stats(stats_file_path)
+
+
+def _write_stage_report(report_file: TextIO, stage_name: str, metas: List[dict], stats: pstats.Stats, top: int) -> None:
+    # wall time and peak memory of each worker
+    workers: Dict[str, Tuple[int, float, int]] = dict()
+    for meta in metas:
+        blocks_num, wall_time, peak_memory = workers.get(meta['worker'], (0, 0.0, 0))
+        workers[meta['worker']] = (blocks_num + 1, wall_time + meta['wall_time'], max(peak_memory, meta['peak_memory']))
+    report_file.write(f'{stage_name}\n\n')
+    report_file.write(f'  {"worker":<40}{"blocks":>8}{"wall time [s]":>16}{"peak memory [MB]":>20}\n')
+    for worker_name, (blocks_num, wall_time, peak_memory) in sorted(workers.items()):
+        report_file.write(f'  {worker_name:<40}{blocks_num:>8}{wall_time:>16.3f}{peak_memory / 1_000_000:>20.1f}\n')
+
+    # functions taking the most time on their own (callees excluded), summed over all workers
+    report_file.write(f'\n  {"calls":>12}{"own time [s]":>16}{"cumulative [s]":>16}  function\n')
+    functions = sorted(stats.stats.items(), key=lambda x: x[1][2], reverse=True)[:top]
+    for (file_name, line_no, func_name), (_, calls_num, own_time, cumulative_time, _) in functions:
+        location = f'{os.path.basename(file_name)}:{line_no}' if line_no else file_name
+        report_file.write(f'  {calls_num:>12,}{own_time:>16.3f}{cumulative_time:>16.3f}  {func_name} ({location})\n')
+    report_file.write('\n')
@@ -0,0 +1,55 @@
+import datetime
+from typing import Any, Dict, Iterable, Optional
+
+
+class RecordFilter:
+    """Projection and predicates pushed down into log parsers, so that unwanted records are dropped (and unwanted
+    fields are skipped) while logs are being parsed.
+
+    Predicates are checked on entry fields (parser, datetime and event name), before params of the entry are extracted.
+    Records lacking a field a predicate is set for (e.g. records of parsers without event names) are dropped.
+    """
+
+    def __init__(self,
+                 fields: Iterable[str] = None,
+                 parsers: Iterable[str] = None,
+                 start: datetime.datetime = None,
+                 end: datetime.datetime = None,
+                 event_names: Iterable[str] = None):
+        self.fields = frozenset(fields) if fields else None
+        self.parsers = frozenset(parsers) if parsers else None
+        # bounds are compared with datetime strings of records (`%Y-%m-%d %H:%M:%S`), start inclusive, end exclusive
+        self.start = start.strftime('%Y-%m-%d %H:%M:%S') if start else None
+        self.end = end.strftime('%Y-%m-%d %H:%M:%S') if end else None
+        self.event_names = frozenset(event_names) if event_names else None
+
+    def accepts_parser(self, parser_name: str) -> bool:
+        return self.parsers is None or parser_name in self.parsers
+
+    def accepts_datetime(self, date_str: Optional[str]) -> bool:
+        if self.start is None and self.end is None:
+            return True
+        if date_str is None:
+            return False
+        return (self.start is None or date_str >= self.start) and (self.end is None or date_str < self.end)
+
+    def accepts_event_name(self, event_name: Optional[str]) -> bool:
+        return self.event_names is None or event_name in self.event_names
+
+    def accepts_record(self, parser_name: str, record: Dict[str, Any]) -> bool:
+        """Check all predicates against a parsed record (for parsers without predicates pushed down any further)."""
+        return (self.accepts_parser(parser_name)
+                and self.accepts_datetime(record.get('_b_datetime'))
+                and self.accepts_event_name(record.get('_e_event_name')))
+
+    def needs_fields(self, keys: Iterable[str]) -> bool:
+        """Check whether any field other than the given ones (e.g. any param) is selected."""
+        return self.fields is None or not self.fields.issubset(keys)
+
+    def __repr__(self):
+        # stable representation (log parsers built with equal filters are reused)
+        return (f'{self.__class__.__name__}('
+                f'fields={sorted(self.fields) if self.fields is not None else None}, '
+                f'parsers={sorted(self.parsers) if self.parsers is not None else None}, '
+                f'start={self.start!r}, end={self.end!r}, '
+                f'event_names={sorted(self.event_names) if self.event_names is not None else None})')
@@ -0,0 +1,128 @@
+import ast
+import pickle
+import struct
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, IO, Iterable, Iterator, Type
+
+from src.log_parsers import ParsedBatch
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class RecordFormat(ABC):
+    """Abstract class for formats of files with intermediate records (written and read as batches)."""
+    binary = True
+
+    @property
+    @abstractmethod
+    def short_name(self) -> str:
+        pass
+
+    @abstractmethod
+    def dump(self, batches: Iterable[ParsedBatch], file: IO) -> None:
+        pass
+
+    @abstractmethod
+    def load(self, file: IO) -> Iterator[ParsedBatch]:
+        pass
+
+    @property
+    def file_mode_suffix(self) -> str:
+        return 'b' if self.binary else ''
+
+    def __repr__(self):
+        return self.__class__.__name__
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class ReprRecordFormat(RecordFormat):
+    """Legacy text format with one record repr per line (loaded with `ast.literal_eval` instead of `eval`)."""
+    short_name = 'repr'
+    binary = False
+
+    def __init__(self, batch_size: int = 10_000):
+        assert int(batch_size) > 0, "Batch size has to be greater than zero."
+        self.batch_size = int(batch_size)
+
+    def dump(self, batches: Iterable[ParsedBatch], file: IO) -> None:
+        for batch in batches:
+            for record in batch.records():
+                file.write(str(record) + '\n')
+
+    def load(self, file: IO) -> Iterator[ParsedBatch]:
+        batch = ParsedBatch()
+        for line in file:
+            record = ast.literal_eval(line)
+            batch.append(record.keys(), record.values())
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = ParsedBatch()
+        if len(batch):
+            yield batch
+
+
+class FramedRecordFormat(RecordFormat, ABC):
+    """Abstract binary format storing slices of record batches as length-prefixed frames."""
+    frame_header = struct.Struct('<Q')
+
+    def __init__(self, frame_size: int = 10_000):
+        assert int(frame_size) > 0, "Frame size has to be greater than zero."
+        self.frame_size = int(frame_size)
+
+    @abstractmethod
+    def _serialize(self, batch: ParsedBatch) -> bytes:
+        pass
+
+    @abstractmethod
+    def _deserialize(self, frame: bytes) -> ParsedBatch:
+        pass
+
+    def dump(self, batches: Iterable[ParsedBatch], file: BinaryIO) -> None:
+        for batch in batches:
+            for frame_batch in batch.split(self.frame_size):
+                frame = self._serialize(frame_batch)
+                file.write(self.frame_header.pack(len(frame)))
+                file.write(frame)
+
+    def load(self, file: BinaryIO) -> Iterator[ParsedBatch]:
+        while header := file.read(self.frame_header.size):
+            (frame_length, ) = self.frame_header.unpack(header)
+            yield self._deserialize(file.read(frame_length))
+
+
+class PickleRecordFormat(FramedRecordFormat):
+    """Binary format with length-prefixed pickled batches of records (intended for trusted temporary files only)."""
+    short_name = 'pickle'
+
+    def _serialize(self, batch: ParsedBatch) -> bytes:
+        return pickle.dumps((batch.size, batch.columns), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _deserialize(self, frame: bytes) -> ParsedBatch:
+        size, columns = pickle.loads(frame)
+        return ParsedBatch(columns, size)
+
+
+class MsgpackRecordFormat(FramedRecordFormat):
+    """Binary format with length-prefixed msgpack batches of records (requires `msgpack` package)."""
+    short_name = 'msgpack'
+
+    def __init__(self, frame_size: int = 10_000):
+        assert msgpack is not None, "Msgpack record format requires `msgpack` package to be installed."
+        super().__init__(frame_size=frame_size)
+
+    def _serialize(self, batch: ParsedBatch) -> bytes:
+        return msgpack.packb((batch.size, batch.columns), use_bin_type=True)
+
+    def _deserialize(self, frame: bytes) -> ParsedBatch:
+        size, columns = msgpack.unpackb(frame, raw=False)
+        return ParsedBatch(columns, size)
+
+
+RECORD_FORMATS: Dict[str, Type[RecordFormat]] = {
+    f.short_name: f for f in (PickleRecordFormat, MsgpackRecordFormat, ReprRecordFormat)
+}
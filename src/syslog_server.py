@@ -0,0 +1,437 @@
+"""Syslog ingestion server parsing logs received over UDP and TCP in micro-batches.
+
+Received lines are gathered into batches (flushed once they reach a number of lines or a maximum age), parsed by log
+parsers in a pool of worker processes and written in the order they were received by a single writer thread into
+rolling per-parser output tables. Number of batches in flight (being parsed or written) is bounded: once the bound is
+reached, TCP connections are no longer read from (so that TCP flow control holds senders back) and UDP datagrams are
+dropped (and counted), as UDP has no flow control.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import os
+import re
+import signal
+import socket
+import time
+from abc import ABC, abstractmethod
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple, Type
+
+from src.file_parser import FileParser
+from src.log_parsers import LogParser, LogParserDispatcher, ParsedBatch
+from src.output_formats import OutputFormat, OutputTable, TsvOutputFormat
+from src.parallel_executor import DEFAULT_PROCESS_NUM, script_logger
+from src.record_filters import RecordFilter
+
+
+# priority prefix of syslog messages (log files written by syslog daemons lack it)
+PRI_REGEX = re.compile(r'^<\d{1,3}>')
+
+_worker_state = dict()
+
+
+def _init_worker(log_parsers: List[Type[LogParser]],
+                 log_parser_kwargs: dict,
+                 adaptive_parser_order: bool,
+                 record_filter: Optional[RecordFilter]
+                 ) -> None:
+    # build log parsers (and compile their regexes) once per worker process, interrupts are left to the server
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    parsers = [p(**log_parser_kwargs) for p in log_parsers]
+    for parser in parsers:
+        parser.record_filter = record_filter
+    _worker_state['dispatcher'] = LogParserDispatcher(parsers, adaptive=adaptive_parser_order)
+    _worker_state['record_filter'] = record_filter
+
+
+def _parse_lines(lines: List[bytes]) -> Tuple[Dict[str, ParsedBatch], List[str]]:
+    # return batches of records parsed by each parser (without their schemas) and stripped lines that were not parsed
+    log_entries = [PRI_REGEX.sub('', line.decode('utf8', errors='replace').strip(), count=1) for line in lines]
+    batches, unparsed = _worker_state['dispatcher'].parse_batch(log_entries)
+    record_filter = _worker_state['record_filter']
+    batches = {name: ParsedBatch(batch.columns, batch.size) for name, batch in batches.items()
+               if len(batch) and (record_filter is None or record_filter.accepts_parser(name))}
+    return batches, [log_entries[idx] for idx in unparsed]
+
+
+class RollingFile(ABC):
+    """Output file rolled over to a new one once it grows too big or too old.
+
+    Files are written under hidden names and renamed once they are complete, so that only complete files are visible.
+    """
+
+    def __init__(self, dir_path: str, name: str, ext: str, max_size: int, max_age: float):
+        self.dir_path = dir_path
+        self.name = name
+        self.ext = ext
+        self.max_size = max_size
+        self.max_age = max_age
+        self.file_path: Optional[str] = None
+        self.opened_at: Optional[float] = None
+
+    @abstractmethod
+    def _open(self, file_path: str) -> None:
+        pass
+
+    @abstractmethod
+    def _close(self) -> None:
+        pass
+
+    def open(self) -> None:
+        opened = datetime.datetime.now()
+        self.file_path = os.path.join(self.dir_path, f'syslog_{opened:%Y%m%d_%H%M%S_%f}.{self.name}{self.ext}')
+        self.opened_at = time.monotonic()
+        self._open(self._hidden_path(self.file_path))
+
+    @property
+    def is_open(self) -> bool:
+        return self.file_path is not None
+
+    def is_expired(self) -> bool:
+        if not self.is_open:
+            return False
+        return (time.monotonic() - self.opened_at >= self.max_age
+                or os.path.getsize(self._hidden_path(self.file_path)) >= self.max_size)
+
+    def roll(self) -> None:
+        """Close the current file (a new one is opened once there is something to write)."""
+        if not self.is_open:
+            return
+        self._close()
+        os.replace(self._hidden_path(self.file_path), self.file_path)
+        self.file_path = self.opened_at = None
+
+    @staticmethod
+    def _hidden_path(file_path: str) -> str:
+        dir_path, file_name = os.path.split(file_path)
+        return os.path.join(dir_path, '.' + file_name)
+
+
+class RollingTable(RollingFile):
+    """Rolling output table of a single parser, also rolled over once records bring columns the table lacks (headers
+    of each table are fixed, headers of the next one cover all columns seen so far)."""
+
+    def __init__(self,
+                 dir_path: str,
+                 name: str,
+                 output_format: OutputFormat,
+                 column_types: Dict[str, str],
+                 max_size: int,
+                 max_age: float):
+        super().__init__(dir_path, name, output_format.ext, max_size, max_age)
+        self.output_format = output_format
+        self.column_types = column_types
+        self.headers: List[str] = []
+        self.table: Optional[OutputTable] = None
+
+    def _open(self, file_path: str) -> None:
+        self.table = self.output_format.open_table(file_path, self.headers, self.column_types)
+
+    def _close(self) -> None:
+        self.table.close()
+        self.table = None
+
+    def write_batch(self, batch: ParsedBatch) -> None:
+        if not set(batch.columns).issubset(self.headers):
+            self.roll()
+            self.headers = FileParser.sort_table_headers({*self.headers, *batch.columns})
+        if not self.is_open:
+            self.open()
+        self.table.write_batch(batch)
+        self.table.flush()
+        if self.is_expired():
+            self.roll()
+
+
+class RollingLogFile(RollingFile):
+    """Rolling text file with logs that were not parsed."""
+
+    def __init__(self, dir_path: str, name: str, max_size: int, max_age: float):
+        super().__init__(dir_path, name, '.log', max_size, max_age)
+        self.file = None
+
+    def _open(self, file_path: str) -> None:
+        self.file = open(file_path, mode='w', encoding='utf8')
+
+    def _close(self) -> None:
+        self.file.close()
+        self.file = None
+
+    def write_lines(self, lines: Sequence[str]) -> None:
+        if not self.is_open:
+            self.open()
+        self.file.writelines(line + '\n' for line in lines)
+        self.file.flush()
+        if self.is_expired():
+            self.roll()
+
+
+class _SyslogDatagramProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server: 'SyslogServer'):
+        self.server = server
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        self.server._receive_datagram(data)
+
+
+class SyslogServer:
+    """Asyncio syslog server (RFC 3164 messages over UDP, newline delimited messages over TCP) parsing received logs
+    with log parsers and writing them into rolling output tables, while tracking latency from receiving each line to
+    writing its record (or the line itself, if it was not parsed)."""
+    unparsed_short_name = FileParser.unparsed_short_name
+    udp_receive_buffer_size = 4 * 1024 * 1024  # bursts of datagrams overflowing the buffer are lost (capped by the os)
+
+    def __init__(self,
+                 log_parsers: List[Type[LogParser]],
+                 out_dir_path: str,
+                 udp_address: Tuple[str, int] = None,
+                 tcp_address: Tuple[str, int] = None,
+                 max_processes: int = DEFAULT_PROCESS_NUM,
+                 batch_size: int = 10_000,
+                 batch_interval: float = 1.0,
+                 max_pending_batches: int = None,
+                 roll_size: int = 100_000_000,  # ~100MB
+                 roll_interval: float = 3600.0,
+                 output_format: Type[OutputFormat] = TsvOutputFormat,
+                 log_parser_kwargs: dict = None,
+                 adaptive_parser_order: bool = True,
+                 record_filter: RecordFilter = None,
+                 report_interval: float = 10.0,
+                 latency_window: int = 1_000_000):
+        assert udp_address is not None or tcp_address is not None, "Server has to listen on UDP or TCP address."
+        assert int(max_processes) > 0, "Max number of processes has to be greater than zero."
+        assert int(batch_size) > 0, "Batch size has to be greater than zero."
+        assert batch_interval > 0, "Batch interval has to be greater than zero."
+        assert max_pending_batches is None or int(max_pending_batches) > 0, \
+            "Max number of pending batches has to be greater than zero."
+        self.log = script_logger
+        self.log_parsers = log_parsers
+        self.out_dir_path = out_dir_path
+        self.udp_address = udp_address
+        self.tcp_address = tcp_address
+        self.max_processes = int(max_processes)
+        self.batch_size = int(batch_size)
+        self.batch_interval = batch_interval
+        # by default every worker process has a batch to parse and another one waiting
+        self.max_pending_batches = int(max_pending_batches or 2 * self.max_processes)
+        self.roll_size = roll_size
+        self.roll_interval = roll_interval
+        self.output_format = output_format
+        self.log_parser_kwargs = log_parser_kwargs or dict()
+        self.adaptive_parser_order = adaptive_parser_order
+        self.record_filter = record_filter
+        self.report_interval = report_interval
+
+        self.stats = {'received': 0, 'parsed': 0, 'unparsed': 0, 'dropped': 0, 'lost': 0}
+        self.latencies: Deque[float] = collections.deque(maxlen=latency_window)  # seconds, of the latest lines
+        self._report_latencies: List[float] = []
+        self._lines: List[bytes] = []
+        self._received_at: List[float] = []
+        self._stopped: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pending: Optional[asyncio.Queue] = None
+        self._pool: Optional[concurrent.futures.Executor] = None
+        self._producers: Set[asyncio.Task] = set()  # tasks of connections and of batches being submitted
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._outputs: Dict[str, RollingFile] = dict()
+
+    def stop(self) -> None:
+        """Stop receiving logs, write out those already received and return from `serve` (has to be called from the
+        thread running the event loop, e.g. with `loop.call_soon_threadsafe`)."""
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def serve(self) -> None:
+        """Receive, parse and write logs until the server is stopped."""
+        loop = asyncio.get_running_loop()
+        os.makedirs(self.out_dir_path, exist_ok=True)
+        self._stopped = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_pending_batches)
+        self._pending = asyncio.Queue()
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_processes,
+            initializer=_init_worker,
+            initargs=(self.log_parsers, self.log_parser_kwargs, self.adaptive_parser_order, self.record_filter)
+        )
+        writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='Writer')
+        udp_transport = tcp_server = None
+        try:
+            if self.udp_address is not None:
+                udp_transport, _ = await loop.create_datagram_endpoint(lambda: _SyslogDatagramProtocol(self),
+                                                                       local_addr=self.udp_address)
+                udp_transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                                                  self.udp_receive_buffer_size)
+                self.udp_address = udp_transport.get_extra_info('sockname')[:2]
+                self.log.info(f'(syslog server) Listening on udp {self.udp_address[0]}:{self.udp_address[1]}')
+            if self.tcp_address is not None:
+                tcp_server = await asyncio.start_server(self._serve_connection, *self.tcp_address)
+                self.tcp_address = tcp_server.sockets[0].getsockname()[:2]
+                self.log.info(f'(syslog server) Listening on tcp {self.tcp_address[0]}:{self.tcp_address[1]}')
+
+            writing = asyncio.create_task(self._write_batches(writer))
+            flushing = asyncio.create_task(self._flush_batches(writer))
+            reporting = asyncio.create_task(self._report_periodically())
+            await self._stopped.wait()
+
+            # stop receiving, then write out the lines received so far
+            self.log.info('(syslog server) Stopping')
+            if udp_transport is not None:
+                udp_transport.close()
+            if tcp_server is not None:
+                tcp_server.close()
+            for connection in list(self._connections):
+                connection.close()
+            await flushing
+            while self._producers:
+                await asyncio.gather(*self._producers)
+            await self._flush()
+            self._pending.put_nowait(None)
+            await writing
+            reporting.cancel()
+        finally:
+            if udp_transport is not None:
+                udp_transport.close()
+            if tcp_server is not None:
+                tcp_server.close()
+            await loop.run_in_executor(writer, self._close_outputs)
+            writer.shutdown()
+            self._pool.shutdown(cancel_futures=True)
+        self._report(self.latencies, 'total')
+
+    def _receive(self, lines: List[bytes]) -> bool:
+        # add lines to the current batch and return whether it is full
+        received_at = time.monotonic()
+        self._lines.extend(lines)
+        self._received_at.extend([received_at] * len(lines))
+        self.stats['received'] += len(lines)
+        return len(self._lines) >= self.batch_size
+
+    def _take_batch(self) -> Tuple[List[bytes], List[float]]:
+        lines, received_at = self._lines, self._received_at
+        self._lines, self._received_at = [], []
+        return lines, received_at
+
+    def _receive_datagram(self, data: bytes) -> None:
+        # each datagram carries a single message, but may carry more lines
+        if not self._receive([line for line in data.splitlines() if line.strip()]):
+            return
+        lines, received_at = self._take_batch()
+        if self._slots.locked():
+            # udp senders cannot be held back
+            self.stats['dropped'] += len(lines)
+            return
+        task = asyncio.create_task(self._submit(lines, received_at))
+        self._producers.add(task)
+        task.add_done_callback(self._producers.discard)
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        task = asyncio.current_task()
+        self._producers.add(task)
+        self._connections.add(writer)
+        self.log.debug(f'(syslog server) Connection from {peer}')
+        rest = b''
+        try:
+            while data := await reader.read(1 << 16):
+                *lines, rest = (rest + data).split(b'\n')
+                if self._receive([line for line in lines if line.strip()]):
+                    # connection is not read from until the batch is submitted
+                    await self._flush()
+            if rest.strip():
+                self._receive([rest])
+        except ConnectionError as e:
+            self.log.warning(f'(syslog server) Connection from {peer} lost: {repr(e)}')
+        finally:
+            writer.close()
+            self._connections.discard(writer)
+            self._producers.discard(task)
+
+    async def _flush(self) -> None:
+        lines, received_at = self._take_batch()
+        if lines:
+            await self._submit(lines, received_at)
+
+    async def _submit(self, lines: List[bytes], received_at: List[float]) -> None:
+        # wait for a free slot, then have the batch parsed (it is written once all batches before it are written)
+        await self._slots.acquire()
+        parsing = asyncio.get_running_loop().run_in_executor(self._pool, _parse_lines, lines)
+        self._pending.put_nowait((parsing, received_at))
+
+    async def _flush_batches(self, writer: concurrent.futures.Executor) -> None:
+        # flush batches older than the batch interval and roll over outputs that got too old in the meantime
+        loop = asyncio.get_running_loop()
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.batch_interval / 4)
+            except asyncio.TimeoutError:
+                pass
+            if self._received_at and time.monotonic() - self._received_at[0] >= self.batch_interval:
+                await self._flush()
+            else:
+                await loop.run_in_executor(writer, self._roll_expired_outputs)
+
+    async def _write_batches(self, writer: concurrent.futures.Executor) -> None:
+        loop = asyncio.get_running_loop()
+        while (pending := await self._pending.get()) is not None:
+            parsing, received_at = pending
+            try:
+                batches, unparsed = await parsing
+                await loop.run_in_executor(writer, self._write_outputs, batches, unparsed)
+            except Exception as e:
+                self.stats['lost'] += len(received_at)
+                self.log.error(f'(syslog server) Batch of {len(received_at)} lines lost: {repr(e)}', exc_info=True)
+            else:
+                written_at = time.monotonic()
+                latencies = [written_at - t for t in received_at]
+                self.latencies.extend(latencies)
+                self._report_latencies.extend(latencies)
+                self.stats['parsed'] += sum(len(b) for b in batches.values())
+                self.stats['unparsed'] += len(unparsed)
+            finally:
+                self._slots.release()
+
+    def _write_outputs(self, batches: Dict[str, ParsedBatch], unparsed: List[str]) -> None:
+        for parser_name, batch in batches.items():
+            if (output := self._outputs.get(parser_name)) is None:
+                parser = next(p for p in self.log_parsers if p.short_name == parser_name)
+                output = self._outputs[parser_name] = RollingTable(self.out_dir_path, parser_name, self.output_format(),
+                                                                   parser.column_types, self.roll_size,
+                                                                   self.roll_interval)
+            output.write_batch(batch)
+        if unparsed:
+            if (output := self._outputs.get(self.unparsed_short_name)) is None:
+                output = self._outputs[self.unparsed_short_name] = RollingLogFile(
+                    self.out_dir_path, self.unparsed_short_name, self.roll_size, self.roll_interval)
+            output.write_lines(unparsed)
+
+    def _roll_expired_outputs(self) -> None:
+        for output in self._outputs.values():
+            if output.is_expired():
+                output.roll()
+
+    def _close_outputs(self) -> None:
+        for output in self._outputs.values():
+            output.roll()
+
+    async def _report_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            latencies, self._report_latencies = self._report_latencies, []
+            self._report(latencies, f'last {self.report_interval:g}s')
+
+    def _report(self, latencies: Sequence[float], period: str) -> None:
+        stats = ', '.join(f'{v:,} {k}' for k, v in self.stats.items())
+        if latencies:
+            percentiles = self.get_percentiles(latencies)
+            stats += ', latency ' + ' '.join(f'{k} {v * 1000:,.1f}ms' for k, v in percentiles.items())
+        self.log.info(f'(syslog server) Lines so far: {stats} ({period})')
+
+    @staticmethod
+    def get_percentiles(values: Sequence[float], percentiles: Sequence[int] = (50, 90, 99)) -> Dict[str, float]:
+        """Return chosen percentiles (nearest-rank) and the max of the values."""
+        values = sorted(values)
+        result = {f'p{p}': values[max(0, -(-len(values) * p // 100) - 1)] for p in percentiles}
+        result['max'] = values[-1]
+        return result
@@ -0,0 +1,64 @@
+import bisect
+import json
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class TableIndex:
+    """Sparse index of a table sorted by one of its columns, saved next to the table as a sidecar file.
+
+    Index holds the key of the first row of every block of rows along with the position of the block, which is the byte
+    offset of its first row in tsv tables and the number of its row group in parquet tables.
+    """
+    ext = '.index.json'
+
+    def __init__(self,
+                 column: str,
+                 column_type: str = 'string',
+                 interval: int = 10_000,
+                 entries: List[Tuple[Any, int]] = None):
+        assert int(interval) > 0, "Index interval has to be greater than zero."
+        self.column = column
+        self.column_type = column_type
+        self.interval = int(interval)
+        self.keys: List[Any] = [k for k, _ in entries] if entries else []
+        self.positions: List[int] = [p for _, p in entries] if entries else []
+        self.key = self.get_key_func(column_type)
+
+    @staticmethod
+    def get_key_func(column_type: str) -> Callable[[Any], Any]:
+        """Return function normalizing values of the column into sort keys (values of tsv tables are read back as
+        strings), sorting rows lacking the value first."""
+        if column_type == 'int64':
+            return lambda value: int(value) if value not in (None, '') else -1
+        return lambda value: str(value) if value is not None else ''
+
+    def add(self, key: Any, position: int) -> None:
+        self.keys.append(key)
+        self.positions.append(position)
+
+    def extend(self, index: 'TableIndex', shift: int = 0) -> None:
+        """Add entries of an index of a table appended to the indexed one, shifting their positions."""
+        self.keys.extend(index.keys)
+        self.positions.extend(p + shift for p in index.positions)
+
+    def find(self, key: Any) -> Optional[int]:
+        """Return position of the block the first row with a key equal to or greater than the given one may be in
+        (none if it is the first block)."""
+        idx = bisect.bisect_left(self.keys, key) - 1
+        return self.positions[idx] if idx >= 0 else None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def save(self, file_path: str) -> None:
+        with open(file_path, mode='w', encoding='utf8') as file:
+            json.dump({'column': self.column,
+                       'column_type': self.column_type,
+                       'interval': self.interval,
+                       'entries': list(zip(self.keys, self.positions))}, file)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'TableIndex':
+        with open(file_path, encoding='utf8') as file:
+            index = json.load(file)
+        return cls(index['column'], index['column_type'], index['interval'], [tuple(e) for e in index['entries']])
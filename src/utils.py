@@ -1,8 +1,12 @@
 import csv
+import errno
 import logging
 import pandas as pd
+import os
+import shutil
 import sys
 import time
+from typing import Any, BinaryIO, Iterator, List, TextIO, Tuple
 
 
 class Timer:
@@ -66,6 +70,25 @@ def df2tsv(df: pd.DataFrame, dst_file_path: str, **kwargs) -> None:
     )
 
 
+def df2parquet(df: pd.DataFrame, dst_file_path: str, **kwargs) -> None:
+    df.to_parquet(
+        path=dst_file_path,
+        index=False,
+        compression='snappy',
+        **kwargs
+    )
+
+
+def tsv_writer(file: TextIO) -> Any:
+    """Return csv writer producing rows in the same tsv format as `df2tsv`."""
+    return csv.writer(file, delimiter='\t', quoting=csv.QUOTE_ALL, quotechar='"', lineterminator='\n')
+
+
+def tsv_reader(file: TextIO) -> Iterator[List[str]]:
+    """Return csv reader of rows in the tsv format produced by `df2tsv`."""
+    return csv.reader(file, delimiter='\t', quoting=csv.QUOTE_ALL, quotechar='"')
+
+
 def tsv2df(src_file_path: str, **kwargs) -> pd.DataFrame:
     return pd.read_csv(
         filepath_or_buffer=src_file_path,
@@ -78,3 +101,89 @@ def tsv2df(src_file_path: str, **kwargs) -> pd.DataFrame:
         low_memory=False,
         **kwargs
     )
+
+
+def plan_file_ranges(file_path: str,
+                     chunk_byte_size: int,
+                     offset: int = 0,
+                     length: int = None
+                     ) -> List[Tuple[int, int]]:
+    """Split file (or its newline aligned byte range) into newline aligned (offset, length) byte ranges of roughly
+    the given size."""
+    assert int(chunk_byte_size) > 0, "Chunk size has to be greater than zero."
+    end = os.path.getsize(file_path) if length is None else offset + length
+
+    ranges = []
+    with open(file_path, mode='rb') as file:
+        range_start = offset
+        while range_start < end:
+            # jump to the nominal end of the range and move forward to the end of the line
+            file.seek(min(range_start + chunk_byte_size, end) - 1)
+            file.readline()
+            range_end = min(file.tell(), end)
+            ranges.append((range_start, range_end - range_start))
+            range_start = range_end
+
+    return ranges
+
+
+def find_last_line_end(file_path: str, offset: int = 0, end: int = None, block_size: int = 65_536) -> int:
+    """Return position right after the last newline within the byte range (or the offset if there is none)."""
+    end = os.path.getsize(file_path) if end is None else end
+    with open(file_path, mode='rb') as file:
+        block_end = end
+        while block_end > offset:
+            block_start = max(block_end - block_size, offset)
+            file.seek(block_start)
+            if (idx := file.read(block_end - block_start).rfind(b'\n')) != -1:
+                return block_start + idx + 1
+            block_end = block_start
+    return offset
+
+
+def read_file_range(file_path: str, offset: int = 0, length: int = None, encoding: str = 'utf8') -> Iterator[str]:
+    """Iterate over decoded lines of the file within specified byte range."""
+    with open(file_path, mode='rb') as file:
+        file.seek(offset)
+        remaining = length if length is not None else os.path.getsize(file_path) - offset
+        while remaining > 0 and (line := file.readline()):
+            remaining -= len(line)
+            yield line.decode(encoding, errors='replace')
+
+
+def copy_file_data(src_file: BinaryIO, dst_file: BinaryIO, block_size: int = 1 << 30) -> int:
+    """Copy the rest of the source file into the destination file at its current position, within the kernel if the
+    platform allows it (`copy_file_range` or `sendfile`), return number of copied bytes."""
+    dst_file.flush()
+    src_offset, dst_offset = src_file.tell(), dst_file.tell()
+    length = os.fstat(src_file.fileno()).st_size - src_offset
+    src_fd, dst_fd = src_file.fileno(), dst_file.fileno()
+
+    copied = 0
+    for copy_method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, copy_method):
+            continue
+        try:
+            while copied < length:
+                count = min(block_size, length - copied)
+                if copy_method == 'copy_file_range':
+                    copied_now = os.copy_file_range(src_fd, dst_fd, count, src_offset + copied, dst_offset + copied)
+                else:
+                    os.lseek(dst_fd, dst_offset + copied, os.SEEK_SET)
+                    copied_now = os.sendfile(dst_fd, src_fd, src_offset + copied, count)
+                if copied_now == 0:
+                    break
+                copied += copied_now
+            break
+        except OSError as e:
+            # e.g. files on different file systems (older kernels), append mode or not supported by the file system
+            if e.errno not in (errno.EXDEV, errno.EINVAL, errno.EBADF, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+
+    # copy whatever could not be copied within the kernel through user space buffers
+    src_file.seek(src_offset + copied)
+    dst_file.seek(dst_offset + copied)
+    if copied < length:
+        shutil.copyfileobj(src_file, dst_file)
+        copied = length
+    return copied